@@ -1,15 +1,47 @@
+import logging
 import os
 
-from flask import Flask, render_template, request, flash, redirect, session, g, abort, jsonify
+from flask import (Flask, Response, render_template, request, flash, redirect, session, g,
+                   abort, jsonify)
 from flask_debugtoolbar import DebugToolbarExtension
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
 
 from forms import UserAddForm, UserEditForm, LoginForm, MessageForm
-from models import db, connect_db, User, Message
+from models import db, connect_db, User, Message, Likes
+import timeline
+import feeds
+import migrations
+import counters
+from like_buffer import like_buffer
+from pagination import decode_cursor
+import instrumentation
+import user_search
+import message_search
+import trending
+import identity
+import http_cache
+import assets
+import fragment_cache
+import replicas
+from http_cache import conditional
+from page_cache import page_cache
+from pubsub import broker, message_channel, publish_message
+from trending import trends
+from replicas import read_only
+from passwords import passwords, PasswordHasherBusy
+from identity import CURR_USER_VERSION_KEY
 from os import environ
 from dotenv import load_dotenv
 
 CURR_USER_KEY = "curr_user"
+MESSAGES_PER_PAGE = 100
+USERS_PER_PAGE = 60
+TYPEAHEAD_LIMIT = 10
+SEARCH_RESULTS_PER_PAGE = 20
+TRENDING_LIMIT = 10
+
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
@@ -18,9 +50,25 @@ load_dotenv()
 # if not set there, use development local db.
 app.config['SQLALCHEMY_DATABASE_URI'] = environ.get('DATABASE_URL', 'postgresql:///warbler')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SQLALCHEMY_ECHO'] = True
+# Comma-separated read replicas for read-only pages (see replicas.py)
+app.config['SQLALCHEMY_REPLICA_URIS'] = [
+    uri for uri in environ.get('DATABASE_REPLICA_URLS', '').split(',') if uri]
+# Set SQLALCHEMY_ECHO=1 to log every statement; per-request query counts and
+# slow queries are always recorded (see instrumentation.py)
+app.config['SQLALCHEMY_ECHO'] = environ.get('SQLALCHEMY_ECHO') == '1'
+app.config['SQL_SLOW_QUERY_MS'] = int(environ.get('SQL_SLOW_QUERY_MS', 100))
+app.config['INTERNAL_METRICS_TOKEN'] = environ.get('INTERNAL_METRICS_TOKEN')
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
 app.config['SECRET_KEY'] = environ.get('SECRET_KEY', "SECRET28937423")
+# bcrypt cost is calibrated to BCRYPT_TARGET_MS at startup unless pinned
+# with BCRYPT_LOG_ROUNDS (see passwords.py)
+if 'BCRYPT_LOG_ROUNDS' in environ:
+    app.config['BCRYPT_LOG_ROUNDS'] = int(environ['BCRYPT_LOG_ROUNDS'])
+app.config['BCRYPT_TARGET_MS'] = int(environ.get('BCRYPT_TARGET_MS', 250))
+# Where rendered message fragments are cached (see fragment_cache.py)
+app.config['FRAGMENT_CACHE_URL'] = environ.get('FRAGMENT_CACHE_URL', 'memory://')
+# How live updates reach other workers' streams (see pubsub.py)
+app.config['PUBSUB_URL'] = environ.get('PUBSUB_URL', 'memory://')
 
 # app.config['SQLALCHEMY_DATABASE_URI'] = (
 #     os.environ.get('DATABASE_URL', 'postgresql:///warbler'))
@@ -30,7 +78,19 @@ app.config['SECRET_KEY'] = environ.get('SECRET_KEY', "SECRET28937423")
 # app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
 toolbar = DebugToolbarExtension(app)
 
+passwords.init_app(app)
 connect_db(app)
+like_buffer.init_app(app)
+instrumentation.init_app(app)
+identity.init_app(app)
+http_cache.init_app(app)
+assets.init_app(app)
+fragment_cache.init_app(app)
+# (first of the request hooks below: a cached page skips all of them)
+page_cache.init_app(app)
+replicas.init_app(app)
+broker.init_app(app)
+trends.init_app(app)
 
 
 ##############################################################################
@@ -42,16 +102,29 @@ def add_user_to_g():
     """If we're logged in, add curr user to Flask global."""
 
     if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
+        # A cached snapshot of the user; the full User loads only if needed.
+        # (Writes also make sure the user hasn't been deleted meanwhile.)
+        g.user = identity.load(session[CURR_USER_KEY],
+                               session.get(CURR_USER_VERSION_KEY),
+                               verify=request.method not in ('GET', 'HEAD'))
 
     else:
         g.user = None
 
 
+@app.errorhandler(PasswordHasherBusy)
+def password_hasher_busy(error):
+    """Ask clients to come back when too many logins are already waiting."""
+
+    return ("Too many people are signing in right now; please try again.",
+            503, {'Retry-After': '1'})
+
+
 def do_login(user):
     """Log in user."""
 
     session[CURR_USER_KEY] = user.id
+    session[CURR_USER_VERSION_KEY] = user.version
 
 
 def do_logout():
@@ -59,6 +132,7 @@ def do_logout():
 
     if CURR_USER_KEY in session:
         del session[CURR_USER_KEY]
+    session.pop(CURR_USER_VERSION_KEY, None)
 
 
 @app.route('/signup', methods=["GET", "POST"])
@@ -107,6 +181,8 @@ def login():
         user = User.authenticate(form.username.data,form.password.data)
 
         if user:
+            # Save the password hash if authenticate upgraded it
+            db.session.commit()
             do_login(user)
             flash(f"Hello, {user.username}!", "success")
             return redirect("/")
@@ -128,23 +204,26 @@ def logout():
 # General user routes:
 
 @app.route('/users')
+@read_only
 def list_users():
     """Page with listing of users.
 
     Can take a 'q' param in querystring to search by that username.
     """
 
-    search = request.args.get('q')
+    search = request.args.get('q', '')
 
-    if not search:
-        users = User.query.all()
-    else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
+    users, next_cursor = user_search.search(
+        search, after=get_search_cursor(), per_page=USERS_PER_PAGE)
 
-    return render_template('users/index.html', users=users)
+    return render_template('users/index.html', users=users, search=search,
+                           next_cursor=next_cursor)
 
 
 @app.route('/users/<int:user_id>')
+@read_only
+@page_cache.cached('user:{user_id}')
+@conditional(http_cache.profile_stamp)
 def users_show(user_id):
     """Show user profile."""
 
@@ -152,16 +231,14 @@ def users_show(user_id):
 
     # snagging messages in order from the database;
     # user.messages won't be in order by default
-    messages = (Message
-                .query
-                .filter(Message.user_id == user_id)
-                .order_by(Message.timestamp.desc())
-                .limit(100)
-                .all())
-    return render_template('users/show.html', user=user, messages=messages)
+    messages, next_cursor = feeds.user_feed(user_id, before=get_before_cursor(),
+                                            per_page=MESSAGES_PER_PAGE)
+    return render_template('users/show.html', user=user, messages=messages,
+                           next_cursor=next_cursor)
 
 
 @app.route('/users/<int:user_id>/following')
+@read_only
 def show_following(user_id):
     """Show list of people this user is following."""
 
@@ -174,6 +251,7 @@ def show_following(user_id):
 
 
 @app.route('/users/<int:user_id>/followers')
+@read_only
 def users_followers(user_id):
     """Show list of followers of this user."""
 
@@ -194,7 +272,12 @@ def add_follow(follow_id):
         return redirect("/")
 
     followed_user = User.query.get_or_404(follow_id)
+    # Users see their own messages anyway; they can't follow themselves
+    if followed_user.id == g.user.id:
+        return abort(403)
+
     g.user.following.append(followed_user)
+    timeline.follow(g.user.id, followed_user.id)
     db.session.commit()
 
     return redirect(f"/users/{g.user.id}/following")
@@ -210,11 +293,13 @@ def stop_following(follow_id):
 
     followed_user = User.query.get(follow_id)
     g.user.following.remove(followed_user)
+    timeline.unfollow(g.user.id, followed_user.id)
     db.session.commit()
 
     return redirect(f"/users/{g.user.id}/following")
 
 @app.route('/users/<int:user_id>/likes', methods=["GET"])
+@read_only
 def show_likes(user_id):
     """Show the users liked messages!"""
     if not g.user:
@@ -222,7 +307,31 @@ def show_likes(user_id):
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
-    return render_template('users/likes.html', user=user, likes=user.likes)
+
+    # Load the liked messages and their authors together, rather than one
+    # query for the likes and then one per author
+    likes = (Message
+             .query
+             .join(Likes, Likes.message_id == Message.id)
+             .filter(Likes.user_id == user_id)
+             .options(joinedload(Message.user))
+             .order_by(Message.timestamp.desc(), Message.id.desc())
+             .all())
+
+    return render_template('users/likes.html', user=user, likes=likes)
+
+@app.route('/users/<int:user_id>/mentions')
+@read_only
+def show_mentions(user_id):
+    """Show the messages that @mention a user."""
+
+    user = User.query.get_or_404(user_id)
+
+    messages, next_cursor = feeds.mentions_feed(user_id, before=get_before_cursor(),
+                                                per_page=MESSAGES_PER_PAGE)
+
+    return render_template('users/mentions.html', user=user, messages=messages,
+                           next_cursor=next_cursor)
 
 @app.route('/users/profile', methods=["GET", "POST"])
 def profile():
@@ -233,7 +342,7 @@ def profile():
         return redirect("/")
     #print(g.user)
     
-    user = g.user
+    user = g.user.model
     form = UserEditForm(obj=user)
     
     if form.validate_on_submit():
@@ -246,8 +355,12 @@ def profile():
             user.image_url = form.image_url.data or "/static/images/default-pic.png"
             user.header_image_url = form.header_image_url.data or "/static/images/warbler-hero.jpg"
             user.bio = form.bio.data
+            user.version = User.version + 1
+            # (followers' home pages show the new name and picture)
+            timeline.author_changed(user.id)
 
             db.session.commit()
+            session[CURR_USER_VERSION_KEY] = user.version
             flash("Profile edited successfully!", 'success')
             return redirect(f"/users/{user.id}")
 
@@ -266,7 +379,7 @@ def delete_user():
 
     do_logout()
 
-    db.session.delete(g.user)
+    db.session.delete(g.user.model)
     db.session.commit()
 
     return redirect("/signup")
@@ -291,49 +404,65 @@ def messages_add():
     if form.validate_on_submit():
         msg = Message(text=form.text.data)
         g.user.messages.append(msg)
+        db.session.flush()
+        timeline.fan_out(msg)
+        mentioned_ids = trending.add_mentions(msg)
         db.session.commit()
 
+        # The message is saved: trends and live streams are best-effort, and
+        # failing here would only get it posted twice
+        try:
+            trends.count(msg.text, mentioned_ids)
+            # Followers with the home page open get it straight away
+            publish_message(msg)
+        except Exception:
+            logger.exception("Failed to publish message %s", msg.id)
+
         return redirect(f"/users/{g.user.id}")
 
     return render_template('messages/new.html', form=form)
 
 
 @app.route('/messages/<int:message_id>', methods=["GET"])
+@read_only
+@page_cache.cached('message:{message_id}')
+@conditional(http_cache.message_stamp)
 def messages_show(message_id):
     """Show a message."""
 
-    msg = Message.query.get(message_id)
+    msg = Message.query.options(joinedload(Message.user)).get_or_404(message_id)
+    page_cache.tag(f'user:{msg.user_id}')
     return render_template('messages/show.html', message=msg)
 
 @app.route('/messages/<int:message_id>/like', methods=["POST"])
 def messages_like(message_id):
     """Like a message based on id."""
 
-    # if not g.user:
-    #     flash("Access unauthorized.", "danger")
-    #     return redirect("/")
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
 
     message = Message.query.get_or_404(message_id)
     # Make sure htye aren't liking their own post!
     if message.user_id == g.user.id:
         return abort(403)
 
-    if g.user.has_liked_message(message):
-        # print(f'*************************************')
-        # print(f'{g.user} has like message {message.id} already, time to unlike')
-        # print(f'*************************************')
-        g.user.unlike_message(message)
-        liked = False
-    else:
-        # print(f'*************************************')
-        # print(f'{g.user} has not like message {message.id} , time to like')
-        # print(f'*************************************')
-        g.user.like_message(message)
-        liked = True
+    # The click goes into the like buffer (see like_buffer.py) rather than
+    # straight to the database, so toggle whatever state the user last saw
+    liked_in_db = message.id in g.user.like_states([message.id])
+    was_liked = message.id in like_buffer.overlay(
+        g.user.id, {message.id} if liked_in_db else set(), [message.id])
+    liked = not was_liked
 
-    db.session.commit()
+    like_buffer.set(g.user.id, message.id, liked)
+    # (other users' unflushed clicks aren't counted until they're written)
+    likes_count = message.likes_count + int(liked) - int(liked_in_db)
+
+    if like_buffer.is_due():
+        like_buffer.flush()
+        db.session.commit()
 
-    return jsonify({'liked': liked}) # Return true or false
+    return jsonify({'liked': liked, 'likes_count': likes_count}) # Return true or false
 
 
     # # Get current users likes
@@ -366,17 +495,45 @@ def messages_destroy(message_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
+    timeline.remove_message(msg)
     db.session.delete(msg)
     db.session.commit()
 
     return redirect(f"/users/{g.user.id}")
 
 
+@app.route('/search')
+@read_only
+def messages_search():
+    """Search messages by text.
+
+    Takes `?q=`, and optionally `?author=<user id>` or `?following=1` (only
+    messages by people the current user follows).
+    """
+
+    if request.args.get('following') and not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    search = get_message_search()
+    messages, next_cursor = message_search.search(
+        **search, per_page=SEARCH_RESULTS_PER_PAGE)
+
+    likes = liked_message_ids(msg.id for msg in messages) if g.user else set()
+
+    return render_template('messages/search.html', messages=messages, likes=likes,
+                           search=search, next_cursor=next_cursor,
+                           max_candidates=message_search.MAX_CANDIDATES)
+
+
 ##############################################################################
 # Homepage and error pages
 
 
 @app.route('/')
+@read_only
+@page_cache.cached()
+@conditional(http_cache.timeline_stamp)
 def homepage():
     """Show homepage:
 
@@ -385,43 +542,321 @@ def homepage():
     """
 
     if g.user:
-        # Iterates over g.user.following (list of users that the current user is following) and create a new list with the id attribute of each user. 
-        following_filter = [follower.id for follower in g.user.following]
-        # Add global users id to this list so their tweets appear also, derp!
-        following_filter.append(g.user.id)
-
         user_id = g.user.id # Using this for conditional logic in the template, not sure if I even need to assign it or I can just call g.user in the template.
 
-        # Need to filter out list that we make
-        messages = (Message
-                    .query # filter by our list!
-                    .filter(Message.user_id.in_(following_filter))
-                    .order_by(Message.timestamp.desc())
-                    .limit(100)
-                    .all())
+        # Our own messages and the ones from everyone we follow are already
+        # fanned out into our timeline when they're posted
+        # (read as plain rows rather than ORM objects; see feeds.py)
+        messages, next_cursor = feeds.home_feed(
+            g.user.id, before=get_before_cursor(), per_page=MESSAGES_PER_PAGE)
 
-        # Get all of the msg id's that the user has liked
-        liked_msgs = [msg.id for msg in g.user.likes]
+        # Get the id's of the messages on this page that the user has liked
+        liked_msgs = liked_message_ids(msg.id for msg in messages)
 
-        return render_template('home.html', messages=messages, likes=liked_msgs, user_id=user_id)
+        return render_template('home.html', messages=messages, likes=liked_msgs,
+                               user_id=user_id, next_cursor=next_cursor)
 
     else:
         return render_template('home-anon.html')
 
 
 ##############################################################################
-# Turn off all caching in Flask
-#   (useful for dev; in production, this kind of stuff is typically
-#   handled elsewhere)
-#
-# https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
-
-@app.after_request
-def add_header(req):
-    """Add non-caching headers on every request."""
-
-    req.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    req.headers["Pragma"] = "no-cache"
-    req.headers["Expires"] = "0"
-    req.headers['Cache-Control'] = 'public, max-age=0'
-    return req
+# JSON API routes (used by static/scripts/app.js for infinite scroll)
+
+
+def liked_message_ids(message_ids):
+    """Get which of `message_ids` the current user has liked.
+
+    Counts likes/unlikes still waiting in the like buffer, so users always
+    see their own clicks.
+    """
+
+    message_ids = list(message_ids)
+    return like_buffer.overlay(g.user.id, g.user.like_states(message_ids), message_ids)
+
+
+def get_before_cursor():
+    """Get the `before` pagination cursor from the query string.
+
+    Responds with a 400 if the cursor is malformed.
+    """
+
+    before = request.args.get('before')
+
+    if before:
+        try:
+            decode_cursor(before)
+        except ValueError:
+            abort(400)
+
+    return before
+
+
+def get_search_cursor():
+    """Get the `after` user search cursor from the query string.
+
+    Responds with a 400 if the cursor is malformed.
+    """
+
+    after = request.args.get('after')
+
+    if after:
+        try:
+            user_search.decode_cursor(after)
+        except ValueError:
+            abort(400)
+
+    return after
+
+
+def get_message_search():
+    """Get the `message_search.search` arguments from the query string.
+
+    Responds with a 400 if the cursor is malformed.
+    """
+
+    after = request.args.get('after')
+
+    if after:
+        try:
+            message_search.decode_cursor(after)
+        except ValueError:
+            abort(400)
+
+    return {
+        'q': request.args.get('q', ''),
+        'author_id': request.args.get('author', type=int),
+        'follower_id': g.user.id if g.user and request.args.get('following') else None,
+        'after': after,
+    }
+
+
+def get_per_page(default=MESSAGES_PER_PAGE):
+    """Get the page size from the query string, capped at MESSAGES_PER_PAGE."""
+
+    per_page = request.args.get('limit', default, type=int)
+    return max(1, min(per_page, MESSAGES_PER_PAGE))
+
+
+def serialize_messages(messages):
+    """Serialize feed messages for the current user, saying which they've liked."""
+
+    liked_msgs = liked_message_ids(msg.id for msg in messages) if g.user else set()
+
+    serialized = []
+    for msg in messages:
+        data = msg.serialize()
+        # Only say whether it's liked if the current user can like it
+        if g.user and msg.user_id != g.user.id:
+            data['liked'] = msg.id in liked_msgs
+        serialized.append(data)
+
+    return serialized
+
+
+@app.route('/api/timeline')
+@read_only
+@conditional(http_cache.timeline_stamp)
+def api_timeline():
+    """Get a page of the current user's home timeline as JSON."""
+
+    if not g.user:
+        return jsonify({'error': 'Access unauthorized.'}), 401
+
+    messages, next_cursor = feeds.home_feed(
+        g.user.id, before=get_before_cursor(), per_page=get_per_page())
+
+    return jsonify({'messages': serialize_messages(messages), 'next': next_cursor})
+
+
+@app.route('/api/timeline/since/<int:message_id>')
+@read_only
+def api_timeline_since(message_id):
+    """How many messages has the current user's timeline had since `message_id`?
+
+    For clients polling instead of streaming. If there are none, answers
+    304 Not Modified after a single primary key lookup (of the user's
+    timeline head; see timeline.py). Otherwise gives the count and the
+    `head` to poll from next, and with `?ids=1`, up to `?limit=` of the
+    new messages' ids, newest first.
+    """
+
+    if not g.user:
+        return jsonify({'error': 'Access unauthorized.'}), 401
+
+    head = timeline.head(g.user.id)
+    if head is None or head <= message_id:
+        return '', 304
+
+    want_ids = bool(request.args.get('ids'))
+    count, ids = timeline.since(g.user.id, message_id, get_per_page() if want_ids else 0)
+
+    data = {'count': count, 'head': head}
+    if want_ids:
+        data['ids'] = ids
+    return jsonify(data)
+
+
+@app.route('/api/likes/state')
+def api_like_state():
+    """Which of the messages in `?ids=1,2,3` has the current user liked?"""
+
+    if not g.user:
+        return jsonify({'error': 'Access unauthorized.'}), 401
+
+    try:
+        message_ids = [int(message_id)
+                       for message_id in request.args.get('ids', '').split(',')
+                       if message_id]
+    except ValueError:
+        abort(400)
+
+    if len(message_ids) > MESSAGES_PER_PAGE:
+        abort(400)
+
+    return jsonify({'liked': sorted(liked_message_ids(message_ids))})
+
+
+@app.route('/api/users/<int:user_id>/messages')
+@read_only
+@conditional(http_cache.profile_stamp)
+def api_user_messages(user_id):
+    """Get a page of a user's messages as JSON."""
+
+    User.query.get_or_404(user_id)
+
+    messages, next_cursor = feeds.user_feed(
+        user_id, before=get_before_cursor(), per_page=get_per_page())
+
+    return jsonify({'messages': [msg.serialize() for msg in messages],
+                    'next': next_cursor})
+
+
+@app.route('/api/users/<int:user_id>/mentions')
+@read_only
+def api_user_mentions(user_id):
+    """Get a page of the messages that @mention a user as JSON."""
+
+    User.query.get_or_404(user_id)
+
+    messages, next_cursor = feeds.mentions_feed(
+        user_id, before=get_before_cursor(), per_page=get_per_page())
+
+    return jsonify({'messages': serialize_messages(messages), 'next': next_cursor})
+
+
+@app.route('/api/trending')
+def api_trending():
+    """Get the trending hashtags and most-mentioned users (see trending.py) as JSON."""
+
+    hashtags = trends.hashtags.top(TRENDING_LIMIT)
+    mentions = trends.mentions.top(TRENDING_LIMIT)
+
+    usernames = {}
+    if mentions:
+        usernames = dict(db.session
+                         .query(User.id, User.username)
+                         .filter(User.id.in_([user_id for user_id, _ in mentions])))
+
+    # The same for everyone, and fine to be a minute old
+    g.cache_control = 'public, max-age=60'
+
+    return jsonify({
+        'hashtags': [{'tag': tag, 'count': count} for tag, count in hashtags],
+        'mentions': [{'id': user_id, 'username': usernames[user_id], 'count': count}
+                     for user_id, count in mentions if user_id in usernames],
+    })
+
+
+@app.route('/api/users/search')
+def api_user_search():
+    """Get usernames matching `?q=` as JSON, for the search box typeahead."""
+
+    limit = max(1, min(request.args.get('limit', TYPEAHEAD_LIMIT, type=int),
+                       USERS_PER_PAGE))
+
+    users, next_cursor = user_search.search(
+        request.args.get('q', ''), after=get_search_cursor(), per_page=limit)
+
+    return jsonify({'users': [{'id': user.id,
+                               'username': user.username,
+                               'image_url': user.image_url}
+                              for user in users],
+                    'next': next_cursor})
+
+
+@app.route('/api/search')
+@read_only
+def api_search():
+    """Search messages as JSON; takes the same arguments as /search."""
+
+    if request.args.get('following') and not g.user:
+        return jsonify({'error': 'Access unauthorized.'}), 401
+
+    messages, next_cursor = message_search.search(
+        **get_message_search(), per_page=get_per_page(SEARCH_RESULTS_PER_PAGE))
+
+    return jsonify({'messages': serialize_messages(messages), 'next': next_cursor})
+
+
+##############################################################################
+# Live updates (Server-Sent Events; see pubsub.py)
+
+
+@app.route('/stream/timeline')
+def stream_timeline():
+    """Stream messages posted from now on to the current user's home timeline.
+
+    Each one is sent as an event whose data is the message as JSON (like
+    the timeline API's, without `liked`).
+    """
+
+    if not g.user:
+        return jsonify({'error': 'Access unauthorized.'}), 401
+
+    subscription = broker.subscribe(
+        message_channel(user_id) for user_id in g.user.following_ids | {g.user.id})
+
+    # (and ask proxies such as nginx not to buffer it)
+    return Response(broker.stream(subscription), mimetype='text/event-stream',
+                    headers={'X-Accel-Buffering': 'no'})
+
+
+##############################################################################
+# Maintenance commands (run with `flask <command>`)
+
+
+@app.cli.command('db-upgrade')
+def db_upgrade():
+    """Apply any schema migrations the database hasn't had yet."""
+
+    ran = migrations.upgrade(db.engine)
+    print(f"Applied migrations: {', '.join(ran)}" if ran else "Already up to date.")
+
+
+@app.cli.command('assets-build')
+def assets_build():
+    """Fingerprint, bundle, minify and pre-compress static assets."""
+
+    manifest = assets.build(app.static_folder)
+    app.extensions['assets_manifest'] = manifest
+    print(f"Built {len(manifest)} assets into static/{assets.DIST_DIR}"
+          + ("" if assets.brotli else " (install brotli for .br variants)"))
+
+
+@app.cli.command('backfill-timelines')
+def backfill_timelines():
+    """Rebuild every home timeline from the follows and messages tables."""
+
+    count = timeline.backfill()
+    db.session.commit()
+    print(f"Wrote {count} timeline entries.")
+
+
+@app.cli.command('reconcile-counters')
+def reconcile_counters():
+    """Recount every user's message/follow/like counters, fixing drift."""
+
+    fixed = counters.reconcile()
+    db.session.commit()
+    print(f"Fixed counters for {fixed} users.")
@@ -0,0 +1,210 @@
+"""Static asset pipeline: fingerprinted, minified, pre-compressed files.
+
+`flask assets-build` writes `static/dist/`:
+
+- every image (and the favicon), renamed to include a hash of its
+  contents, e.g. `images/warbler-logo.4f1c0a9e2b.png`,
+- one bundle per entry in `BUNDLES`: its sources concatenated, minified,
+  with `url("/static/...")` references pointed at the fingerprinted
+  copies, and hashed the same way,
+- a `.gz` (and, if the `brotli` package is installed, a `.br`) next to
+  every text file,
+- `manifest.json`, mapping each source/bundle name to its built file.
+
+Templates link assets with `asset_url('images/...')` and
+`bundle_urls('app.css')`. With a manifest, those point into `dist/`;
+without one (e.g. in development before a build), they fall back to the
+unbuilt sources. Since a built file's name changes whenever its content
+does, http_cache serves everything under `dist/` as immutable, and the
+static route picks the smallest pre-compressed variant the client accepts
+and hands it to the server as a file (so `sendfile` does the copying, and
+nothing is compressed per request).
+
+The minifiers are deliberately simple: they drop comments, indentation
+and blank lines (and, in CSS, spaces around punctuation), nothing that
+needs a parser. Don't start a line inside a JS template literal with
+indentation you mean to keep.
+"""
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+
+from flask import url_for, request, send_from_directory
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DIST_DIR = 'dist'
+MANIFEST = 'manifest.json'
+
+# Built bundle name: the source files (relative to static/) that make it up
+BUNDLES = {
+    'app.css': ['stylesheets/style.css'],
+    'app.js': ['scripts/app.js'],
+}
+
+# Files copied to dist/ with fingerprinted names (and rewritten in CSS)
+FINGERPRINTED = ('images/', 'favicon.ico')
+
+COMPRESSIBLE = ('.css', '.js', '.svg', '.ico', '.json')
+
+# Best first; (encoding, file suffix)
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+CSS_URL = re.compile(r'''url\(\s*(['"]?)/static/([^'")]+)\1\s*\)''')
+
+
+##############################################################################
+# Building
+
+
+def fingerprint(name, content):
+    """`images/logo.png` -> `images/logo.<hash>.png`"""
+
+    root, ext = os.path.splitext(name)
+    return f"{root}.{hashlib.sha1(content).hexdigest()[:10]}{ext}"
+
+
+def minify_css(css):
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.S)
+    css = re.sub(r'\s+', ' ', css)
+    css = re.sub(r'\s*([{};,>])\s*', r'\1', css)
+    return css.replace(';}', '}').strip()
+
+
+def minify_js(js):
+    lines = (line.strip() for line in js.splitlines())
+    return '\n'.join(line for line in lines if line and not line.startswith('//'))
+
+
+def build(static_folder):
+    """Build `static_folder/dist` from scratch. Returns the manifest."""
+
+    dist = os.path.join(static_folder, DIST_DIR)
+    shutil.rmtree(dist, ignore_errors=True)
+    manifest = {}
+
+    def write(name, content):
+        built = fingerprint(name, content)
+        path = os.path.join(dist, built)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(content)
+        manifest[name] = built
+
+        if name.endswith(COMPRESSIBLE):
+            write_compressed(path, content)
+
+    for dirpath, _, filenames in os.walk(static_folder):
+        if os.path.relpath(dirpath, static_folder).split(os.sep)[0] == DIST_DIR:
+            continue
+        for filename in sorted(filenames):
+            name = os.path.relpath(os.path.join(dirpath, filename), static_folder)
+            name = name.replace(os.sep, '/')
+            if name.startswith(FINGERPRINTED):
+                with open(os.path.join(static_folder, name), 'rb') as f:
+                    write(name, f.read())
+
+    def built_url(match):
+        quote, name = match.groups()
+        if name in manifest:
+            name = f"{DIST_DIR}/{manifest[name]}"
+        return f"url({quote}/static/{name}{quote})"
+
+    for bundle, sources in BUNDLES.items():
+        parts = []
+        for source in sources:
+            with open(os.path.join(static_folder, source), encoding='utf-8') as f:
+                parts.append(f.read())
+
+        if bundle.endswith('.css'):
+            content = minify_css(CSS_URL.sub(built_url, '\n'.join(parts)))
+        else:
+            # (semicolons keep separate scripts from running together)
+            content = minify_js(';\n'.join(parts))
+
+        write(bundle, content.encode('utf-8'))
+
+    with open(os.path.join(dist, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    return manifest
+
+
+def write_compressed(path, content):
+    """Write `.gz` (and `.br`) variants of `path`, if they're any smaller."""
+
+    variants = {'.gz': gzip.compress(content, 9, mtime=0)}
+    if brotli is not None:
+        variants['.br'] = brotli.compress(content, quality=11)
+
+    for suffix, compressed in variants.items():
+        if len(compressed) < len(content):
+            with open(path + suffix, 'wb') as f:
+                f.write(compressed)
+
+
+##############################################################################
+# Serving
+
+
+def load_manifest(static_folder):
+    try:
+        with open(os.path.join(static_folder, DIST_DIR, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def init_app(app):
+    """Add the template helpers and pre-compressed static serving to `app`."""
+
+    app.extensions['assets_manifest'] = load_manifest(app.static_folder)
+
+    @app.template_global()
+    def asset_url(name):
+        """URL of the built copy of static file `name` (or the file itself)."""
+
+        manifest = app.extensions['assets_manifest']
+        if name in manifest:
+            return url_for('static', filename=f"{DIST_DIR}/{manifest[name]}")
+        return url_for('static', filename=name)
+
+    @app.template_global()
+    def bundle_urls(bundle):
+        """URLs to link for `bundle`: the built bundle, or all its sources."""
+
+        manifest = app.extensions['assets_manifest']
+        if bundle in manifest:
+            return [url_for('static', filename=f"{DIST_DIR}/{manifest[bundle]}")]
+        return [url_for('static', filename=source) for source in BUNDLES[bundle]]
+
+    def send_static_file(filename):
+        """Serve a static file, pre-compressed if we can."""
+
+        if not filename.startswith(DIST_DIR + '/'):
+            return app.send_static_file(filename)
+
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        path = os.path.join(app.static_folder, filename)
+
+        for encoding, suffix in ENCODINGS:
+            if request.accept_encodings[encoding] and os.path.isfile(path + suffix):
+                response = send_from_directory(app.static_folder, filename + suffix,
+                                               mimetype=mimetype)
+                response.headers['Content-Encoding'] = encoding
+                break
+        else:
+            response = send_from_directory(app.static_folder, filename, mimetype=mimetype)
+
+        response.vary.add('Accept-Encoding')
+        return response
+
+    app.view_functions['static'] = send_static_file
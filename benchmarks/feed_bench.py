@@ -0,0 +1,134 @@
+"""Compare loading feed pages through the ORM and through feeds.py.
+
+Run from the project root:
+
+    python -m benchmarks.feed_bench [--rows 100 1000] [--repeat 50]
+
+This drops and recreates every table in $DATABASE_URL (by default
+`postgresql:///warbler-bench`, never the development database), fills it
+with one reader following one author with `max(--rows)` messages, and then
+for each page size times fetching a page of each feed and serializing it,
+as `api_timeline` and `api_user_messages` do. Each run gets a fresh
+session, like a request would. Reported per page:
+
+- CPU: mean process time (so waiting on the database doesn't count),
+- memory: peak Python allocations while building the page (tracemalloc).
+"""
+
+import argparse
+import os
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+os.environ.setdefault('DATABASE_URL', 'postgresql:///warbler-bench')
+
+from app import app  # noqa: E402 (app reads DATABASE_URL on import)
+from models import db, User, Message, Follows  # noqa: E402
+from pagination import paginate  # noqa: E402
+import feeds  # noqa: E402
+import timeline  # noqa: E402
+
+READER_ID = 1
+AUTHOR_ID = 2
+
+
+def seed(rows):
+    """Fill the database with a reader following an author of `rows` messages."""
+
+    db.drop_all()
+    db.create_all()
+
+    for user_id in (READER_ID, AUTHOR_ID):
+        db.session.execute(User.__table__.insert(), {
+            'id': user_id, 'username': f'user{user_id}', 'email': f'user{user_id}@test.com',
+            'password': 'x', 'image_url': '/static/images/default-pic.png'})
+
+    db.session.execute(Follows.__table__.insert(), {
+        'user_being_followed_id': AUTHOR_ID, 'user_following_id': READER_ID})
+
+    start = datetime(2020, 1, 1)
+    db.session.execute(Message.__table__.insert(), [
+        {'id': n, 'user_id': AUTHOR_ID, 'text': f'Message number {n} ' * 5,
+         'timestamp': start + timedelta(minutes=n)}
+        for n in range(1, rows + 1)])
+
+    timeline.backfill()
+    db.session.commit()
+
+
+def orm_home(per_page):
+    return timeline.home_messages(READER_ID, per_page=per_page)
+
+
+def orm_profile(per_page):
+    query = Message.query.filter(Message.user_id == AUTHOR_ID)
+    return paginate(query, Message.timestamp, Message.id, per_page=per_page)
+
+
+def core_home(per_page):
+    return feeds.home_feed(READER_ID, per_page=per_page)
+
+
+def core_profile(per_page):
+    return feeds.user_feed(AUTHOR_ID, per_page=per_page)
+
+
+CASES = [
+    ('home', orm_home, core_home),
+    ('profile', orm_profile, core_profile),
+]
+
+
+def run(fetch, per_page):
+    """Fetch and serialize one page in a fresh session."""
+
+    messages, _ = fetch(per_page)
+    serialized = [msg.serialize() for msg in messages]
+    db.session.remove()
+    return serialized
+
+
+def measure(fetch, per_page, repeat):
+    """Return (mean CPU ms, peak KiB) for `fetch`ing pages of `per_page`."""
+
+    run(fetch, per_page)  # warm up caches (compiled SQL, templates, ...)
+
+    started = time.process_time()
+    for _ in range(repeat):
+        run(fetch, per_page)
+    cpu_ms = (time.process_time() - started) / repeat * 1000
+
+    tracemalloc.start()
+    try:
+        run(fetch, per_page)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return cpu_ms, peak / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[100, 1000])
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    with app.app_context():
+        seed(max(args.rows))
+
+        print(f"{'feed':8} {'rows':>5} {'ORM ms':>8} {'Core ms':>8} {'saved':>6}"
+              f" {'ORM KiB':>8} {'Core KiB':>9} {'saved':>6}")
+
+        for name, orm_fetch, core_fetch in CASES:
+            for rows in args.rows:
+                orm_ms, orm_kib = measure(orm_fetch, rows, args.repeat)
+                core_ms, core_kib = measure(core_fetch, rows, args.repeat)
+                print(f"{name:8} {rows:5} {orm_ms:8.2f} {core_ms:8.2f}"
+                      f" {1 - core_ms / orm_ms:6.0%}"
+                      f" {orm_kib:8.0f} {core_kib:9.0f} {1 - core_kib / orm_kib:6.0%}")
+
+
+if __name__ == '__main__':
+    main()
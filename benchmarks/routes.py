@@ -0,0 +1,444 @@
+"""Benchmark the main routes at several database sizes.
+
+Run from the project root:
+
+    python -m benchmarks.routes [--tiers 1k 100k 1m] [--requests 200]
+                                [--concurrency 8] [--compare OLD.json]
+
+For each tier this generates that many users' worth of data (with
+generator/create_csvs.py, so follows are skewed toward a few popular
+accounts), loads it into $DATABASE_URL with seed.py (by default
+`postgresql:///warbler-bench`, which is dropped and recreated: never point
+it at a database you care about), adds a few benchmark users with a known
+password, and then drives each route in `ROUTES`:
+
+- in process, one request at a time, through the Flask test client,
+- over HTTP, from --concurrency client threads at once, against the app
+  served by a threaded Werkzeug server in a child process.
+
+Every route gets p50/p95/p99 latency, throughput and queries per request
+(read from the `Server-Timing` header instrumentation.py adds). Results
+are printed and saved as JSON in benchmarks/results/; --compare prints
+how p95 latencies moved against an earlier results file. --no-seed reuses
+whatever data is already loaded (for the first tier given).
+"""
+
+import argparse
+import http.client
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from multiprocessing import Process
+from urllib.parse import urlencode
+
+os.environ.setdefault('DATABASE_URL', 'postgresql:///warbler-bench')
+
+from werkzeug.serving import make_server  # noqa: E402
+
+from app import app  # noqa: E402 (app reads DATABASE_URL on import)
+from models import db, User, Message, Follows  # noqa: E402
+from passwords import passwords  # noqa: E402
+import seed  # noqa: E402
+import timeline  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+
+TIERS = {'1k': 1000, '100k': 100000, '1m': 1000000}
+
+ROUTES = ['login', 'homepage', 'users_show', 'list_users',
+          'messages_like', 'messages_add', 'add_follow']
+
+# Routes that answer with a redirect when they work
+REDIRECTING = {'login', 'messages_add', 'add_follow'}
+
+BENCH_USERS = 16
+BENCH_PASSWORD = 'benchmark'
+BENCH_FOLLOWS = 50
+
+QUERY_COUNT = re.compile(r'desc="(\d+) queries"')
+
+
+##############################################################################
+# Data
+
+
+def seed_tier(users, rng_seed):
+    """Generate and load a database of `users` users. Returns timings."""
+
+    with tempfile.TemporaryDirectory() as csv_dir:
+        started = time.monotonic()
+        subprocess.run([sys.executable, 'generator/create_csvs.py', '--users', str(users),
+                        '--seed', str(rng_seed), '--out', csv_dir], cwd=ROOT, check=True)
+        generated = time.monotonic()
+
+        seed.load(csv_dir)
+        loaded = time.monotonic()
+
+    return {'generate_seconds': generated - started, 'load_seconds': loaded - generated}
+
+
+def bench_users(count):
+    """Get (creating if needed) `count` benchmark users, following popular accounts."""
+
+    popular = [user_id for (user_id,) in (db.session
+                                          .query(User.id)
+                                          .order_by(User.followers_count.desc())
+                                          .limit(BENCH_FOLLOWS))]
+    users = []
+
+    for n in range(count):
+        username = f'bench{n}'
+        user = User.query.filter_by(username=username).first()
+
+        if user is None:
+            user = User.signup(username, f'{username}@example.com', BENCH_PASSWORD, None)
+            db.session.flush()
+            for followed_id in popular:
+                db.session.add(Follows(user_being_followed_id=followed_id,
+                                       user_following_id=user.id))
+                timeline.follow(user.id, followed_id)
+
+        users.append(user.id)
+
+    db.session.commit()
+
+    def followed(user_id):
+        return {followed_id for (followed_id,) in (db.session
+                                                   .query(Follows.user_being_followed_id)
+                                                   .filter(Follows.user_following_id == user_id))}
+
+    return [{'id': user_id, 'username': f'bench{n}', 'followed': followed(user_id)}
+            for n, user_id in enumerate(users)]
+
+
+class Workload:
+    """What requests are aimed at: ids and search terms sampled from the data."""
+
+    def __init__(self, rng):
+        # Profile views are skewed like follows: popular accounts get most
+        top = [user_id for (user_id,) in (db.session
+                                          .query(User.id)
+                                          .order_by(User.followers_count.desc())
+                                          .limit(100))]
+        anyone = [user_id for (user_id,) in (db.session
+                                             .query(User.id)
+                                             .filter(~User.username.like('bench%'))
+                                             .order_by(User.id.desc())
+                                             .limit(5000))]
+        self.profiles = top * 4 + rng.sample(anyone, min(len(anyone), 400))
+        self.follow_targets = anyone
+
+        self.messages = [message_id for (message_id,) in (db.session
+                                                          .query(Message.id)
+                                                          .filter(Message.user_id.in_(anyone))
+                                                          .order_by(Message.timestamp.desc())
+                                                          .limit(1000))]
+
+        self.prefixes = sorted({User.query.get(user_id).username[:3]
+                                for user_id in rng.sample(anyone, min(len(anyone), 50))})
+
+        db.session.remove()
+
+    def request(self, route, user, rng):
+        """Build the (method, path, form) of one request to `route` by `user`."""
+
+        if route == 'login':
+            return 'POST', '/login', {'username': user['username'], 'password': BENCH_PASSWORD}
+        if route == 'homepage':
+            return 'GET', '/', None
+        if route == 'users_show':
+            return 'GET', f'/users/{rng.choice(self.profiles)}', None
+        if route == 'list_users':
+            return 'GET', f'/users?q={rng.choice(self.prefixes)}', None
+        if route == 'messages_like':
+            return 'POST', f'/messages/{rng.choice(self.messages)}/like', None
+        if route == 'messages_add':
+            return 'POST', '/messages/new', {'text': f'Benchmarking #{rng.randrange(10 ** 6)}'}
+        if route == 'add_follow':
+            # (following someone twice is an error, so each user remembers)
+            while True:
+                followed_id = rng.choice(self.follow_targets)
+                if followed_id not in user['followed']:
+                    user['followed'].add(followed_id)
+                    return 'POST', f'/users/follow/{followed_id}', None
+
+        raise ValueError(route)
+
+
+##############################################################################
+# Drivers
+
+
+def summarize(samples, wall_seconds, expected_status):
+    """Reduce (status, seconds, queries) samples to a dict of stats."""
+
+    latencies = sorted(seconds for _, seconds, _ in samples)
+    queries = [count for _, _, count in samples if count is not None]
+
+    def percentile(q):
+        return latencies[min(len(latencies) - 1, round(q * (len(latencies) - 1)))] * 1000
+
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for status, _, _ in samples if status != expected_status),
+        'p50_ms': percentile(0.50),
+        'p95_ms': percentile(0.95),
+        'p99_ms': percentile(0.99),
+        'throughput_rps': len(samples) / wall_seconds,
+        'queries_per_request': sum(queries) / len(queries) if queries else None,
+    }
+
+
+def query_count(server_timing):
+    match = QUERY_COUNT.search(server_timing or '')
+    return int(match.group(1)) if match else None
+
+
+def run_test_client(workload, users, requests, rng):
+    """Time each route in process, one request at a time."""
+
+    clients = []
+    for user in users:
+        client = app.test_client()
+        client.post('/login', data={'username': user['username'], 'password': BENCH_PASSWORD})
+        clients.append((client, user))
+
+    results = {}
+    for route in ROUTES:
+        samples = []
+        started = time.perf_counter()
+
+        for n in range(requests):
+            client, user = clients[n % len(clients)]
+            method, path, form = workload.request(route, user, rng)
+
+            sent = time.perf_counter()
+            response = client.open(path, method=method, data=form)
+            elapsed = time.perf_counter() - sent
+
+            samples.append((response.status_code, elapsed,
+                            query_count(', '.join(response.headers.getlist('Server-Timing')))))
+
+        results[route] = summarize(samples, time.perf_counter() - started,
+                                   302 if route in REDIRECTING else 200)
+
+    return results
+
+
+class HttpSession:
+    """One simulated browser: a connection and a session cookie."""
+
+    def __init__(self, port):
+        self.conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        self.cookie = None
+
+    def request(self, method, path, form=None):
+        """Make a request. Returns (status, seconds, queries)."""
+
+        headers = {}
+        body = None
+        if form is not None:
+            body = urlencode(form)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        if self.cookie:
+            headers['Cookie'] = self.cookie
+
+        sent = time.perf_counter()
+        self.conn.request(method, path, body, headers)
+        response = self.conn.getresponse()
+        response.read()
+        elapsed = time.perf_counter() - sent
+
+        for name, value in response.getheaders():
+            if name.lower() == 'set-cookie':
+                self.cookie = value.split(';', 1)[0]
+
+        return response.status, elapsed, query_count(response.getheader('Server-Timing'))
+
+
+def serve(port):
+    # (the forked child mustn't share the parent's database connections, or
+    # its password hashing processes)
+    db.engine.dispose()
+    passwords.pool = None
+    configure()
+    make_server('127.0.0.1', port, app, threaded=True).serve_forever()
+
+
+def configure():
+    """Set the app up for benchmarking: no CSRF tokens, no debug toolbar."""
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.debug = False
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def run_http(workload, users, requests, concurrency, rng_seed):
+    """Time each route over HTTP, `concurrency` requests at a time."""
+
+    port = free_port()
+    db.session.remove()
+    db.engine.dispose()
+    # (not a daemon: daemons may not start the password hashing processes)
+    server = Process(target=serve, args=(port,))
+    server.start()
+
+    try:
+        for _ in range(100):
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                break
+            except OSError:
+                time.sleep(0.1)
+
+        sessions = []
+        for n in range(concurrency):
+            user = users[n % len(users)]
+            session = HttpSession(port)
+            session.request('POST', '/login',
+                            {'username': user['username'], 'password': BENCH_PASSWORD})
+            sessions.append((session, user, random.Random(f'{rng_seed}:http:{n}')))
+
+        results = {}
+        for route in ROUTES:
+            samples = []
+            lock = threading.Lock()
+
+            def client(session, user, rng, count):
+                for _ in range(count):
+                    method, path, form = workload.request(route, user, rng)
+                    sample = session.request(method, path, form)
+                    with lock:
+                        samples.append(sample)
+
+            threads = [threading.Thread(target=client,
+                                        args=(*sessions[n], len(range(n, requests, concurrency))))
+                       for n in range(concurrency)]
+
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            results[route] = summarize(samples, time.perf_counter() - started,
+                                       302 if route in REDIRECTING else 200)
+
+        return results
+
+    finally:
+        server.terminate()
+        server.join()
+
+
+##############################################################################
+# Reporting
+
+
+def print_results(tier, driver, results):
+    print(f"\n{tier} users, {driver}")
+    print(f"{'route':14} {'reqs':>5} {'errs':>5} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+          f" {'req/s':>8} {'queries':>8}")
+    for route, stats in results.items():
+        queries = stats['queries_per_request']
+        print(f"{route:14} {stats['requests']:5} {stats['errors']:5}"
+              f" {stats['p50_ms']:8.1f} {stats['p95_ms']:8.1f} {stats['p99_ms']:8.1f}"
+              f" {stats['throughput_rps']:8.1f} {'-' if queries is None else f'{queries:.1f}':>8}")
+
+
+def compare(old, new):
+    """Print how each route's p95 changed between two results files."""
+
+    print(f"\np95 latency vs {old['started']} ({old['commit']})")
+    for tier, drivers in new['tiers'].items():
+        for driver in ('test_client', 'http'):
+            for route, stats in drivers[driver].items():
+                try:
+                    before = old['tiers'][tier][driver][route]['p95_ms']
+                except KeyError:
+                    continue
+                change = (stats['p95_ms'] - before) / before if before else 0
+                print(f"{tier:>5} {driver:12} {route:14} {before:8.1f} -> "
+                      f"{stats['p95_ms']:8.1f} ms ({change:+.0%})")
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, check=True,
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                              universal_newlines=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tiers', nargs='+', choices=TIERS, default=['1k'])
+    parser.add_argument('--requests', type=int, default=200,
+                        help="requests per route, per driver")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-seed', action='store_true',
+                        help="benchmark the data already loaded")
+    parser.add_argument('--output')
+    parser.add_argument('--compare')
+    args = parser.parse_args()
+
+    configure()
+
+    report = {
+        'started': datetime.utcnow().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'tiers': {},
+    }
+
+    with app.app_context():
+        for tier in (args.tiers[:1] if args.no_seed else args.tiers):
+            rng = random.Random(f'{args.seed}:{tier}')
+            result = {'users': TIERS[tier]}
+            if not args.no_seed:
+                result.update(seed_tier(TIERS[tier], args.seed))
+
+            # (one user per client thread, so none of them race each other)
+            users = bench_users(max(BENCH_USERS, args.concurrency))
+            workload = Workload(rng)
+
+            result['test_client'] = run_test_client(workload, users, args.requests, rng)
+            print_results(tier, 'test client', result['test_client'])
+
+            result['http'] = run_http(workload, users, args.requests,
+                                      args.concurrency, args.seed)
+            print_results(tier, f'HTTP x{args.concurrency}', result['http'])
+
+            report['tiers'][tier] = result
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"routes-{report['started'].replace(':', '')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nSaved {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""A small in-process cache: least-recently-used eviction plus a TTL."""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Up to `max_size` entries, each kept for at most `ttl` seconds.
+
+    With `max_weight`, the total `weigh(value)` of the entries is kept
+    under it too (e.g. `weigh=len` for a byte budget on strings). A `ttl`
+    of None means entries only leave by eviction.
+
+    Safe to share between threads. Every worker process has its own, so
+    anything cached here must be fine to serve for up to `ttl` seconds
+    after another process changes it.
+    """
+
+    def __init__(self, max_size=1024, ttl=60, max_weight=None, weigh=len):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_weight = max_weight
+        self.weigh = weigh
+        self.weight = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Get the value for `key`, or `default` if it's missing or expired."""
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return default
+
+            value, expires, _ = entry
+            if expires is not None and expires < time.monotonic():
+                self._remove(key)
+                return default
+
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        """Cache `value` under `key` (for `ttl` seconds, if given)."""
+
+        ttl = self.ttl if ttl is None else ttl
+        expires = None if ttl is None else time.monotonic() + ttl
+        weight = self.weigh(value) if self.max_weight is not None else 0
+
+        with self.lock:
+            self._remove(key)
+            self.entries[key] = (value, expires, weight)
+            self.weight += weight
+
+            while len(self.entries) > self.max_size or (
+                    self.max_weight is not None and self.weight > self.max_weight):
+                self._remove(next(iter(self.entries)))
+
+    def delete(self, key):
+        with self.lock:
+            self._remove(key)
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.weight -= entry[2]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.weight = 0
+
+    def __len__(self):
+        return len(self.entries)
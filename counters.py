@@ -0,0 +1,248 @@
+"""Denormalized message/follow/like counters on User and Message.
+
+Profile pages show how many messages, followers, followed users and likes a
+user has, and messages show how many likes they have. Counting those
+relationships in Python means loading every row of them, so instead user
+and message rows carry counter columns.
+
+The counters are kept correct in the same transaction as the change they
+count: a `before_flush` hook notes every message, follow and like that is
+about to be added or removed (whether through a `Follows`/`Likes`/`Message`
+object or through a `User.following`/`followers`/`likes` collection), and
+an `after_flush` hook applies the net change with one
+`UPDATE ... SET x = x + n` per counter. Writes that bypass the ORM (bulk
+deletes, raw SQL, loading CSVs) can leave counters drifted; `reconcile()`
+recounts everything and fixes them.
+"""
+
+from collections import Counter
+
+from sqlalchemy import event, select, func, or_, and_
+from sqlalchemy.orm import Session, attributes
+from sqlalchemy.orm.util import identity_key
+
+from models import db, User, Message, Follows, Likes
+import identity
+from page_cache import invalidate_on_commit
+
+users = User.__table__
+messages = Message.__table__
+follows = Follows.__table__
+likes = Likes.__table__
+
+
+##############################################################################
+# Keeping counters up to date on flush
+
+
+@event.listens_for(Session, 'before_flush')
+def collect_counter_changes(session, flush_context, instances):
+    """Note the counter changes implied by everything about to be flushed.
+
+    Ids aren't assigned yet for new rows, so changes are recorded with a
+    getter that's called once the flush is done.
+    """
+
+    changes = session.info.setdefault('counter_changes', [])
+
+    def change(get_id, column, delta, table=users):
+        changes.append((table, get_id, column, delta))
+
+    for obj in session.new:
+        if isinstance(obj, Message):
+            change(lambda obj=obj: obj.user_id, 'messages_count', 1)
+        elif isinstance(obj, Likes):
+            change(lambda obj=obj: obj.user_id, 'likes_count', 1)
+            change(lambda obj=obj: obj.message_id, 'likes_count', 1, messages)
+        elif isinstance(obj, Follows):
+            change(lambda obj=obj: obj.user_following_id, 'following_count', 1)
+            change(lambda obj=obj: obj.user_being_followed_id, 'followers_count', 1)
+
+    for obj in session.deleted:
+        if isinstance(obj, Message):
+            change(lambda uid=obj.user_id: uid, 'messages_count', -1)
+            # Everyone who liked this message loses that like
+            for (liker_id,) in session.query(Likes.user_id).filter(Likes.message_id == obj.id):
+                change(lambda uid=liker_id: uid, 'likes_count', -1)
+        elif isinstance(obj, Likes):
+            change(lambda uid=obj.user_id: uid, 'likes_count', -1)
+            change(lambda mid=obj.message_id: mid, 'likes_count', -1, messages)
+        elif isinstance(obj, Follows):
+            change(lambda uid=obj.user_following_id: uid, 'following_count', -1)
+            change(lambda uid=obj.user_being_followed_id: uid, 'followers_count', -1)
+        elif isinstance(obj, User):
+            collect_deleted_user_changes(session, obj, change)
+
+    for obj in session.new | session.dirty:
+        if isinstance(obj, User) and obj not in session.deleted:
+            collect_collection_changes(obj, change)
+
+
+def collect_deleted_user_changes(session, user, change):
+    """Note the counters of *other* users that change when `user` is deleted.
+
+    The database cascades the delete to the user's follows, likes and
+    messages, so none of those show up as ORM deletes.
+    """
+
+    for (uid,) in session.query(Follows.user_following_id).filter(
+            Follows.user_being_followed_id == user.id):
+        change(lambda uid=uid: uid, 'following_count', -1)
+
+    for (uid,) in session.query(Follows.user_being_followed_id).filter(
+            Follows.user_following_id == user.id):
+        change(lambda uid=uid: uid, 'followers_count', -1)
+
+    for (uid,) in (session
+                   .query(Likes.user_id)
+                   .join(Message, Message.id == Likes.message_id)
+                   .filter(Message.user_id == user.id)):
+        change(lambda uid=uid: uid, 'likes_count', -1)
+
+    for (mid,) in session.query(Likes.message_id).filter(Likes.user_id == user.id):
+        change(lambda mid=mid: mid, 'likes_count', -1, messages)
+
+
+def collect_collection_changes(user, change):
+    """Note counter changes from appending to/removing from user collections."""
+
+    def get_id(obj):
+        return lambda: obj.id
+
+    history = attributes.get_history(user, 'following')
+    for other in history.added:
+        change(get_id(user), 'following_count', 1)
+        change(get_id(other), 'followers_count', 1)
+    for other in history.deleted:
+        change(get_id(user), 'following_count', -1)
+        change(get_id(other), 'followers_count', -1)
+
+    history = attributes.get_history(user, 'followers')
+    for other in history.added:
+        change(get_id(user), 'followers_count', 1)
+        change(get_id(other), 'following_count', 1)
+    for other in history.deleted:
+        change(get_id(user), 'followers_count', -1)
+        change(get_id(other), 'following_count', -1)
+
+    history = attributes.get_history(user, 'likes')
+    change(get_id(user), 'likes_count', len(history.added) - len(history.deleted))
+    for message in history.added:
+        change(get_id(message), 'likes_count', 1, messages)
+    for message in history.deleted:
+        change(get_id(message), 'likes_count', -1, messages)
+
+
+@event.listens_for(Session, 'after_flush')
+def apply_counter_changes(session, flush_context):
+    """Apply the counter changes noted before the flush."""
+
+    totals = Counter()
+    for table, get_id, column, delta in session.info.pop('counter_changes', []):
+        row_id = get_id()
+        if row_id is not None and delta:
+            totals[(table, row_id, column)] += delta
+
+    for (table, row_id, column), delta in totals.items():
+        if delta:
+            session.execute(table
+                            .update()
+                            .where(table.c.id == row_id)
+                            .values({column: table.c[column] + delta}))
+
+    session.info['counters_changed'] = {key for key, delta in totals.items() if delta}
+
+
+@event.listens_for(Session, 'after_flush_postexec')
+def expire_changed_counters(session, flush_context):
+    """Make loaded rows re-read any counter we just changed in the database."""
+
+    expire_counters(session, session.info.pop('counters_changed', ()))
+
+
+def expire_counters(session, changed):
+    """Expire the counters in `changed` on any users/messages `session` has loaded.
+
+    Also drops cached identity snapshots of the users (which include their
+    counters), and cached pages showing them once committed. `changed` is
+    an iterable of (table, id, column).
+    """
+
+    models = {users: User, messages: Message}
+    tags = {users: 'user', messages: 'message'}
+
+    for table, row_id, column in changed:
+        obj = session.identity_map.get(identity_key(models[table], row_id))
+        if obj is not None:
+            session.expire(obj, [column])
+        if table is users:
+            identity.forget(row_id)
+        invalidate_on_commit(session, [f'{tags[table]}:{row_id}'])
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_counter_changes(session):
+    """Forget pending counter changes from a flush that didn't happen."""
+
+    session.info.pop('counter_changes', None)
+    session.info.pop('counters_changed', None)
+
+
+##############################################################################
+# Repairing drift
+
+
+def user_recounts():
+    """Get a correlated subquery that recounts each counter for a user row."""
+
+    return {
+        'messages_count': (select([func.count()])
+                           .where(messages.c.user_id == users.c.id)
+                           .as_scalar()),
+        'following_count': (select([func.count()])
+                            .where(follows.c.user_following_id == users.c.id)
+                            .as_scalar()),
+        'followers_count': (select([func.count()])
+                            .where(follows.c.user_being_followed_id == users.c.id)
+                            .as_scalar()),
+        'likes_count': (select([func.count()])
+                        .select_from(likes.join(messages))
+                        .where(likes.c.user_id == users.c.id)
+                        .as_scalar()),
+    }
+
+
+def message_recounts():
+    """Get a correlated subquery that recounts each counter for a message row."""
+
+    return {
+        'likes_count': (select([func.count()])
+                        .where(likes.c.message_id == messages.c.id)
+                        .as_scalar()),
+    }
+
+
+def reconcile(user_ids=None, message_ids=None):
+    """Recount every user's and message's counters, fixing any that have drifted.
+
+    `user_ids` and `message_ids` (collections or selects of ids) limit the
+    recount to those rows; without either, every row is checked. (Giving
+    only one of them checks only that table.)
+
+    Returns the number of rows whose counters were wrong.
+    """
+
+    limited = user_ids is not None or message_ids is not None
+    fixed = 0
+
+    for table, counts, ids in ((users, user_recounts(), user_ids),
+                               (messages, message_recounts(), message_ids)):
+        if limited and ids is None:
+            continue
+
+        drifted = or_(*(table.c[column] != count for column, count in counts.items()))
+        if ids is not None:
+            drifted = and_(table.c.id.in_(ids), drifted)
+        fixed += db.session.execute(table.update().where(drifted).values(counts)).rowcount
+
+    return fixed
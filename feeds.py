@@ -0,0 +1,143 @@
+"""Read model for message feeds (the home timeline and profile pages).
+
+A feed page only shows each message's text, timestamp and likes, and its
+author's name and picture. Loading those as `Message` and `User` objects
+means identity-map bookkeeping, attribute instrumentation and change
+tracking for up to 100 rows that are never changed. Here they come from
+one Core `SELECT ... JOIN users` instead, as plain `FeedMessage` rows
+(with the same attributes templates and `serialize()` use), and each
+author is one shared `Author` per page.
+
+benchmarks/feed_bench.py compares the two.
+"""
+
+from sqlalchemy import select
+
+from models import db, User, Message, TimelineEntry, Mention
+from pagination import page_select, split_page
+
+users = User.__table__
+messages = Message.__table__
+entries = TimelineEntry.__table__
+mentions = Mention.__table__
+
+FEED_COLUMNS = [messages.c.id, messages.c.text, messages.c.timestamp,
+                messages.c.likes_count, messages.c.user_id,
+                users.c.username, users.c.image_url, users.c.version]
+
+
+class Author:
+    """What a feed shows of a message's author."""
+
+    __slots__ = ('id', 'username', 'image_url', 'version')
+
+    def __init__(self, id, username, image_url, version):
+        self.id = id
+        self.username = username
+        self.image_url = image_url
+        self.version = version
+
+
+class FeedMessage:
+    """What a feed shows of a message."""
+
+    __slots__ = ('id', 'text', 'timestamp', 'likes_count', 'user_id', 'user')
+
+    def __init__(self, id, text, timestamp, likes_count, user):
+        self.id = id
+        self.text = text
+        self.timestamp = timestamp
+        self.likes_count = likes_count
+        self.user_id = user.id
+        self.user = user
+
+    def serialize(self):
+        """Serialize like `Message.serialize`."""
+
+        return {
+            'id': self.id,
+            'text': self.text,
+            'timestamp': self.timestamp.isoformat(),
+            'likes_count': self.likes_count,
+            'user': {
+                'id': self.user.id,
+                'username': self.user.username,
+                'image_url': self.user.image_url,
+            },
+        }
+
+
+def feed_messages(rows):
+    """Turn rows of `FEED_COLUMNS` into `FeedMessage`s (sharing `Author`s)."""
+
+    authors = {}
+    items = []
+
+    for (message_id, text, timestamp, likes_count, user_id,
+         username, image_url, version) in rows:
+        author = authors.get(user_id)
+        if author is None:
+            author = authors[user_id] = Author(user_id, username, image_url, version)
+        items.append(FeedMessage(message_id, text, timestamp, likes_count, author))
+
+    return items
+
+
+def fetch_page(query, timestamp_col, id_col, before, per_page):
+    """Run a feed query for one page. Returns `(messages, next_cursor)`."""
+
+    items = feed_messages(db.session.execute(
+        page_select(query, timestamp_col, id_col, before, per_page)))
+
+    return split_page(items, per_page)
+
+
+def home_feed(user_id, before=None, per_page=100):
+    """Get a page of the home timeline of `user_id`, newest first.
+
+    Same messages as `timeline.home_messages`, as `FeedMessage`s.
+    """
+
+    query = (select(FEED_COLUMNS)
+             .select_from(entries
+                          .join(messages, messages.c.id == entries.c.message_id)
+                          .join(users, users.c.id == messages.c.user_id))
+             .where(entries.c.user_id == user_id))
+
+    return fetch_page(query, entries.c.timestamp, entries.c.message_id, before, per_page)
+
+
+def user_feed(user_id, before=None, per_page=100):
+    """Get a page of the messages `user_id` has posted, newest first."""
+
+    query = (select(FEED_COLUMNS)
+             .select_from(messages.join(users, users.c.id == messages.c.user_id))
+             .where(messages.c.user_id == user_id))
+
+    return fetch_page(query, messages.c.timestamp, messages.c.id, before, per_page)
+
+
+def mentions_feed(user_id, before=None, per_page=100):
+    """Get a page of the messages that @mention `user_id`, newest first."""
+
+    query = (select(FEED_COLUMNS)
+             .select_from(mentions
+                          .join(messages, messages.c.id == mentions.c.message_id)
+                          .join(users, users.c.id == messages.c.user_id))
+             .where(mentions.c.user_id == user_id))
+
+    return fetch_page(query, mentions.c.timestamp, mentions.c.message_id, before, per_page)
+
+
+def by_ids(message_ids):
+    """Get the messages with `message_ids`, in that order (skipping any that are gone)."""
+
+    if not message_ids:
+        return []
+
+    query = (select(FEED_COLUMNS)
+             .select_from(messages.join(users, users.c.id == messages.c.user_id))
+             .where(messages.c.id.in_(message_ids)))
+
+    found = {msg.id: msg for msg in feed_messages(db.session.execute(query))}
+    return [found[message_id] for message_id in message_ids if message_id in found]
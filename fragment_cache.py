@@ -0,0 +1,126 @@
+"""Caching rendered template fragments.
+
+Wrap markup that's the same for everyone in a `{% cache %}` block, keyed
+by whatever it depends on:
+
+    {% cache 'message', msg.id, author.id, author.version %}
+        ...
+    {% endcache %}
+
+The first render stores the block's HTML under that key; after that it's
+reused on every page and for every viewer until the key changes (so keys
+must include a version of everything the block shows) or it's evicted.
+Anything that differs per viewer, like whether they've liked a message,
+goes outside the block. Keys also include the templates' release stamp
+(see http_cache.py), so a deploy that changes templates starts afresh.
+
+Where fragments are kept is set by `FRAGMENT_CACHE_URL`:
+
+- `memory://` (the default): an LRU in each worker, holding at most
+  `FRAGMENT_CACHE_MAX_BYTES` of HTML,
+- `redis://host:port/db`: shared by all workers (needs the `redis`
+  package), with entries expiring after `FRAGMENT_CACHE_TTL` seconds,
+- `none://`: no caching; blocks render every time.
+
+Any object with `get(key)` and `set(key, html)` can also be assigned to
+`app.jinja_env.fragment_cache`.
+"""
+
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+from cache import LRUCache
+
+
+class FragmentCacheExtension(Extension):
+    """Adds the `{% cache key, ... %} ... {% endcache %}` tag."""
+
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=None, fragment_cache_prefix='')
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+
+        key_parts = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            key_parts.append(parser.parse_expression())
+
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+
+        return nodes.CallBlock(self.call_method('_cached', [nodes.List(key_parts)]),
+                               [], [], body).set_lineno(lineno)
+
+    def _cached(self, key_parts, caller):
+        backend = self.environment.fragment_cache
+        if backend is None:
+            return caller()
+
+        key = ':'.join([self.environment.fragment_cache_prefix]
+                       + [str(part) for part in key_parts])
+
+        html = backend.get(key)
+        if html is None:
+            html = str(caller())
+            backend.set(key, html)
+
+        return Markup(html)
+
+
+class MemoryBackend:
+    """Fragments in this process, least recently used evicted first."""
+
+    def __init__(self, max_bytes):
+        self.cache = LRUCache(max_size=float('inf'), ttl=None,
+                              max_weight=max_bytes, weigh=len)
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, html):
+        self.cache.set(key, html)
+
+
+class RedisBackend:
+    """Fragments in Redis, shared by every worker."""
+
+    def __init__(self, url, ttl):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def get(self, key):
+        html = self.client.get(key)
+        return None if html is None else html.decode('utf-8')
+
+    def set(self, key, html):
+        self.client.set(key, html.encode('utf-8'), ex=self.ttl)
+
+
+def make_backend(url, max_bytes, ttl):
+    scheme = url.split('://', 1)[0]
+
+    if scheme == 'memory':
+        return MemoryBackend(max_bytes)
+    if scheme == 'redis':
+        return RedisBackend(url, ttl)
+    if scheme == 'none':
+        return None
+
+    raise ValueError(f"Unknown FRAGMENT_CACHE_URL: {url!r}")
+
+
+def init_app(app):
+    """Enable `{% cache %}` in `app`'s templates."""
+
+    url = app.config.setdefault('FRAGMENT_CACHE_URL', 'memory://')
+    max_bytes = app.config.setdefault('FRAGMENT_CACHE_MAX_BYTES', 16 * 1024 * 1024)
+    ttl = app.config.setdefault('FRAGMENT_CACHE_TTL', 24 * 60 * 60)
+
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    app.jinja_env.fragment_cache = make_backend(url, max_bytes, ttl)
+    app.jinja_env.fragment_cache_prefix = 'fragment:' + app.config.get('CACHE_RELEASE', '')
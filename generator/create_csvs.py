@@ -2,29 +2,58 @@
 
 Students won't need to run this for the exercise; they will just use the CSV
 files that this generates. You should only need to run this if you wanted to
-tweak the CSV formats or generate fewer/more rows.
+tweak the CSV formats or generate fewer/more rows, e.g. for load testing:
+
+    python generator/create_csvs.py --users 1000000 --seed 7
+
+Writes users.csv, messages.csv, follows.csv and likes.csv (to --out,
+`generator/` by default). The data is shaped like a real social network
+rather than uniformly random:
+
+- follows go preferentially to popular accounts (a Zipf distribution over
+  users, --zipf), so a few heavy hitters have a large share of all
+  followers while most users have a handful,
+- how much each user posts, follows and likes is power-law distributed
+  (most do little, a few do a lot), averaging the --*-per-user options,
+- messages are posted in bursts, and likes favour popular authors' posts.
+
+To add a second batch to a database that already has one (`seed.py
+--append`), start its ids after the existing ones with --first-user-id and
+--first-message-id; each batch's follows and likes stay within itself.
+
+Same seed, same files: every chunk of users gets its own random generator
+seeded from --seed, so the output doesn't depend on --workers. Chunks are
+generated in parallel and written out in order as they finish, so memory
+stays flat however many rows are written, and nothing touches the network.
 """
 
+import argparse
 import csv
-from random import choice, randint, sample
-from itertools import permutations
-import requests
-from faker import Faker
-from helpers import get_random_datetime
+import io
+import os
+from array import array
+from datetime import datetime, timedelta
+from multiprocessing import Pool
+
+from helpers import (chunk_rng, sentence, heavy_tailed_count, zipf_rank, scatter,
+                     coprime_multiplier, bursty_times, FIRST_NAMES, LAST_NAMES, CITIES)
 
 MAX_WARBLER_LENGTH = 140
 
-USERS_CSV_HEADERS = ['email', 'username', 'image_url', 'password', 'bio', 'header_image_url', 'location']
-MESSAGES_CSV_HEADERS = ['text', 'timestamp', 'user_id']
+USERS_CSV_HEADERS = ['id', 'email', 'username', 'image_url', 'password', 'bio', 'header_image_url', 'location']
+MESSAGES_CSV_HEADERS = ['id', 'text', 'timestamp', 'user_id']
 FOLLOWS_CSV_HEADERS = ['user_being_followed_id', 'user_following_id']
+LIKES_CSV_HEADERS = ['user_id', 'message_id']
 
-NUM_USERS = 300
-NUM_MESSAGES = 1000
-NUM_FOLLWERS = 5000
+# Users per chunk (part of what the seed determines, so not an option)
+CHUNK_SIZE = 10000
 
-fake = Faker()
+MAX_MESSAGES_PER_USER = 10000
+MAX_FOLLOWS_PER_USER = 5000
+MAX_LIKES_PER_USER = 5000
 
-# Generate random profile image URLs to use for users
+PASSWORD_HASH = '$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe'
+HEADER_IMAGE_URL = '/static/images/warbler-hero.jpg'
 
 image_urls = [
     f"https://randomuser.me/api/portraits/{kind}/{i}.jpg"
@@ -32,46 +61,189 @@ image_urls = [
     for i in range(count)
 ]
 
-# Generate random header image URLs to use for users
+# Set in each worker process by `init_worker`
+settings = None
+message_offsets = None
+
+
+def init_worker(worker_settings, offsets=None):
+    global settings, message_offsets
+    settings = worker_settings
+    message_offsets = offsets
+
+
+def chunk_users(chunk):
+    """The ids of the users in `chunk`."""
+
+    first = settings.first_user_id
+    return range(first + chunk * CHUNK_SIZE,
+                 first + min(settings.users, (chunk + 1) * CHUNK_SIZE))
+
+
+def popular_user(rng):
+    """A user id, popular accounts being far likelier than others."""
+
+    rank = zipf_rank(rng, settings.users, settings.zipf)
+    return scatter(rank, settings.users, settings.multiplier) + settings.first_user_id - 1
+
+
+def user_messages(user_id):
+    """The first message id of `user_id`, and how many messages they have."""
+
+    index = user_id - settings.first_user_id
+    first = message_offsets[index]
+    return settings.first_message_id + first, message_offsets[index + 1] - first
+
+
+def to_csv(rows):
+    out = io.StringIO()
+    csv.writer(out, lineterminator='\n').writerows(rows)
+    return out.getvalue()
+
+
+##############################################################################
+# Chunk generators (run in the worker processes)
+
+
+def message_counts(chunk):
+    """How many messages each user in `chunk` posts."""
+
+    rng = chunk_rng(settings.seed, 'message-counts', chunk)
+    return array('q', (heavy_tailed_count(rng, settings.messages_per_user, MAX_MESSAGES_PER_USER)
+                       for _ in chunk_users(chunk)))
+
+
+def users_chunk(chunk):
+    rng = chunk_rng(settings.seed, 'users', chunk)
+    rows = []
+
+    for user_id in chunk_users(chunk):
+        # (the id suffix keeps usernames and emails unique at any size)
+        username = f"{rng.choice(FIRST_NAMES)}{rng.choice(LAST_NAMES)}{user_id}"
+        rows.append((user_id, f"{username}@example.com", username,
+                     rng.choice(image_urls), PASSWORD_HASH,
+                     sentence(rng, 100), HEADER_IMAGE_URL, rng.choice(CITIES)))
+
+    return to_csv(rows)
+
+
+def messages_chunk(chunk):
+    rng = chunk_rng(settings.seed, 'messages', chunk)
+    rows = []
+
+    for user_id in chunk_users(chunk):
+        first_id, count = user_messages(user_id)
+
+        times = sorted(bursty_times(rng, count, settings.start, settings.span))
+        for message_id, timestamp in enumerate(times, first_id):
+            rows.append((message_id, sentence(rng, MAX_WARBLER_LENGTH), timestamp, user_id))
+
+    return to_csv(rows)
+
+
+def follows_chunk(chunk):
+    rng = chunk_rng(settings.seed, 'follows', chunk)
+    rows = []
+
+    for follower_id in chunk_users(chunk):
+        wanted = min(settings.users - 1,
+                     heavy_tailed_count(rng, settings.follows_per_user, MAX_FOLLOWS_PER_USER))
+        followed = set()
+
+        # (gives up eventually: near-everyone follow lists are mostly repeats)
+        for _ in range(10 * wanted):
+            if len(followed) == wanted:
+                break
+            user_id = popular_user(rng)
+            if user_id != follower_id:
+                followed.add(user_id)
+
+        rows.extend((user_id, follower_id) for user_id in sorted(followed))
+
+    return to_csv(rows)
+
+
+def likes_chunk(chunk):
+    rng = chunk_rng(settings.seed, 'likes', chunk)
+    rows = []
+
+    for user_id in chunk_users(chunk):
+        wanted = heavy_tailed_count(rng, settings.likes_per_user, MAX_LIKES_PER_USER)
+        liked = set()
+
+        for _ in range(10 * wanted):
+            if len(liked) == wanted:
+                break
+            author_id = popular_user(rng)
+            first_id, count = user_messages(author_id)
+            if author_id != user_id and count:
+                liked.add(first_id + rng.randrange(count))
+
+        rows.extend((user_id, message_id) for message_id in sorted(liked))
+
+    return to_csv(rows)
+
+
+##############################################################################
+# Writing the files
+
+
+def write_csv(path, headers, chunks):
+    """Stream generated CSV text for each chunk, in order, into `path`."""
+
+    with open(path, 'w') as f:
+        csv.writer(f, lineterminator='\n').writerow(headers)
+        for text in chunks:
+            f.write(text)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate CSVs of random data for Warbler.")
+    parser.add_argument('--users', type=int, default=300)
+    parser.add_argument('--messages-per-user', type=float, default=3.4)
+    parser.add_argument('--follows-per-user', type=float, default=17)
+    parser.add_argument('--likes-per-user', type=float, default=10)
+    parser.add_argument('--zipf', type=float, default=1.1,
+                        help="how strongly follows and likes favour popular users")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--end', type=datetime.fromisoformat, default=datetime(2025, 1, 1),
+                        help="latest message timestamp (YYYY-MM-DD)")
+    parser.add_argument('--days', type=int, default=730,
+                        help="how far back from --end messages go")
+    parser.add_argument('--first-user-id', type=int, default=1)
+    parser.add_argument('--first-message-id', type=int, default=1)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--out', default=os.path.dirname(os.path.abspath(__file__)))
+
+    args = parser.parse_args()
+    args.span = timedelta(days=args.days)
+    args.start = args.end - args.span
+    args.multiplier = coprime_multiplier(args.users)
+    return args
+
+
+def main():
+    args = parse_args()
+    chunks = range((args.users + CHUNK_SIZE - 1) // CHUNK_SIZE)
+
+    def path(name):
+        return os.path.join(args.out, name)
+
+    with Pool(args.workers, init_worker, (args,)) as pool:
+        write_csv(path('users.csv'), USERS_CSV_HEADERS, pool.imap(users_chunk, chunks))
+
+        # Message ids are handed out in user order, so every chunk needs to
+        # know where each user's run of ids starts
+        offsets = array('q', [0])
+        for counts in pool.imap(message_counts, chunks):
+            for count in counts:
+                offsets.append(offsets[-1] + count)
+
+    with Pool(args.workers, init_worker, (args, offsets)) as pool:
+        write_csv(path('messages.csv'), MESSAGES_CSV_HEADERS, pool.imap(messages_chunk, chunks))
+        write_csv(path('follows.csv'), FOLLOWS_CSV_HEADERS, pool.imap(follows_chunk, chunks))
+        write_csv(path('likes.csv'), LIKES_CSV_HEADERS, pool.imap(likes_chunk, chunks))
 
-header_image_urls = [
-    requests.get(f"http://www.splashbase.co/api/v1/images/{i}").json()['url']
-    for i in range(1, 46)
-]
 
-with open('generator/users.csv', 'w') as users_csv:
-    users_writer = csv.DictWriter(users_csv, fieldnames=USERS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for i in range(NUM_USERS):
-        users_writer.writerow(dict(
-            email=fake.email(),
-            username=fake.user_name(),
-            image_url=choice(image_urls),
-            password='$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe',
-            bio=fake.sentence(),
-            header_image_url=choice(header_image_urls),
-            location=fake.city()
-        ))
-
-with open('generator/messages.csv', 'w') as messages_csv:
-    messages_writer = csv.DictWriter(messages_csv, fieldnames=MESSAGES_CSV_HEADERS)
-    messages_writer.writeheader()
-
-    for i in range(NUM_MESSAGES):
-        messages_writer.writerow(dict(
-            text=fake.paragraph()[:MAX_WARBLER_LENGTH],
-            timestamp=get_random_datetime(),
-            user_id=randint(1, NUM_USERS)
-        ))
-
-# Generate follows.csv from random pairings of users
-
-with open('generator/follows.csv', 'w') as follows_csv:
-    all_pairs = list(permutations(range(1, NUM_USERS + 1), 2))
-
-    users_writer = csv.DictWriter(follows_csv, fieldnames=FOLLOWS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for followed_user, follower in sample(all_pairs, NUM_FOLLWERS):
-        users_writer.writerow(dict(user_being_followed_id=followed_user, user_following_id=follower))
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,155 @@
 """Support functions for CSV generation."""
 
-from datetime import datetime
-from random import uniform
+import math
+import random
+from datetime import timedelta
 
+WORDS = """
+    about above across after again air all almost along also always among and
+    animal another answer any appear area around ask away back bad base be
+    bear beauty because become bed been before began begin behind best better
+    between big bird black blue boat body book both box boy bring brother
+    build busy call came can car care carry case cat cause center certain
+    change check child city class clear close cold color come common complete
+    contain correct could country course cover cross cry cut dark day decide
+    deep develop did different direction do does dog done door down draw
+    dream drive dry during each early earth east eat end enough even ever
+    every example eye face fact fall family far farm fast father feel feet
+    few field figure fill final find fine fire first fish five fly follow food
+    force form found four free friend from front full game gave get girl give
+    go gold good got govern great green ground group grow half hand happen
+    hard has have he head hear heard heat help her here high him his hold
+    home horse hot hour house how hundred idea if important inch interest
+    island just keep kind king knew know land language large last late laugh
+    lead learn leave left less letter life light like line list listen little
+    live long look lost made main make man many map mark may mean measure men
+    might mile mind minute miss money moon more morning most mother mountain
+    move much music must name near need never new next night north notice now
+    number object ocean off often old once only open order other our out over
+    own page paper part pass pattern people perhaps person picture piece place
+    plain plan plane plant play point port pose possible power press problem
+    produce product pull question quick rain ran reach read ready real record
+    red remember rest right river road rock room round rule run said same saw
+    say school science sea second see seem self sentence serve set several
+    shape ship short should show side simple since sing sit six size sleep
+    slow small snow some song soon sound south space special spell stand star
+    start state stay step still stood stop story street strong study such sun
+    sure surface table tail take talk teach tell ten test than that the their
+    them then there these thing think those though thought thousand three
+    through time today together told too took top toward town travel tree
+    true try turn two under unit until upon use usual very voice vowel wait
+    walk wall want warm was watch water way week weight well went were west
+    what wheel when where which while white who whole why wind window winter
+    wish with wonder wood word work world would write year yes yet you young
+""".split()
 
-def get_random_datetime(year_gap=2):
-    """Get a random datetime within the last few years."""
+FIRST_NAMES = """
+    ada alan alex amy ana ben beth cara chen dan dana eli ella emma eva finn
+    gus hana ian ivy jack jade jay jon kai kim leo lia luca mae max mia nia
+    noah nora omar owen pia quinn ravi rose ruby sam sara sean tara theo tom
+    uma vera wade wren yara yuki zane zoe
+""".split()
 
-    now = datetime.now()
-    then = now.replace(year=now.year - year_gap)
-    random_timestamp = uniform(then.timestamp(), now.timestamp())
+LAST_NAMES = """
+    abbott baker banks bell brooks burke chan clark cole cruz davis diaz
+    ellis evans fox garcia gray hall hayes hill hughes ito james jones kane
+    khan kim lee lopez marsh mills moore nash ng ortiz park patel perez price
+    reed reyes rossi ruiz sato shaw singh smith stone tan torres vega wade
+    walsh ward webb west wong wood young
+""".split()
 
-    return datetime.fromtimestamp(random_timestamp)
+CITIES = """
+    Amsterdam Austin Berlin Boston Cairo Chicago Denver Dublin Lagos Lima
+    Lisbon London Madrid Melbourne Mumbai Nairobi Osaka Oslo Paris Portland
+    Seoul Seattle Sydney Toronto Vancouver Vienna
+""".split()
+
+
+def chunk_rng(seed, kind, chunk):
+    """Get the random generator for one chunk of one kind of row.
+
+    Each chunk has its own, seeded from the overall seed, so the output
+    doesn't depend on how many processes generated it or in what order.
+    """
+
+    return random.Random(f"{seed}:{kind}:{chunk}")
+
+
+def sentence(rng, max_length):
+    """A random sentence (of words from `WORDS`) of at most `max_length` characters."""
+
+    words = rng.choices(WORDS, k=rng.randint(4, 24))
+    text = ' '.join(words).capitalize() + '.'
+    if len(text) > max_length:
+        text = text[:max_length].rsplit(' ', 1)[0] + '.'
+    return text
+
+
+def heavy_tailed_count(rng, mean, cap, alpha=2.0):
+    """A count with a Pareto (power-law) distribution averaging about `mean`.
+
+    Most draws are small and a few are huge, like how much people post,
+    follow or like; `cap` keeps the huge ones sane.
+    """
+
+    if mean <= 0:
+        return 0
+
+    scale = mean * (alpha - 1) / alpha
+    return min(cap, round(scale * rng.paretovariate(alpha)))
+
+
+def zipf_rank(rng, n, exponent):
+    """A rank in 1..n, rank r drawn with probability ~ 1/r**exponent.
+
+    Inverts the continuous power law's CDF, so it needs no table of n
+    weights: O(1) time and memory at any n.
+    """
+
+    u = rng.random()
+    if exponent == 1:
+        rank = math.exp(u * math.log(n + 1))
+    else:
+        power = 1 - exponent
+        rank = (u * ((n + 1) ** power - 1) + 1) ** (1 / power)
+
+    return min(n, int(rank))
+
+
+def scatter(rank, n, multiplier):
+    """Map popularity ranks 1..n onto user ids 1..n, one-to-one.
+
+    So the most followed users aren't simply the first ones created.
+    `multiplier` must share no factor with `n`.
+    """
+
+    return rank * multiplier % n + 1
+
+
+def coprime_multiplier(n):
+    """A large multiplier with no factor in common with `n` (for `scatter`)."""
+
+    multiplier = 2654435761  # Knuth's multiplicative hash constant (a prime)
+    while math.gcd(multiplier, n) != 1:
+        multiplier += 2
+    return multiplier
+
+
+def bursty_times(rng, count, start, span, burst_size=6, gap_minutes=4):
+    """`count` datetimes between `start` and `start + span`, in bursts.
+
+    People post in sessions: a burst starts at a random moment and its
+    posts follow each other a few minutes apart (exponentially
+    distributed), so timelines see clusters rather than an even drizzle.
+    """
+
+    seconds = span.total_seconds()
+    times = []
+
+    while len(times) < count:
+        moment = rng.uniform(0, seconds)
+        for _ in range(min(count - len(times), 1 + int(rng.expovariate(1 / burst_size)))):
+            times.append(start + timedelta(seconds=min(moment, seconds)))
+            moment += rng.expovariate(1 / (gap_minutes * 60))
+
+    return times
@@ -0,0 +1,192 @@
+"""HTTP caching: per-route Cache-Control, ETags and 304s, static files.
+
+Pages that are expensive to render but cheap to fingerprint are wrapped in
+`@conditional(stamp)`. `stamp(**view_args)` returns a few values that
+change whenever the page would (row versions, counters, newest ids), read
+in one small query; they're hashed into an ETag, and a request whose
+`If-None-Match` already has it gets a `304 Not Modified` without the view
+running at all. Those pages are `private, no-cache`: browsers keep them
+but check back every time, and shared caches never store them.
+
+Every other page is `no-store` unless its view sets `g.cache_control`.
+
+Static files linked with `url_for('static', ...)` get a `?v=` content hash
+appended, and built assets (`static/dist/`, see assets.py) have one in
+their names, so they can be cached for a year as `immutable`; a changed
+file gets a new URL. Plain `/static/...` links (e.g. default avatar URLs
+stored in the database) are cached for an hour.
+"""
+
+import hashlib
+import os
+from functools import wraps
+
+from flask import current_app, g, request, session, make_response
+from sqlalchemy import select, or_, false
+
+from models import db, User, Message
+from like_buffer import like_buffer
+
+users = User.__table__
+messages = Message.__table__
+
+DEFAULT_CACHE_CONTROL = 'no-store'
+CONDITIONAL_CACHE_CONTROL = 'private, no-cache'
+STATIC_CACHE_CONTROL = 'public, max-age=3600'
+VERSIONED_STATIC_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+USER_STAMP_COLUMNS = [users.c.id, users.c.version, users.c.messages_count,
+                      users.c.following_count, users.c.followers_count,
+                      users.c.likes_count]
+
+
+def init_app(app):
+    """Set up cache headers and static file versioning for `app`."""
+
+    app.config.setdefault('CACHE_RELEASE', release_stamp(
+        os.path.join(app.root_path, app.template_folder)))
+    static_versions = {}
+
+    @app.url_defaults
+    def add_static_version(endpoint, values):
+        # (dist/ files have the hash in their names already; see assets.py)
+        if endpoint != 'static' or 'v' in values or values['filename'].startswith('dist/'):
+            return
+
+        filename = values['filename']
+        path = os.path.join(app.static_folder, filename)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return
+
+        cached = static_versions.get(filename)
+        if cached is None or cached[0] != mtime:
+            with open(path, 'rb') as f:
+                cached = (mtime, hashlib.sha1(f.read()).hexdigest()[:10])
+            static_versions[filename] = cached
+
+        values['v'] = cached[1]
+
+    @app.after_request
+    def set_cache_control(response):
+        if request.endpoint == 'static':
+            versioned = 'v' in request.args or request.view_args['filename'].startswith('dist/')
+            response.headers['Cache-Control'] = (
+                VERSIONED_STATIC_CACHE_CONTROL if versioned else STATIC_CACHE_CONTROL)
+        else:
+            response.headers['Cache-Control'] = g.get('cache_control', DEFAULT_CACHE_CONTROL)
+
+        return response
+
+
+def release_stamp(template_dir):
+    """Fingerprint the templates, so a deploy that changes them changes ETags."""
+
+    digest = hashlib.sha1()
+
+    for dirpath, _, filenames in sorted(os.walk(template_dir)):
+        for filename in sorted(filenames):
+            stat = os.stat(os.path.join(dirpath, filename))
+            digest.update(f"{dirpath}/{filename}:{stat.st_size}:{stat.st_mtime}".encode())
+
+    return digest.hexdigest()[:10]
+
+
+def make_etag(parts):
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def conditional(stamp):
+    """Decorate a view to answer with 304 if the stamp its ETag came from hasn't changed.
+
+    `stamp` gets the view's arguments and returns the values the page
+    depends on (or None to skip caching this request). Pages with flashed
+    messages waiting are never answered from cache: they'd be lost.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            if session.get('_flashes'):
+                return view(**kwargs)
+
+            parts = stamp(**kwargs)
+            if parts is None:
+                return view(**kwargs)
+
+            # (whose page it is, too: the same stamp can be an author's own
+            # page or, once they've logged out, the anonymous one)
+            viewer_id = g.user.id if g.user else None
+            etag = make_etag((current_app.config['CACHE_RELEASE'], request.full_path,
+                              viewer_id, parts))
+            g.cache_control = CONDITIONAL_CACHE_CONTROL
+
+            if request.if_none_match.contains(etag):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(view(**kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag)
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+##############################################################################
+# Stamps
+#
+# Each returns what its page shows that can change: the user rows it
+# shows (version for profile edits, counters for follows/likes/messages),
+# including the viewer's (whose follows and likes decide its buttons),
+# plus the newest message it lists.
+
+
+def user_stamps(condition, *extra_columns):
+    """Get the stamp columns (plus `extra_columns`) of the users matching `condition`."""
+
+    query = (select(USER_STAMP_COLUMNS + list(extra_columns))
+             .where(condition)
+             .order_by(users.c.id))
+    return [tuple(row) for row in db.session.execute(query)]
+
+
+def is_viewer():
+    """Condition matching the logged-in user's row (if any)."""
+
+    return users.c.id == g.user.id if g.user else false()
+
+
+def profile_stamp(user_id):
+    """Stamp for a user's profile page (their messages, newest first)."""
+
+    newest_message = (select([messages.c.id])
+                      .where(messages.c.user_id == users.c.id)
+                      .order_by(messages.c.timestamp.desc(), messages.c.id.desc())
+                      .limit(1)
+                      .as_scalar())
+
+    return user_stamps(or_(users.c.id == user_id, is_viewer()), newest_message)
+
+
+def message_stamp(message_id):
+    """Stamp for a single message's page (its author, and the viewer)."""
+
+    author_id = select([messages.c.user_id]).where(messages.c.id == message_id).as_scalar()
+
+    return [message_id, user_stamps(or_(users.c.id == author_id, is_viewer()))]
+
+
+def timeline_stamp():
+    """Stamp for the home page: the viewer's timeline and like states."""
+
+    if not g.user:
+        return ['anonymous']
+
+    # (timeline.py keeps these up to date, so this is still one row)
+    return (user_stamps(is_viewer(), users.c.timeline_head_id, users.c.timeline_version)
+            + sorted(like_buffer.pending.get(g.user.id, {}).items()))
@@ -0,0 +1,135 @@
+"""Who's logged in, without a users-table query on every request.
+
+Most requests only need a handful of the current user's columns (for the
+navbar, the home page sidebar, permission checks), so `add_user_to_g`
+gets an `Identity` snapshot of them from a per-worker LRU/TTL cache, and
+`g.user` is a `CurrentUser` wrapping it. Anything not in the snapshot
+(relationships, methods, columns like `email`) loads the full `User` on
+first use; views that change or delete the user work on `g.user.model`.
+
+Snapshots carry `User.version`, which `profile()` bumps and which is
+stored in the session at login. A snapshot older than the session's
+version is reloaded. Changes made in this process (profile
+edits, new/deleted users, counter updates) also drop the snapshot right
+away; changes made in other worker processes are picked up within
+`IDENTITY_CACHE_TTL` seconds.
+
+Deleting a user can't wait that long, though: their other sessions would
+still pass login checks, and what they post or like would fail on foreign
+keys. So requests that write (`verify=True`) check that the user still
+exists even when the snapshot is fresh, which is one primary key lookup.
+"""
+
+from sqlalchemy import event, select
+
+from cache import LRUCache
+from models import db, User
+
+CURR_USER_VERSION_KEY = "curr_user_version"
+
+SNAPSHOT_COLUMNS = ('id', 'version', 'username', 'image_url', 'header_image_url',
+                    'messages_count', 'following_count', 'followers_count',
+                    'likes_count')
+
+snapshots = LRUCache(max_size=10000, ttl=30)
+
+
+class Identity:
+    """The columns of a user that most pages need, detached from the DB."""
+
+    __slots__ = SNAPSHOT_COLUMNS
+
+    def __init__(self, user):
+        for column in SNAPSHOT_COLUMNS:
+            setattr(self, column, getattr(user, column))
+
+    def __repr__(self):
+        return f"<Identity #{self.id}: {self.username} v{self.version}>"
+
+
+class CurrentUser:
+    """The logged-in user: snapshot columns for free, the rest on demand."""
+
+    def __init__(self, identity, model=None):
+        self._identity = identity
+        self._model = model
+
+    @property
+    def model(self):
+        """The full `User` (loaded on first use)."""
+
+        if self._model is None:
+            self._model = User.query.get(self._identity.id)
+        return self._model
+
+    # These batched lookups only need the user's id, so they can run against
+    # the snapshot until the User has been loaded for something else
+
+    def like_states(self, message_ids):
+        """See `User.like_states`."""
+
+        return User.like_states(self._model or self, message_ids)
+
+    def follow_states(self, users):
+        """See `User.follow_states`."""
+
+        return User.follow_states(self._model or self, users)
+
+    def __getattr__(self, name):
+        if name in SNAPSHOT_COLUMNS and self._model is None:
+            return getattr(self._identity, name)
+        return getattr(self.model, name)
+
+    def __repr__(self):
+        return f"<CurrentUser #{self._identity.id}: {self._identity.username}>"
+
+
+def init_app(app):
+    snapshots.ttl = app.config.setdefault('IDENTITY_CACHE_TTL', 30)
+
+
+def load(user_id, version=None, verify=False):
+    """Get a `CurrentUser` for `user_id`, or None if there's no such user.
+
+    `version` is the user's version as of login (or their last profile
+    edit); a cached snapshot older than that is reloaded. With `verify`, a
+    cached snapshot is only used once the user's row is known to exist.
+    """
+
+    identity = snapshots.get(user_id)
+
+    if identity is not None and (version is None or identity.version >= version):
+        if verify and not exists(user_id):
+            forget(user_id)
+            return None
+        return CurrentUser(identity)
+
+    user = User.query.get(user_id)
+    if user is None:
+        forget(user_id)
+        return None
+
+    identity = Identity(user)
+    snapshots.set(user_id, identity)
+    return CurrentUser(identity, user)
+
+
+def exists(user_id):
+    """Is `user_id` still in the database?"""
+
+    users = User.__table__
+    return db.session.execute(
+        select([users.c.id]).where(users.c.id == user_id)).scalar() is not None
+
+
+def forget(user_id):
+    """Drop any cached snapshot of `user_id`."""
+
+    snapshots.delete(user_id)
+
+
+@event.listens_for(User, 'after_insert')
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def forget_changed_user(mapper, connection, user):
+    forget(user.id)
@@ -0,0 +1,171 @@
+"""Per-request SQL instrumentation for Warbler.
+
+Hooks SQLAlchemy engine events to record, for every request:
+
+- how many statements it ran and how long they took in total,
+- its slowest statements,
+- how often each statement shape ran; a shape (SQLAlchemy's statement text,
+  whose parameters are placeholders) that runs `SQL_REPEATED_QUERY_THRESHOLD`
+  times in one request is logged as a likely N+1 query.
+
+Each response gets a `Server-Timing` header with the request's database time
+and query count, statements slower than `SQL_SLOW_QUERY_MS` are logged, and
+per-endpoint totals are served as JSON from `/_internal/metrics`. That
+shows query text, so it's off unless `INTERNAL_METRICS_TOKEN` is set, and
+then only answers requests with an `Authorization: Bearer <token>` header.
+(Not the client address: behind a reverse proxy every request comes from
+127.0.0.1.)
+
+This is cheap enough to leave on in production, unlike SQLALCHEMY_ECHO,
+which prints every statement.
+"""
+
+import hmac
+import logging
+import threading
+import time
+from collections import Counter, deque
+
+from flask import g, request, jsonify, abort, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+
+class QueryStats:
+    """SQL statistics for one request."""
+
+    __slots__ = ('count', 'total_time', 'slowest', 'shapes', 'started')
+
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.slowest = []
+        self.shapes = Counter()
+        self.started = time.perf_counter()
+
+    def record(self, statement, duration, keep_slowest):
+        """Record one statement that took `duration` seconds."""
+
+        self.count += 1
+        self.total_time += duration
+        self.shapes[statement] += 1
+
+        self.slowest.append((duration, statement))
+        self.slowest.sort(key=lambda slow: slow[0], reverse=True)
+        del self.slowest[keep_slowest:]
+
+
+class Metrics:
+    """Process-wide totals, by endpoint."""
+
+    def __init__(self, recent_slow=50):
+        self.lock = threading.Lock()
+        self.endpoints = {}
+        self.recent_slow = deque(maxlen=recent_slow)
+
+    def add_request(self, endpoint, stats, duration):
+        with self.lock:
+            totals = self.endpoints.setdefault(endpoint, {
+                'requests': 0, 'queries': 0, 'db_ms': 0.0, 'total_ms': 0.0,
+            })
+            totals['requests'] += 1
+            totals['queries'] += stats.count
+            totals['db_ms'] += stats.total_time * 1000
+            totals['total_ms'] += duration * 1000
+
+    def add_slow_query(self, statement, duration, endpoint):
+        with self.lock:
+            self.recent_slow.append({
+                'statement': statement,
+                'ms': round(duration * 1000, 2),
+                'endpoint': endpoint,
+            })
+
+    def as_dict(self):
+        with self.lock:
+            endpoints = {}
+            for endpoint, totals in self.endpoints.items():
+                endpoints[endpoint] = dict(
+                    totals,
+                    queries_per_request=totals['queries'] / totals['requests'],
+                    db_ms_per_request=totals['db_ms'] / totals['requests'],
+                )
+            return {
+                'endpoints': endpoints,
+                'recent_slow_queries': list(self.recent_slow),
+            }
+
+
+metrics = Metrics()
+
+
+def current_stats():
+    """Get the SQL statistics of the current request (or None outside one)."""
+
+    if has_request_context():
+        return g.get('query_stats')
+    return None
+
+
+def init_app(app):
+    """Turn on SQL instrumentation for `app`."""
+
+    app.config.setdefault('SQL_SLOW_QUERY_MS', 100)
+    app.config.setdefault('SQL_REPEATED_QUERY_THRESHOLD', 10)
+    app.config.setdefault('SQL_SLOWEST_KEPT', 5)
+    app.config.setdefault('INTERNAL_METRICS_TOKEN', None)
+
+    @event.listens_for(Engine, 'before_cursor_execute')
+    def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    @event.listens_for(Engine, 'after_cursor_execute')
+    def record_query(conn, cursor, statement, parameters, context, executemany):
+        duration = time.perf_counter() - conn.info['query_started'].pop()
+        stats = current_stats()
+        endpoint = request.endpoint if stats is not None else None
+
+        if duration * 1000 >= app.config['SQL_SLOW_QUERY_MS']:
+            logger.warning("Slow query (%.1f ms) in %s: %s",
+                           duration * 1000, endpoint, statement)
+            metrics.add_slow_query(statement, duration, endpoint)
+
+        if stats is None:
+            return
+
+        stats.record(statement, duration, app.config['SQL_SLOWEST_KEPT'])
+
+        if stats.shapes[statement] == app.config['SQL_REPEATED_QUERY_THRESHOLD']:
+            logger.warning("Possible N+1: statement ran %d times in %s: %s",
+                           stats.shapes[statement], endpoint, statement)
+
+    @app.before_request
+    def start_query_stats():
+        g.query_stats = QueryStats()
+
+    @app.after_request
+    def add_server_timing(response):
+        stats = current_stats()
+
+        if stats is not None:
+            duration = time.perf_counter() - stats.started
+            metrics.add_request(request.endpoint, stats, duration)
+            response.headers.add(
+                'Server-Timing',
+                f'db;dur={stats.total_time * 1000:.2f};desc="{stats.count} queries"')
+            response.headers.add('Server-Timing', f'app;dur={duration * 1000:.2f}')
+
+        return response
+
+    @app.route('/_internal/metrics')
+    def internal_metrics():
+        """Show per-endpoint request/query totals and recent slow queries."""
+
+        token = app.config['INTERNAL_METRICS_TOKEN']
+        if not token or not hmac.compare_digest(
+                request.headers.get('Authorization', ''), f'Bearer {token}'):
+            abort(404)
+
+        return jsonify(metrics.as_dict())
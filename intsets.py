@@ -0,0 +1,30 @@
+"""Compact sets of integer ids."""
+
+from array import array
+from bisect import bisect_left
+
+
+class SortedIntSet:
+    """An immutable set of ints stored as one sorted machine-int array.
+
+    Takes 8 bytes per id (a Python set of ints takes several times that)
+    and answers membership with a binary search.
+    """
+
+    __slots__ = ('_ids',)
+
+    def __init__(self, ids=()):
+        self._ids = array('q', sorted(set(ids)))
+
+    def __contains__(self, value):
+        i = bisect_left(self._ids, value)
+        return i < len(self._ids) and self._ids[i] == value
+
+    def __iter__(self):
+        return iter(self._ids)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __repr__(self):
+        return f"<SortedIntSet of {len(self)} ids>"
@@ -0,0 +1,343 @@
+"""Write-coalescing buffer for like/unlike toggles.
+
+Clicking like used to cost a SELECT, an INSERT or DELETE and a commit, all
+contending on the same hot rows when a message goes viral. Instead, clicks
+are recorded here as the state the user wants ((user, message) -> liked?),
+so repeated toggles by the same user collapse into one entry, and the
+buffer is written out in bulk:
+
+- one `INSERT ... ON CONFLICT DO NOTHING` for all new likes,
+- one `DELETE ... WHERE (user_id, message_id) IN (...)` for all unlikes,
+- one `UPDATE ... SET likes_count = likes_count + CASE ...` each for the
+  affected users and messages (counting only rows that really changed).
+
+Until it's committed, `overlay` lets this process answer "has this user
+liked this?" as if it had been, so the user who clicked always sees their
+click. That includes toggles being flushed by another request whose
+transaction hasn't committed yet (`in_flight`), so a quick second click
+still toggles the state the first one left.
+
+How long toggles may wait is set with `LIKE_BUFFER_MAX_AGE` (seconds); the
+default of 0 writes them at the end of the request that made them, which
+still batches but doesn't coalesce across requests. Buffered toggles live in
+this process's memory: set a max age only if losing a few seconds of likes
+on a crash is acceptable, and only behind sticky sessions, since a click
+routed to another worker can't see this one's toggles and would flip the
+database's (stale) state instead. Likes of messages deleted before the
+flush are dropped; if the write fails or is rolled back, the toggles go
+back in the buffer.
+
+The `likes_count` a click reports is the database's count plus that
+click, so other users' unflushed toggles of the same message only show up
+once they're flushed.
+"""
+
+import atexit
+import logging
+import threading
+import time
+from collections import Counter
+
+from sqlalchemy import case, event, select, tuple_
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.util import identity_key
+
+from models import db, User, Message, Likes
+from counters import expire_counters
+
+logger = logging.getLogger(__name__)
+
+users = User.__table__
+messages = Message.__table__
+likes = Likes.__table__
+
+
+class LikeBuffer:
+    """Pending like states, keyed by user id then message id."""
+
+    def __init__(self, max_age=0, max_size=1000):
+        self.max_age = max_age
+        self.max_size = max_size
+        self.pending = {}
+        # Batches flushed into transactions that haven't committed yet
+        self.in_flight = []
+        self.size = 0
+        self.oldest = None
+        self.lock = threading.Lock()
+        self.timer = None
+        self.app = None
+
+    def init_app(self, app):
+        """Configure the buffer from `app.config` and flush it at exit."""
+
+        self.app = app
+        self.max_age = app.config.setdefault('LIKE_BUFFER_MAX_AGE', 0)
+        self.max_size = app.config.setdefault('LIKE_BUFFER_MAX_SIZE', 1000)
+        atexit.register(self.flush_in_background)
+
+    def reset(self):
+        """Forget every buffered and in-flight toggle without writing them."""
+
+        with self.lock:
+            self.pending = {}
+            self.in_flight = []
+            self.size = 0
+            self.oldest = None
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+
+    def set(self, user_id, message_id, liked):
+        """Record that `user_id` wants `message_id` to be liked (or not)."""
+
+        with self.lock:
+            user_pending = self.pending.setdefault(user_id, {})
+            if message_id not in user_pending:
+                self.size += 1
+            user_pending[message_id] = liked
+
+            if self.oldest is None:
+                self.oldest = time.monotonic()
+                self.schedule_flush()
+
+    def overlay(self, user_id, liked_ids, message_ids):
+        """Apply this user's unflushed toggles to a set of liked message ids.
+
+        `liked_ids` is what the database says the user likes among
+        `message_ids`; returns what they'll like once we've flushed.
+        """
+
+        with self.lock:
+            user_pending = {}
+            for batch in self.in_flight + [self.pending]:
+                user_pending.update(batch.get(user_id, {}))
+
+        liked_ids = set(liked_ids)
+        for message_id in message_ids:
+            if message_id in user_pending:
+                if user_pending[message_id]:
+                    liked_ids.add(message_id)
+                else:
+                    liked_ids.discard(message_id)
+
+        return liked_ids
+
+    def is_due(self):
+        """Is it time to flush?"""
+
+        return self.oldest is not None and (
+            self.size >= self.max_size
+            or time.monotonic() - self.oldest >= self.max_age)
+
+    def schedule_flush(self):
+        """Make sure buffered toggles get flushed even if no request comes by."""
+
+        if self.max_age and self.app is not None:
+            self.timer = threading.Timer(self.max_age, self.flush_in_background)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def flush_in_background(self):
+        """Flush and commit from outside a request."""
+
+        if not self.pending:
+            return
+
+        with self.app.app_context():
+            try:
+                self.flush()
+                db.session.commit()
+            except Exception:
+                # (the toggles are back in the buffer for the next flush)
+                db.session.rollback()
+                logger.exception("Failed to flush the like buffer")
+
+    def flush(self):
+        """Write every buffered toggle to the current session in bulk.
+
+        Returns the (likes added, likes removed) that actually changed rows.
+        The caller commits; until then the toggles stay visible to
+        `overlay`, and if the transaction doesn't commit they're restored.
+        """
+
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            self.in_flight.append(pending)
+            self.size = 0
+            self.oldest = None
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+
+        try:
+            added, removed = self.write(pending)
+        except Exception:
+            self.restore(pending)
+            raise
+
+        db.session.info.setdefault('like_buffer_batches', []).append(pending)
+
+        user_deltas = Counter()
+        message_deltas = Counter()
+        for user_id, message_id in added:
+            user_deltas[user_id] += 1
+            message_deltas[message_id] += 1
+        for user_id, message_id in removed:
+            user_deltas[user_id] -= 1
+            message_deltas[message_id] -= 1
+
+        bump_counts(users, user_deltas)
+        bump_counts(messages, message_deltas)
+
+        # These writes skip the ORM, so make sure loaded users/messages notice
+        expire_counters(db.session,
+                        [(users, user_id, 'likes_count') for user_id in user_deltas]
+                        + [(messages, message_id, 'likes_count') for message_id in message_deltas])
+        for user_id in pending:
+            user = db.session.identity_map.get(identity_key(User, user_id))
+            if user is not None:
+                user.forget_liked_messages()
+
+        return added, removed
+
+    def write(self, pending):
+        """Insert and delete the likes for `pending` toggles.
+
+        Returns the (likes added, likes removed) that actually changed rows.
+        """
+
+        to_like = [(user_id, message_id)
+                   for user_id, user_pending in pending.items()
+                   for message_id, liked in user_pending.items() if liked]
+        to_unlike = [(user_id, message_id)
+                     for user_id, user_pending in pending.items()
+                     for message_id, liked in user_pending.items() if not liked]
+
+        # The message (or user) may have been deleted since the click
+        to_like = still_existing(to_like) if to_like else []
+
+        added = insert_likes(to_like) if to_like else []
+        removed = delete_likes(to_unlike) if to_unlike else []
+
+        return added, removed
+
+    def committed(self, pending):
+        """Forget a flushed batch once its transaction has committed."""
+
+        with self.lock:
+            self.in_flight = [batch for batch in self.in_flight if batch is not pending]
+
+    def restore(self, pending):
+        """Put toggles that failed to flush back, behind any made since."""
+
+        with self.lock:
+            self.in_flight = [batch for batch in self.in_flight if batch is not pending]
+            for user_id, user_pending in pending.items():
+                current = self.pending.setdefault(user_id, {})
+                for message_id, liked in user_pending.items():
+                    if message_id not in current:
+                        current[message_id] = liked
+                        self.size += 1
+
+            if self.oldest is None and self.pending:
+                self.oldest = time.monotonic()
+                self.schedule_flush()
+
+
+@event.listens_for(Session, 'after_commit')
+def forget_committed_batches(session):
+    for batch in session.info.pop('like_buffer_batches', []):
+        like_buffer.committed(batch)
+
+
+@event.listens_for(Session, 'after_transaction_end')
+def restore_uncommitted_batches(session, transaction):
+    # (committed batches are gone by now, so these were rolled back or closed)
+    if transaction.parent is None:
+        for batch in session.info.pop('like_buffer_batches', []):
+            like_buffer.restore(batch)
+
+
+def is_postgres():
+    return db.session.get_bind().dialect.name == 'postgresql'
+
+
+def still_existing(pairs):
+    """Keep the (user_id, message_id) pairs whose user and message both exist."""
+
+    user_ids = {user_id for (user_id,) in db.session.execute(
+        select([users.c.id]).where(users.c.id.in_({user_id for user_id, _ in pairs})))}
+    message_ids = {message_id for (message_id,) in db.session.execute(
+        select([messages.c.id]).where(messages.c.id.in_({message_id for _, message_id in pairs})))}
+
+    return [(user_id, message_id) for user_id, message_id in pairs
+            if user_id in user_ids and message_id in message_ids]
+
+
+def insert_likes(pairs):
+    """Insert likes for (user_id, message_id) pairs, skipping existing ones.
+
+    Returns the pairs that were actually inserted.
+    """
+
+    rows = [{'user_id': user_id, 'message_id': message_id}
+            for user_id, message_id in pairs]
+
+    if is_postgres():
+        stmt = (postgresql.insert(likes)
+                .values(rows)
+                .on_conflict_do_nothing(index_elements=['user_id', 'message_id'])
+                .returning(likes.c.user_id, likes.c.message_id))
+        return [tuple(row) for row in db.session.execute(stmt)]
+
+    # Other databases (i.e. SQLite in development): find the new ones first
+    existing = set(tuple(row) for row in db.session.execute(
+        select([likes.c.user_id, likes.c.message_id])
+        .where(tuple_(likes.c.user_id, likes.c.message_id).in_(pairs))))
+    new_rows = [row for row in rows
+                if (row['user_id'], row['message_id']) not in existing]
+
+    if new_rows:
+        db.session.execute(likes.insert(), new_rows)
+
+    return [(row['user_id'], row['message_id']) for row in new_rows]
+
+
+def delete_likes(pairs):
+    """Delete likes for (user_id, message_id) pairs.
+
+    Returns the pairs that were actually deleted.
+    """
+
+    matching = tuple_(likes.c.user_id, likes.c.message_id).in_(pairs)
+
+    if is_postgres():
+        stmt = (likes.delete()
+                .where(matching)
+                .returning(likes.c.user_id, likes.c.message_id))
+        return [tuple(row) for row in db.session.execute(stmt)]
+
+    deleted = [tuple(row) for row in db.session.execute(
+        select([likes.c.user_id, likes.c.message_id]).where(matching))]
+
+    if deleted:
+        db.session.execute(likes.delete().where(matching))
+
+    return deleted
+
+
+def bump_counts(table, deltas):
+    """Add `deltas` ({row id: change}) to `likes_count` of rows in `table`."""
+
+    deltas = {row_id: delta for row_id, delta in deltas.items() if delta}
+
+    if deltas:
+        db.session.execute(table
+                           .update()
+                           .where(table.c.id.in_(deltas))
+                           .values(likes_count=table.c.likes_count
+                                   + case(deltas, value=table.c.id, else_=0)))
+
+
+like_buffer = LikeBuffer()
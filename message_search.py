@@ -0,0 +1,282 @@
+"""Full-text search over message text, for /search and /api/search.
+
+Results are ranked by how well they match, best first, and can be limited
+to one author's messages or to those of the people a user follows.
+
+Only the newest `MAX_CANDIDATES` matches (by id) are ranked, and matches
+older than those can't be found at all; the search page says so. This
+bounds the ranking work (`ts_rank` runs on those candidates only, not on
+every match), but not the matching: the GIN index still finds every
+message with the words, and picking the newest of them means reading
+each one's id. A search for a very common word therefore costs more than
+a rare one; recent messages are usually what people are looking for,
+though, so the horizon rarely shows.
+
+Results are in (rank, id) order, so a page ends with a cursor of
+(rank, message id) and the next page continues after it.
+
+On PostgreSQL, messages have a `search_vector` tsvector column, kept up to
+date by a trigger and indexed with GIN. Queries are parsed with
+`plainto_tsquery`, which wants all of the words (stemmed, and stop words
+dropped), and ranked with `ts_rank`. Other databases (SQLite in
+development) get `MessageIndex`, an in-process inverted index loaded on
+first use and kept up to date by Message mapper events. It matches whole
+words without stemming.
+"""
+
+import base64
+import json
+import re
+import threading
+from collections import Counter
+
+from sqlalchemy import DDL, REAL, cast, event, func, select, tuple_
+
+from models import db, Message, Follows
+from user_search import is_postgres
+import feeds
+
+# The text search configuration (language) of `search_vector`
+SEARCH_CONFIG = 'pg_catalog.english'
+
+# Most matches ranked per search (the newest ones)
+MAX_CANDIDATES = 1000
+
+WORD = re.compile(r'\w+')
+
+messages = Message.__table__
+follows = Follows.__table__
+
+event.listen(messages, 'after_create', DDL(
+    'CREATE INDEX ix_messages_search_vector ON messages USING gin (search_vector)'
+).execute_if(dialect='postgresql'))
+event.listen(messages, 'after_create', DDL(
+    'CREATE TRIGGER messages_search_vector_update '
+    'BEFORE INSERT OR UPDATE OF text ON messages FOR EACH ROW EXECUTE PROCEDURE '
+    f"tsvector_update_trigger(search_vector, '{SEARCH_CONFIG}', text)"
+).execute_if(dialect='postgresql'))
+
+
+##############################################################################
+# Cursors
+
+
+def encode_cursor(rank, message_id):
+    """Build an opaque cursor for a result at (`rank`, `message_id`)."""
+
+    raw = json.dumps([rank, message_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Turn a cursor string back into a (rank, id) tuple.
+
+    Raises ValueError if the cursor is malformed.
+    """
+
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        rank, message_id = json.loads(raw)
+    except (TypeError, UnicodeDecodeError, json.JSONDecodeError, ValueError) as exc:
+        raise ValueError(f"Bad cursor: {cursor!r}") from exc
+
+    if not isinstance(rank, (int, float)) or isinstance(rank, bool) \
+            or not isinstance(message_id, int):
+        raise ValueError(f"Bad cursor: {cursor!r}")
+
+    return rank, message_id
+
+
+##############################################################################
+# Searching
+
+
+def search(q, author_id=None, follower_id=None, after=None, per_page=20):
+    """Find messages matching `q`, best matches first.
+
+    With `author_id`, only that user's messages; with `follower_id`, only
+    messages by people that user follows. `after` is a cursor from a
+    previous page (or None for the first page). Returns
+    `(messages, next_cursor)`, the messages as `feeds.FeedMessage`s;
+    `next_cursor` is None on the last page.
+    """
+
+    q = (q or '').strip()
+    if not q:
+        return [], None
+
+    start = decode_cursor(after) if after else None
+    finder = find_in_db if is_postgres() else local_index.find
+
+    # Grab one extra result so we know whether there's another page
+    found = finder(q, author_id, follower_id, start, per_page + 1)
+
+    next_cursor = None
+    if len(found) > per_page:
+        found = found[:per_page]
+        next_cursor = encode_cursor(*found[-1])
+
+    return feeds.by_ids([message_id for _, message_id in found]), next_cursor
+
+
+def followed_by(follower_id):
+    return select([follows.c.user_being_followed_id]).where(
+        follows.c.user_following_id == follower_id)
+
+
+def find_in_db(q, author_id, follower_id, after, limit):
+    """Get up to `limit` (rank, id) matches for `q` after `after`."""
+
+    query = func.plainto_tsquery(SEARCH_CONFIG, q)
+
+    candidates = select([messages.c.id, messages.c.search_vector])
+    candidates = candidates.where(messages.c.search_vector.op('@@')(query))
+    if author_id is not None:
+        candidates = candidates.where(messages.c.user_id == author_id)
+    if follower_id is not None:
+        candidates = candidates.where(messages.c.user_id.in_(followed_by(follower_id)))
+    candidates = (candidates
+                  .order_by(messages.c.id.desc())
+                  .limit(MAX_CANDIDATES)
+                  .alias('candidates'))
+
+    # Ranked out here so ts_rank only runs on the candidates
+    rank = func.ts_rank(candidates.c.search_vector, query)
+
+    page = select([rank.label('rank'), candidates.c.id])
+    if after:
+        # ts_rank is a float4 (real); the cursor's rank came back from JSON
+        # as a float8, which isn't equal to it, so compare them as reals
+        after_rank, after_id = after
+        page = page.where(tuple_(rank, candidates.c.id)
+                          < tuple_(cast(after_rank, REAL), after_id))
+    page = page.order_by(rank.desc(), candidates.c.id.desc()).limit(limit)
+
+    return [tuple(row) for row in db.session.execute(page)]
+
+
+##############################################################################
+# In-process index (for databases without text search)
+
+
+def words(text):
+    return WORD.findall(text.lower())
+
+
+class MessageIndex:
+    """Inverted index over every message's words, held in memory.
+
+    `postings` maps each word to the ids of the messages containing it, so
+    a search is an intersection of a few sets; `messages` keeps each
+    message's author and word counts, for filtering and ranking (the
+    share of its words that are search terms).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.postings = {}
+        self.messages = {}
+
+    def reset(self):
+        """Forget everything; it's reloaded on next use."""
+
+        with self.lock:
+            self.loaded = False
+            self.postings = {}
+            self.messages = {}
+
+    def load(self):
+        rows = db.session.query(Message.id, Message.user_id, Message.text).all()
+
+        with self.lock:
+            self.postings = {}
+            self.messages = {}
+            for message_id, user_id, text in rows:
+                self._add(message_id, user_id, text)
+            self.loaded = True
+
+    def add(self, message_id, user_id, text):
+        with self.lock:
+            if not self.loaded:
+                return
+            self._remove(message_id)
+            self._add(message_id, user_id, text)
+
+    def remove(self, message_id):
+        with self.lock:
+            if self.loaded:
+                self._remove(message_id)
+
+    def _add(self, message_id, user_id, text):
+        counts = Counter(words(text))
+        self.messages[message_id] = (user_id, counts)
+        for word in counts:
+            self.postings.setdefault(word, set()).add(message_id)
+
+    def _remove(self, message_id):
+        entry = self.messages.pop(message_id, None)
+        if entry is None:
+            return
+        for word in entry[1]:
+            self.postings[word].discard(message_id)
+
+    def find(self, q, author_id, follower_id, after, limit):
+        """Get up to `limit` (rank, id) matches for `q` after `after`."""
+
+        if not self.loaded:
+            self.load()
+
+        terms = set(words(q))
+        if not terms:
+            return []
+
+        authors = None
+        if follower_id is not None:
+            authors = {user_id for (user_id,) in db.session.execute(followed_by(follower_id))}
+
+        with self.lock:
+            candidates = None
+            for term in sorted(terms, key=lambda term: len(self.postings.get(term, ()))):
+                ids = self.postings.get(term, set())
+                candidates = ids.copy() if candidates is None else candidates & ids
+                if not candidates:
+                    return []
+
+            ranked = []
+            for message_id in sorted(candidates, reverse=True):
+                user_id, counts = self.messages[message_id]
+                if author_id is not None and user_id != author_id:
+                    continue
+                if authors is not None and user_id not in authors:
+                    continue
+
+                rank = sum(counts[term] for term in terms) / sum(counts.values())
+                ranked.append((rank, message_id))
+                if len(ranked) == MAX_CANDIDATES:
+                    break
+
+        ranked.sort(reverse=True)
+        if after:
+            ranked = [match for match in ranked if match < tuple(after)]
+        return ranked[:limit]
+
+
+local_index = MessageIndex()
+
+
+@event.listens_for(Message, 'after_insert')
+@event.listens_for(Message, 'after_update')
+def index_message(mapper, connection, message):
+    local_index.add(message.id, message.user_id, message.text)
+
+
+@event.listens_for(Message, 'after_delete')
+def unindex_message(mapper, connection, message):
+    local_index.remove(message.id)
+
+
+@event.listens_for(messages, 'after_create')
+@event.listens_for(messages, 'after_drop')
+def reset_index(target, connection, **kw):
+    local_index.reset()
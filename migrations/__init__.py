@@ -0,0 +1,83 @@
+"""Versioned schema migrations.
+
+Each module in `migrations/versions` is one migration, named
+`NNNN_what_it_does.py`, with an `upgrade(conn)` function that takes the
+database from the previous version's schema to its own. Which ones a
+database has had is recorded in the `schema_migrations` table, and
+`flask db-upgrade` runs the rest, in order, in one transaction (under an
+advisory lock on PostgreSQL, so two deploys can't both run them).
+
+Migrations are never edited once shipped: change the schema by adding
+the next one (and updating models.py to match). A database made from
+scratch with `db.create_all()` already has the latest schema, so it's
+`stamp`ed as having every migration instead (seed.py does this).
+"""
+
+import importlib
+import pkgutil
+from datetime import datetime
+
+from sqlalchemy import select, func
+
+from models import db
+
+# Any constant will do, as long as nothing else locks on it
+ADVISORY_LOCK_ID = 1617091
+
+schema_migrations = db.Table(
+    'schema_migrations',
+    db.Column('version', db.String(100), primary_key=True),
+    db.Column('applied_at', db.DateTime, nullable=False, default=datetime.utcnow),
+)
+
+
+def available():
+    """Get every migration as (version, module), oldest first."""
+
+    from migrations import versions
+
+    found = []
+    for info in pkgutil.iter_modules(versions.__path__):
+        version = info.name.split('_', 1)[0]
+        found.append((version, importlib.import_module(f'{versions.__name__}.{info.name}')))
+
+    return sorted(found, key=lambda migration: migration[0])
+
+
+def applied(conn):
+    """Get the versions already applied to the database on `conn`."""
+
+    schema_migrations.create(conn, checkfirst=True)
+    return {version for (version,) in conn.execute(select([schema_migrations.c.version]))}
+
+
+def upgrade(engine):
+    """Apply every pending migration. Returns the versions applied."""
+
+    with engine.begin() as conn:
+        if conn.dialect.name == 'postgresql':
+            conn.execute(select([func.pg_advisory_xact_lock(ADVISORY_LOCK_ID)]))
+
+        done = applied(conn)
+        ran = []
+
+        for version, migration in available():
+            if version not in done:
+                migration.upgrade(conn)
+                conn.execute(schema_migrations.insert().values(version=version))
+                ran.append(version)
+
+        return ran
+
+
+def stamp(engine):
+    """Record every migration as applied without running any.
+
+    For databases whose tables were just made by `db.create_all()`.
+    """
+
+    with engine.begin() as conn:
+        done = applied(conn)
+        for version, _ in available():
+            if version not in done:
+                conn.execute(schema_migrations.insert().values(version=version))
@@ -0,0 +1,49 @@
+"""The schema Warbler first shipped with.
+
+Only creates the tables that don't exist yet, so it's safe to run on a
+database that was set up with the original `db.create_all()`.
+"""
+
+from sqlalchemy import (MetaData, Table, Column, Integer, Text, String, DateTime,
+                        ForeignKey)
+
+metadata = MetaData()
+
+Table(
+    'users', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('email', Text, nullable=False, unique=True),
+    Column('username', Text, nullable=False, unique=True),
+    Column('image_url', Text),
+    Column('header_image_url', Text),
+    Column('bio', Text),
+    Column('location', Text),
+    Column('password', Text, nullable=False),
+)
+
+Table(
+    'follows', metadata,
+    Column('user_being_followed_id', Integer,
+           ForeignKey('users.id', ondelete='cascade'), primary_key=True),
+    Column('user_following_id', Integer,
+           ForeignKey('users.id', ondelete='cascade'), primary_key=True),
+)
+
+Table(
+    'messages', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('text', String(140), nullable=False),
+    Column('timestamp', DateTime, nullable=False),
+    Column('user_id', Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False),
+)
+
+Table(
+    'likes', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('user_id', Integer, ForeignKey('users.id', ondelete='cascade')),
+    Column('message_id', Integer, ForeignKey('messages.id', ondelete='cascade'), unique=True),
+)
+
+
+def upgrade(conn):
+    metadata.create_all(conn)
@@ -0,0 +1,29 @@
+"""Counter columns on users and messages, and one like per user per message.
+
+The first schema made `likes.message_id` unique, so a message could only
+ever be liked by one user; that's replaced by uniqueness of
+(user_id, message_id). Counters start out recounted from the data.
+"""
+
+USER_COUNTERS = {
+    'messages_count': 'SELECT count(*) FROM messages WHERE messages.user_id = users.id',
+    'following_count': 'SELECT count(*) FROM follows WHERE follows.user_following_id = users.id',
+    'followers_count': 'SELECT count(*) FROM follows WHERE follows.user_being_followed_id = users.id',
+    'likes_count': 'SELECT count(*) FROM likes WHERE likes.user_id = users.id',
+}
+
+
+def upgrade(conn):
+    # (SQLite can't drop constraints; re-seed SQLite databases instead)
+    if conn.dialect.name == 'postgresql':
+        conn.execute('ALTER TABLE likes DROP CONSTRAINT IF EXISTS likes_message_id_key')
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS likes_user_id_message_id_key '
+                 'ON likes (user_id, message_id)')
+
+    for column, recount in USER_COUNTERS.items():
+        conn.execute(f'ALTER TABLE users ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0')
+        conn.execute(f'UPDATE users SET {column} = ({recount})')
+
+    conn.execute('ALTER TABLE messages ADD COLUMN likes_count INTEGER NOT NULL DEFAULT 0')
+    conn.execute('UPDATE messages SET likes_count = '
+                 '(SELECT count(*) FROM likes WHERE likes.message_id = messages.id)')
@@ -0,0 +1,21 @@
+"""Materialized home timelines (see timeline.py), filled from existing data."""
+
+
+def upgrade(conn):
+    conn.execute('''
+        CREATE TABLE timeline_entries (
+            user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+            message_id INTEGER NOT NULL REFERENCES messages (id) ON DELETE CASCADE,
+            timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            PRIMARY KEY (user_id, message_id)
+        )''')
+    conn.execute('CREATE INDEX ix_timeline_entries_user_timestamp '
+                 'ON timeline_entries (user_id, timestamp, message_id)')
+
+    conn.execute('''
+        INSERT INTO timeline_entries (user_id, message_id, timestamp)
+        SELECT messages.user_id, messages.id, messages.timestamp FROM messages
+        UNION ALL
+        SELECT follows.user_following_id, messages.id, messages.timestamp
+        FROM messages
+        JOIN follows ON follows.user_being_followed_id = messages.user_id''')
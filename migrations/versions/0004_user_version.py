@@ -0,0 +1,5 @@
+"""Version number on users, for invalidating cached snapshots (identity.py)."""
+
+
+def upgrade(conn):
+    conn.execute('ALTER TABLE users ADD COLUMN version INTEGER NOT NULL DEFAULT 0')
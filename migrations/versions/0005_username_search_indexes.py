@@ -0,0 +1,12 @@
+"""Indexes for username search (see user_search.py); PostgreSQL only."""
+
+
+def upgrade(conn):
+    if conn.dialect.name != 'postgresql':
+        return
+
+    conn.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    conn.execute('CREATE INDEX IF NOT EXISTS ix_users_username_lower_c '
+                 'ON users (lower(username) COLLATE "C")')
+    conn.execute('CREATE INDEX IF NOT EXISTS ix_users_username_trgm '
+                 'ON users USING gin (lower(username) gin_trgm_ops)')
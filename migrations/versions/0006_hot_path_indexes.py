@@ -0,0 +1,21 @@
+"""Indexes for the queries behind the busiest pages.
+
+- messages (user_id, timestamp DESC, id DESC): a user's profile feed
+- follows (user_following_id, user_being_followed_id): who a user follows
+  (the primary key only covers the other direction)
+- likes (message_id): a message's likes, for deleting it
+  (likes (user_id, message_id) is already indexed by 0002)
+- timeline_entries (message_id): removing a deleted message from timelines
+"""
+
+INDEXES = {
+    'ix_messages_user_timestamp': 'messages (user_id, timestamp DESC, id DESC)',
+    'ix_follows_following': 'follows (user_following_id, user_being_followed_id)',
+    'ix_likes_message_id': 'likes (message_id)',
+    'ix_timeline_entries_message_id': 'timeline_entries (message_id)',
+}
+
+
+def upgrade(conn):
+    for name, columns in INDEXES.items():
+        conn.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {columns}')
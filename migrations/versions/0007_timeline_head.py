@@ -0,0 +1,8 @@
+"""Newest message id in each user's home timeline, for cheap polling (timeline.py)."""
+
+
+def upgrade(conn):
+    conn.execute('ALTER TABLE users ADD COLUMN timeline_head_id INTEGER')
+    conn.execute('UPDATE users SET timeline_head_id = '
+                 '(SELECT max(message_id) FROM timeline_entries '
+                 'WHERE timeline_entries.user_id = users.id)')
@@ -0,0 +1,20 @@
+"""Full-text search vector on messages (see message_search.py).
+
+On PostgreSQL it's a tsvector, filled in for existing messages, kept up to
+date by a trigger and indexed with GIN. Elsewhere it's a plain, unused
+column, so the schema matches the models.
+"""
+
+
+def upgrade(conn):
+    if conn.dialect.name != 'postgresql':
+        conn.execute('ALTER TABLE messages ADD COLUMN search_vector TEXT')
+        return
+
+    conn.execute('ALTER TABLE messages ADD COLUMN search_vector tsvector')
+    conn.execute("UPDATE messages SET search_vector = to_tsvector('pg_catalog.english', text)")
+    conn.execute('CREATE INDEX IF NOT EXISTS ix_messages_search_vector '
+                 'ON messages USING gin (search_vector)')
+    conn.execute('CREATE TRIGGER messages_search_vector_update '
+                 'BEFORE INSERT OR UPDATE OF text ON messages FOR EACH ROW EXECUTE PROCEDURE '
+                 "tsvector_update_trigger(search_vector, 'pg_catalog.english', text)")
@@ -0,0 +1,29 @@
+"""Index of the users each message @mentions (see trending.py).
+
+On PostgreSQL it's filled from existing messages; SQLite databases start
+empty (re-seed them instead).
+"""
+
+
+def upgrade(conn):
+    conn.execute('''
+        CREATE TABLE mentions (
+            user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+            message_id INTEGER NOT NULL REFERENCES messages (id) ON DELETE CASCADE,
+            timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            PRIMARY KEY (user_id, message_id)
+        )''')
+    conn.execute('CREATE INDEX ix_mentions_user_timestamp '
+                 'ON mentions (user_id, timestamp, message_id)')
+    conn.execute('CREATE INDEX ix_mentions_message_id ON mentions (message_id)')
+
+    if conn.dialect.name != 'postgresql':
+        return
+
+    # (the same mentions as trending.MENTION: @word, not preceded by a word character)
+    conn.execute(r'''
+        INSERT INTO mentions (user_id, message_id, timestamp)
+        SELECT DISTINCT users.id, messages.id, messages.timestamp
+        FROM messages
+        CROSS JOIN LATERAL regexp_matches(messages.text, '(^|[^\w])@(\w+)', 'g') AS found (parts)
+        JOIN users ON users.username = found.parts[2]''')
@@ -0,0 +1,14 @@
+"""Remove users following themselves, which is no longer allowed.
+
+Their own messages are already in their timelines (see timeline.py), so
+only the follows rows and the follow counters need fixing.
+"""
+
+
+def upgrade(conn):
+    conn.execute('DELETE FROM follows WHERE user_following_id = user_being_followed_id')
+    conn.execute('UPDATE users SET '
+                 'following_count = (SELECT count(*) FROM follows '
+                 'WHERE follows.user_following_id = users.id), '
+                 'followers_count = (SELECT count(*) FROM follows '
+                 'WHERE follows.user_being_followed_id = users.id)')
@@ -0,0 +1,5 @@
+"""Version number of each user's home timeline, for cheap ETags (http_cache.py)."""
+
+
+def upgrade(conn):
+    conn.execute('ALTER TABLE users ADD COLUMN timeline_version INTEGER NOT NULL DEFAULT 0')
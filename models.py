@@ -2,11 +2,16 @@
 
 from datetime import datetime
 
-from flask_bcrypt import Bcrypt
-from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import object_session
+from sqlalchemy.orm.util import identity_key
 
-bcrypt = Bcrypt()
-db = SQLAlchemy()
+from intsets import SortedIntSet
+from passwords import passwords
+from replicas import RoutingSQLAlchemy
+
+db = RoutingSQLAlchemy()
 
 
 class Follows(db.Model):
@@ -26,6 +31,11 @@ class Follows(db.Model):
         primary_key=True,
     )
 
+    # The primary key covers "who follows X?"; this covers "who does X follow?"
+    __table_args__ = (
+        db.Index('ix_follows_following', 'user_following_id', 'user_being_followed_id'),
+    )
+
 
 class Likes(db.Model):
     """Mapping user likes to warbles."""
@@ -45,7 +55,13 @@ class Likes(db.Model):
     message_id = db.Column(
         db.Integer,
         db.ForeignKey('messages.id', ondelete='cascade'),
-        unique=True
+    )
+
+    # A user can like a message only once (and the like buffer relies on
+    # this for INSERT ... ON CONFLICT DO NOTHING)
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'message_id'),
+        db.Index('ix_likes_message_id', 'message_id'),
     )
 
 
@@ -94,6 +110,61 @@ class User(db.Model):
         nullable=False,
     )
 
+    # Denormalized counts of the relationships below, kept up to date by
+    # counters.py so profile pages don't have to load them to count them
+    messages_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    following_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    followers_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    likes_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    # Bumped when the user edits their profile so cached
+    # snapshots of them (see identity.py) know they're stale
+    version = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    # Id of the newest message in the user's home timeline, kept up to date
+    # by timeline.py so polling for new ones is a primary key lookup
+    timeline_head_id = db.Column(
+        db.Integer,
+    )
+
+    # Bumped by timeline.py whenever the user's home timeline changes other
+    # than by new messages arriving (follows, deletions, authors' profile
+    # edits), so its ETag (see http_cache.py) needn't look at the timeline
+    timeline_version = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
     messages = db.relationship('Message')
 
     followers = db.relationship(
@@ -118,17 +189,70 @@ class User(db.Model):
     def __repr__(self):
         return f"<User #{self.id}: {self.username}, {self.email}>"
 
+    # The follow graph is cached on the instance as sets of user ids, so
+    # checking whether we follow someone is O(1) after a single query for
+    # the ids (rather than loading every followed User to compare them).
+    # The sets are dropped whenever the instance is expired (e.g. on commit)
+    # or the follows involving it change.
+
+    @property
+    def following_ids(self):
+        """Set of ids of the users this user is following."""
+
+        if '_following_ids' not in self.__dict__:
+            self.__dict__['_following_ids'] = frozenset(
+                followed_id for (followed_id,) in db.session
+                .query(Follows.user_being_followed_id)
+                .filter(Follows.user_following_id == self.id))
+
+        return self.__dict__['_following_ids']
+
+    @property
+    def follower_ids(self):
+        """Set of ids of the users following this user."""
+
+        if '_follower_ids' not in self.__dict__:
+            self.__dict__['_follower_ids'] = frozenset(
+                follower_id for (follower_id,) in db.session
+                .query(Follows.user_following_id)
+                .filter(Follows.user_being_followed_id == self.id))
+
+        return self.__dict__['_follower_ids']
+
+    def forget_follow_graph(self):
+        """Drop the cached follow id sets for this user."""
+
+        self.__dict__.pop('_following_ids', None)
+        self.__dict__.pop('_follower_ids', None)
+
     def is_followed_by(self, other_user):
         """Is this user followed by `other_user`?"""
 
-        found_user_list = [user for user in self.followers if user == other_user]
-        return len(found_user_list) == 1
+        return other_user.id in self.follower_ids
 
     def is_following(self, other_user):
         """Is this user following `other_user`?"""
 
-        found_user_list = [user for user in self.following if user == other_user]
-        return len(found_user_list) == 1
+        return other_user.id in self.following_ids
+
+    def follow_states(self, users):
+        """Get {user id: is this user following them?} for a page of `users`.
+
+        Uses the cached following set if we have it; otherwise it asks
+        about just these users in one query instead of loading every id.
+        """
+
+        user_ids = {user.id for user in users}
+
+        if '_following_ids' in self.__dict__ or not user_ids:
+            followed = self.following_ids & user_ids
+        else:
+            followed = {followed_id for (followed_id,) in db.session
+                        .query(Follows.user_being_followed_id)
+                        .filter(Follows.user_following_id == self.id)
+                        .filter(Follows.user_being_followed_id.in_(user_ids))}
+
+        return {user_id: user_id in followed for user_id in user_ids}
 
     @classmethod
     def signup(cls, username, email, password, image_url):
@@ -137,7 +261,7 @@ class User(db.Model):
         Hashes password and adds user to system.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = passwords.hash(password)
 
         user = User(
             username=username,
@@ -158,21 +282,64 @@ class User(db.Model):
         and, if it finds such a user, returns that user object.
 
         If can't find matching user (or if password is wrong), returns False.
+
+        If the user's password hash is weaker than we'd make it today, it's
+        replaced with a fresh one (the caller commits).
         """
 
         user = cls.query.filter_by(username=username).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = passwords.check(password, user.password)
             if is_auth:
+                if passwords.needs_rehash(user.password):
+                    user.password = passwords.hash(password)
                 return user
 
         return False
 
+    # Like the follow graph, the ids of liked messages are cached on the
+    # instance (as a compact sorted array) and dropped when likes change.
+
+    @property
+    def liked_message_ids(self):
+        """Sorted set of ids of the messages this user has liked."""
+
+        if '_liked_message_ids' not in self.__dict__:
+            self.__dict__['_liked_message_ids'] = SortedIntSet(
+                message_id for (message_id,) in db.session
+                .query(Likes.message_id)
+                .filter(Likes.user_id == self.id))
+
+        return self.__dict__['_liked_message_ids']
+
+    def forget_liked_messages(self):
+        """Drop the cached liked message ids for this user."""
+
+        self.__dict__.pop('_liked_message_ids', None)
+
+    def like_states(self, message_ids):
+        """Get the subset of `message_ids` that this user has liked.
+
+        Uses the cached liked ids if we have them; otherwise it asks about
+        just these messages in one query instead of loading every like.
+        """
+
+        message_ids = set(message_ids)
+
+        if '_liked_message_ids' in self.__dict__ or not message_ids:
+            return {message_id for message_id in message_ids
+                    if message_id in self.liked_message_ids}
+
+        return {message_id for (message_id,) in db.session
+                .query(Likes.message_id)
+                .filter(Likes.user_id == self.id)
+                .filter(Likes.message_id.in_(message_ids))}
+
     def has_liked_message(self, message):
         """Return True if this user has liked the given message."""
 
-        return message in self.likes
+        return message.id in self.like_states([message.id])
 
     def like_message(self, message):
         """Add a like for this user to the given message."""
@@ -180,6 +347,7 @@ class User(db.Model):
         like = Likes(user_id=self.id, message_id=message.id)
         db.session.add(like)
         message.likes.append(like)
+        self.forget_liked_messages()
 
     def unlike_message(self, message):
         """Remove a like for this user from the given message."""
@@ -187,6 +355,67 @@ class User(db.Model):
         like = Likes.query.filter_by(user_id=self.id, message_id=message.id).first()
         db.session.delete(like)
         message.likes.remove(like)
+        self.forget_liked_messages()
+
+
+@event.listens_for(User, 'expire')
+def forget_follow_graph_on_expire(user, attrs):
+    """Drop cached follow ids when the user is expired (e.g. on commit)."""
+
+    # (the user may already have been garbage collected)
+    if user is not None:
+        user.forget_follow_graph()
+        user.forget_liked_messages()
+
+
+@event.listens_for(User, 'refresh')
+def forget_follow_graph_on_refresh(user, context, attrs):
+    """Drop cached follow ids when the user is reloaded from the database."""
+
+    user.forget_follow_graph()
+    user.forget_liked_messages()
+
+
+@event.listens_for(User.following, 'append')
+@event.listens_for(User.following, 'remove')
+@event.listens_for(User.followers, 'append')
+@event.listens_for(User.followers, 'remove')
+def forget_follow_graph_on_change(user, other_user, initiator):
+    """Drop cached follow ids when following/followers collections change."""
+
+    user.forget_follow_graph()
+    other_user.forget_follow_graph()
+
+
+@event.listens_for(Follows, 'after_insert')
+@event.listens_for(Follows, 'after_delete')
+def forget_follow_graph_on_flush(mapper, connection, follow):
+    """Drop cached follow ids of loaded users when a Follows row changes."""
+
+    session = object_session(follow)
+
+    for user_id in (follow.user_following_id, follow.user_being_followed_id):
+        user = session.identity_map.get(identity_key(User, user_id))
+        if user is not None:
+            user.forget_follow_graph()
+
+
+@event.listens_for(User.likes, 'append')
+@event.listens_for(User.likes, 'remove')
+def forget_liked_messages_on_change(user, message, initiator):
+    """Drop cached liked ids when the likes collection changes."""
+
+    user.forget_liked_messages()
+
+
+@event.listens_for(Likes, 'after_insert')
+@event.listens_for(Likes, 'after_delete')
+def forget_liked_messages_on_flush(mapper, connection, like):
+    """Drop cached liked ids of a loaded user when a Likes row changes."""
+
+    user = object_session(like).identity_map.get(identity_key(User, like.user_id))
+    if user is not None:
+        user.forget_liked_messages()
 
 
 class Message(db.Model):
@@ -207,7 +436,7 @@ class Message(db.Model):
     timestamp = db.Column(
         db.DateTime,
         nullable=False,
-        default=datetime.utcnow(),
+        default=datetime.utcnow,
     )
 
     user_id = db.Column(
@@ -216,10 +445,112 @@ class Message(db.Model):
         nullable=False,
     )
 
+    # Denormalized count of `likes`, kept up to date by counters.py and
+    # like_buffer.py
+    likes_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    # The words of `text`, for full-text search: on PostgreSQL, a tsvector
+    # kept up to date by a trigger (see message_search.py); unused elsewhere.
+    # Deferred, since nothing but the search query reads it.
+    search_vector = db.deferred(db.Column(
+        db.Text().with_variant(postgresql.TSVECTOR(), 'postgresql'),
+    ))
+
     user = db.relationship('User')
 
     likes = db.relationship('Likes', backref='message', lazy='dynamic')
 
+    def serialize(self):
+        """Serialize this message (and its author) to a dict for JSON."""
+
+        return {
+            'id': self.id,
+            'text': self.text,
+            'timestamp': self.timestamp.isoformat(),
+            'likes_count': self.likes_count,
+            'user': {
+                'id': self.user.id,
+                'username': self.user.username,
+                'image_url': self.user.image_url,
+            },
+        }
+
+
+# A user's messages, newest first (their profile page)
+db.Index('ix_messages_user_timestamp',
+         Message.user_id, Message.timestamp.desc(), Message.id.desc())
+
+
+class TimelineEntry(db.Model):
+    """A message materialized into one user's home timeline.
+
+    Rows are written when a message is posted (one per follower, plus the
+    author), so the home page is a single range scan over this table.
+    """
+
+    __tablename__ = 'timeline_entries'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+    __table_args__ = (
+        db.Index('ix_timeline_entries_user_timestamp',
+                 'user_id', 'timestamp', 'message_id'),
+        db.Index('ix_timeline_entries_message_id', 'message_id'),
+    )
+
+
+class Mention(db.Model):
+    """A user @mentioned in a message.
+
+    Rows are written when the message is posted (see trending.py), so a
+    user's mentions are a range scan here rather than a search of every
+    message's text.
+    """
+
+    __tablename__ = 'mentions'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+    __table_args__ = (
+        db.Index('ix_mentions_user_timestamp', 'user_id', 'timestamp', 'message_id'),
+        db.Index('ix_mentions_message_id', 'message_id'),
+    )
+
 
 def connect_db(app):
     """Connect this database to provided Flask app.
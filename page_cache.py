@@ -0,0 +1,218 @@
+"""Whole-page cache for anonymous visitors.
+
+Someone without a session cookie sees exactly the same profile, message
+or home page as every other anonymous visitor, so when a link to one is
+shared widely there's no point rendering it for each of them. Views
+decorated with `@page_cache.cached(tags...)` are answered for those
+requests straight from a cache, before `add_user_to_g` or the view run.
+
+Entries expire after `PAGE_CACHE_TTL` seconds, and sooner if one of their
+tags is invalidated. Tags name what a page shows: `user:<id>` for a user's
+row and messages, `message:<id>` for a message. The decorator's tags are
+formatted with the view's arguments (`'user:{user_id}'`), and a view can
+add more while rendering with `page_cache.tag()`. Committing a change to a
+user or message (including its counters) invalidates its tag.
+
+While one request renders a page that isn't cached, other anonymous
+requests for it wait (up to `PAGE_CACHE_WAIT` seconds) for that render
+rather than starting their own, so a spike of misses costs one render.
+
+Each tag's current version is a number from a counter, kept in an LRU of
+`PAGE_CACHE_MAX_TAGS` tags, so tags of users and messages nobody looks at
+any more don't pile up. Invalidating a tag drops its version, and a page
+whose tag has no version (invalidated or evicted) is treated as changed;
+the next page to use the tag gets a new number, never an old one.
+
+The cache and its tags are per process: a change committed by another
+worker is only seen here once entries expire, so keep the TTL short.
+"""
+
+import itertools
+import threading
+
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from cache import LRUCache
+from models import User, Message
+
+
+class PageCache:
+    """Rendered anonymous responses, keyed by path and query string."""
+
+    def __init__(self, ttl=30, max_pages=1000, max_tags=10000, wait=5):
+        self.pages = LRUCache(max_pages, ttl)
+        self.wait = wait
+        self.tag_versions = LRUCache(max_tags, ttl=None)
+        self.next_version = itertools.count()
+        self.rendering = {}
+        self.lock = threading.Lock()
+
+    def init_app(self, app):
+        """Serve cached pages in `app` (before any other request hooks run)."""
+
+        self.pages.ttl = app.config.setdefault('PAGE_CACHE_TTL', 30)
+        self.pages.max_size = app.config.setdefault('PAGE_CACHE_MAX_PAGES', 1000)
+        self.tag_versions.max_size = app.config.setdefault('PAGE_CACHE_MAX_TAGS', 10000)
+        self.wait = app.config.setdefault('PAGE_CACHE_WAIT', 5)
+
+        def cacheable():
+            view = app.view_functions.get(request.endpoint)
+            return (request.method == 'GET'
+                    and hasattr(view, 'page_cache_tags')
+                    and app.session_cookie_name not in request.cookies)
+
+        @app.before_request
+        def serve_cached_page():
+            if not cacheable():
+                return None
+
+            key = request.full_path
+            response = self.cached_response(app, key)
+            if response is not None:
+                return response
+
+            if not self.start_render(key):
+                # Someone else was rendering it: use theirs, or (if they
+                # couldn't cache it) render it without caching
+                return self.cached_response(app, key)
+
+            view = app.view_functions[request.endpoint]
+            g.page_cache_key = key
+            g.page_cache_tags = {}
+            self.tag(*(tag.format(**request.view_args) for tag in view.page_cache_tags))
+            return None
+
+        @app.after_request
+        def store_page(response):
+            key = g.pop('page_cache_key', None)
+            if key is None:
+                return response
+
+            if response.status_code == 200 and not response.direct_passthrough \
+                    and 'Set-Cookie' not in response.headers:
+                headers = [(name, value) for name, value in response.headers
+                           if name not in ('Content-Length', 'Set-Cookie')]
+                self.pages.set(key, (response.get_data(), headers,
+                                     g.get('cache_control'), g.page_cache_tags))
+            self.finish_render(key)
+            return response
+
+        @app.teardown_request
+        def finish_failed_render(exc):
+            key = g.pop('page_cache_key', None)
+            if key is not None:
+                self.finish_render(key)
+
+    def cached(self, *tags):
+        """Decorate a view to cache the pages it shows anonymous visitors."""
+
+        def decorator(view):
+            view.page_cache_tags = tags
+            return view
+
+        return decorator
+
+    def tag(self, *tags):
+        """Also invalidate the page being rendered when any of `tags` is."""
+
+        if 'page_cache_tags' in g:
+            for tag in tags:
+                g.page_cache_tags[tag] = self.tag_version(tag)
+
+    def tag_version(self, tag):
+        """Get the current version of `tag`, starting one if it has none."""
+
+        with self.lock:
+            version = self.tag_versions.get(tag)
+            if version is None:
+                version = next(self.next_version)
+                self.tag_versions.set(tag, version)
+            return version
+
+    def invalidate(self, *tags):
+        """Stop serving every cached page with any of `tags`."""
+
+        # A tag without a version matches no cached page; the next page
+        # that uses it starts a new one
+        with self.lock:
+            for tag in tags:
+                self.tag_versions.delete(tag)
+
+    def cached_response(self, app, key):
+        """Get a response for the page cached under `key`, if it's still good."""
+
+        entry = self.pages.get(key)
+        if entry is None:
+            return None
+
+        body, headers, cache_control, tags = entry
+        # (a tag that's been evicted counts as changed)
+        if any(self.tag_versions.get(tag) != version for tag, version in tags.items()):
+            self.pages.delete(key)
+            return None
+
+        if cache_control is not None:
+            g.cache_control = cache_control
+
+        response = app.response_class(body, headers=headers)
+        response.headers['X-Page-Cache'] = 'hit'
+        return response.make_conditional(request.environ)
+
+    def start_render(self, key):
+        """Claim rendering `key`, or wait for whoever has. True if it's ours."""
+
+        with self.lock:
+            done = self.rendering.get(key)
+            if done is None:
+                self.rendering[key] = threading.Event()
+                return True
+
+        done.wait(self.wait)
+        return False
+
+    def finish_render(self, key):
+        with self.lock:
+            done = self.rendering.pop(key, None)
+        if done is not None:
+            done.set()
+
+
+page_cache = PageCache()
+
+
+##############################################################################
+# Invalidating on commit
+#
+# Tags are collected as changes are flushed but only invalidated once
+# they're committed; invalidating earlier would let a page rendered from
+# the old rows in between be cached as current.
+
+
+def invalidate_on_commit(session, tags):
+    """Invalidate `tags` when `session` commits."""
+
+    session.info.setdefault('page_cache_tags', set()).update(tags)
+
+
+@event.listens_for(Session, 'after_flush')
+def collect_changed_pages(session, flush_context):
+    tags = []
+    for obj in session.new | session.dirty | session.deleted:
+        if isinstance(obj, User):
+            tags.append(f'user:{obj.id}')
+        elif isinstance(obj, Message):
+            tags += [f'message:{obj.id}', f'user:{obj.user_id}']
+
+    invalidate_on_commit(session, tags)
+
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_committed_pages(session):
+    page_cache.invalidate(*session.info.pop('page_cache_tags', ()))
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_changed_pages(session):
+    session.info.pop('page_cache_tags', None)
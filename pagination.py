@@ -0,0 +1,76 @@
+"""Keyset (cursor) pagination for message feeds.
+
+Feeds are ordered newest first by `(timestamp, id)`. A page ends with a
+cursor naming its last row, and the next page asks for rows that sort
+strictly after it. That is one indexed range scan, so every page costs the
+same no matter how far back the user has scrolled (unlike OFFSET, which
+reads and throws away every row before the page).
+"""
+
+from datetime import datetime
+
+from sqlalchemy import tuple_
+
+CURSOR_TIMESTAMP_FORMAT = '%Y%m%d%H%M%S%f'
+
+
+def encode_cursor(timestamp, row_id):
+    """Build an opaque cursor string for a row at (`timestamp`, `row_id`)."""
+
+    return f"{timestamp.strftime(CURSOR_TIMESTAMP_FORMAT)}-{row_id}"
+
+
+def decode_cursor(cursor):
+    """Turn a cursor string back into a (timestamp, id) tuple.
+
+    Raises ValueError if the cursor is malformed.
+    """
+
+    timestamp, _, row_id = cursor.partition('-')
+    return datetime.strptime(timestamp, CURSOR_TIMESTAMP_FORMAT), int(row_id)
+
+
+def paginate(query, timestamp_col, id_col, before=None, per_page=100):
+    """Return one newest-first page of `query` and the cursor for the next.
+
+    `before` is a cursor from a previous page (or None for the first page).
+    Returns `(items, next_cursor)`; `next_cursor` is None on the last page.
+    Items must have `timestamp` and `id` attributes matching the columns.
+    """
+
+    if before:
+        query = query.filter(tuple_(timestamp_col, id_col) < tuple_(*decode_cursor(before)))
+
+    # Grab one extra row so we know whether there's another page
+    items = (query
+             .order_by(timestamp_col.desc(), id_col.desc())
+             .limit(per_page + 1)
+             .all())
+
+    return split_page(items, per_page)
+
+
+def page_select(select, timestamp_col, id_col, before=None, per_page=100):
+    """Limit a Core `select` to the page `paginate` would fetch.
+
+    Pass the rows it returns (as items with `timestamp` and `id`) to
+    `split_page`.
+    """
+
+    if before:
+        select = select.where(tuple_(timestamp_col, id_col) < tuple_(*decode_cursor(before)))
+
+    return (select
+            .order_by(timestamp_col.desc(), id_col.desc())
+            .limit(per_page + 1))
+
+
+def split_page(items, per_page):
+    """Split a page fetched with one extra row into `(items, next_cursor)`."""
+
+    if len(items) <= per_page:
+        return items, None
+
+    items = items[:per_page]
+    last = items[-1]
+    return items, encode_cursor(last.timestamp, last.id)
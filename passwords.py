@@ -0,0 +1,145 @@
+"""Password hashing on a bounded pool of CPUs.
+
+bcrypt is slow on purpose (a few hundred ms per hash), so a burst of
+signups/logins can eat every CPU and stall requests that have nothing to
+do with passwords. `PasswordHasher` runs hashes on a small process pool
+and admits at most `PASSWORD_HASH_MAX_PENDING` of them at once (running or
+queued); past that, callers wait up to `PASSWORD_HASH_WAIT` seconds for a
+slot and then get `PasswordHasherBusy` (which the app turns into a 503),
+instead of piling up behind each other.
+
+This isolates the CPU, not the request: the request thread still waits
+for its hash, so a login ties up a server worker for as long as before.
+What it buys is that other requests keep their CPUs meanwhile.
+
+The bcrypt cost ("log rounds") is `BCRYPT_LOG_ROUNDS` if set; otherwise
+it's calibrated at startup so one hash takes about `BCRYPT_TARGET_MS` on
+this machine, and never less than `BCRYPT_MIN_LOG_ROUNDS`. Hashes with a
+lower cost than that (e.g. the seed data's `$2b$12$...`) are upgraded the
+next time their owner logs in (see `User.authenticate`).
+
+Set `PASSWORD_HASH_WORKERS` to 0 to hash inline (handy for tests and the
+shell).
+"""
+
+import math
+import os
+import statistics
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import bcrypt
+
+
+class PasswordHasherBusy(Exception):
+    """Too many passwords are waiting to be hashed; try again shortly."""
+
+
+def hash_password(password, rounds):
+    return bcrypt.hashpw(password.encode('utf-8'),
+                         bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def check_password(password, hashed):
+    try:
+        return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+    except ValueError:
+        # Not a bcrypt hash at all
+        return False
+
+
+def hash_rounds(hashed):
+    """Get the cost of a `$2b$12$...` style hash (or 0 if it isn't one)."""
+
+    try:
+        return int(hashed.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return 0
+
+
+def calibrate(target_ms, min_rounds, sample_rounds=8, samples=5):
+    """Find the cost at which one hash takes about `target_ms` here.
+
+    Each extra round doubles the time, so a few cheap samples are enough;
+    the median of them, so one slow one (a busy machine while booting)
+    doesn't set the cost.
+    """
+
+    timings = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        hash_password('calibration', sample_rounds)
+        timings.append((time.perf_counter() - started) * 1000)
+    sample_ms = statistics.median(timings)
+
+    rounds = sample_rounds + int(math.log2(target_ms / sample_ms))
+    return max(min_rounds, min(rounds, 31))
+
+
+class PasswordHasher:
+    """Hashes and checks passwords on a bounded process pool."""
+
+    def __init__(self, rounds=12, workers=0, max_pending=1, wait=0):
+        self.rounds = rounds
+        self.workers = workers
+        self.wait = wait
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.pool = None
+        self.pool_lock = threading.Lock()
+
+    def init_app(self, app):
+        """Configure from `app.config`, calibrating the cost if needed."""
+
+        min_rounds = app.config.setdefault('BCRYPT_MIN_LOG_ROUNDS', 12)
+        target_ms = app.config.setdefault('BCRYPT_TARGET_MS', 250)
+        self.workers = app.config.setdefault('PASSWORD_HASH_WORKERS', os.cpu_count() or 1)
+        max_pending = app.config.setdefault('PASSWORD_HASH_MAX_PENDING', 4 * max(self.workers, 1))
+        self.wait = app.config.setdefault('PASSWORD_HASH_WAIT', 2)
+
+        rounds = app.config.get('BCRYPT_LOG_ROUNDS')
+        if rounds is None:
+            rounds = calibrate(target_ms, min_rounds)
+        self.rounds = app.config['BCRYPT_LOG_ROUNDS'] = rounds
+
+        self.slots = threading.BoundedSemaphore(max_pending)
+
+    def run(self, fn, *args):
+        """Run `fn(*args)` on the pool (or inline, with no workers).
+
+        Blocks the calling thread until the result is in.
+        """
+
+        if not self.slots.acquire(timeout=self.wait):
+            raise PasswordHasherBusy()
+
+        try:
+            if not self.workers:
+                return fn(*args)
+
+            # Started on first use, so workers fork from a fully-loaded app
+            with self.pool_lock:
+                if self.pool is None:
+                    self.pool = ProcessPoolExecutor(self.workers)
+
+            return self.pool.submit(fn, *args).result()
+        finally:
+            self.slots.release()
+
+    def hash(self, password):
+        """Hash `password` at the current cost."""
+
+        return self.run(hash_password, password, self.rounds)
+
+    def check(self, password, hashed):
+        """Does `password` match `hashed`?"""
+
+        return self.run(check_password, password, hashed)
+
+    def needs_rehash(self, hashed):
+        """Was `hashed` made with less work than we'd use now?"""
+
+        return hash_rounds(hashed) < self.rounds
+
+
+passwords = PasswordHasher()
@@ -0,0 +1,285 @@
+"""Publish/subscribe for live updates, streamed as Server-Sent Events.
+
+Publishers send a string to a channel with `broker.publish(channel, data)`;
+everyone subscribed to that channel gets it. New messages go out on their
+author's channel, `messages:<user id>`, so a home timeline stream
+subscribes to the channels of its user and everyone they follow (one
+publish per message, however many followers read it).
+
+Every process keeps its own subscribers. How a publish reaches the other
+processes is set by `PUBSUB_URL`:
+
+- `memory://` (the default): it doesn't; for a single process,
+- `redis://host:port/db`: Redis PUBLISH (needs the `redis` package),
+- `postgresql://...`: Postgres NOTIFY, so the database can stand in for
+  Redis (usually `PUBSUB_URL=$DATABASE_URL`).
+
+With Redis or Postgres, each process has one listener thread (started by
+its first subscriber) that hears every event and hands it to the local
+subscribers of its channel.
+
+Each subscriber's queue holds at most `PUBSUB_MAX_BUFFER_BYTES` of events.
+A subscriber that doesn't keep up (say, a client on a stalled connection)
+is dropped when it would go over, rather than letting its queue grow
+without bound: its stream sends a `dropped` event and ends.
+
+A stream holds on to a server thread (but not a database connection) for
+as long as it's open, so serve the app with enough threads, or something
+asynchronous, for the streams you expect. Streams end after
+`STREAM_MAX_SECONDS`, and browsers reconnect, which also picks up any
+follows since.
+"""
+
+import json
+import logging
+import select
+import threading
+import time
+from collections import defaultdict, deque
+
+from sqlalchemy import create_engine, text
+
+logger = logging.getLogger(__name__)
+
+# The one Postgres NOTIFY channel every event is sent on
+NOTIFY_CHANNEL = 'warbler_pubsub'
+
+# Prefix of Redis channel names
+REDIS_PREFIX = 'warbler:'
+
+# How long browsers wait before reconnecting to a stream that ended
+RETRY_MS = 3000
+
+
+class SlowConsumer(Exception):
+    """The subscriber fell too far behind and was dropped."""
+
+
+class Subscription:
+    """One subscriber's queue of `(channel, data)` events."""
+
+    def __init__(self, channels, max_bytes):
+        self.channels = frozenset(channels)
+        self.max_bytes = max_bytes
+        self.queue = deque()
+        self.queued_bytes = 0
+        self.dropped = False
+        self.ready = threading.Condition()
+
+    def put(self, channel, data):
+        with self.ready:
+            if self.dropped:
+                return
+
+            if self.queued_bytes + len(data) > self.max_bytes:
+                self.dropped = True
+                self.queue.clear()
+                self.queued_bytes = 0
+            else:
+                self.queue.append((channel, data))
+                self.queued_bytes += len(data)
+
+            self.ready.notify()
+
+    def get(self, timeout):
+        """Wait up to `timeout` seconds for events, and take all of them.
+
+        Returns a list, empty if none came; raises `SlowConsumer` if this
+        subscription has been dropped.
+        """
+
+        with self.ready:
+            if not self.queue and not self.dropped:
+                self.ready.wait(timeout)
+
+            if self.dropped:
+                raise SlowConsumer()
+
+            events = list(self.queue)
+            self.queue.clear()
+            self.queued_bytes = 0
+            return events
+
+
+class Broker:
+    """This process's subscriptions, by channel."""
+
+    def __init__(self, max_bytes=64 * 1024):
+        self.max_bytes = max_bytes
+        self.heartbeat = 15
+        self.max_seconds = 300
+        self.transport = None
+        self.subscriptions = defaultdict(set)
+        self.lock = threading.Lock()
+        self.listening = False
+
+    def init_app(self, app):
+        """Configure the broker from `app.config`."""
+
+        url = app.config.setdefault('PUBSUB_URL', 'memory://')
+        self.max_bytes = app.config.setdefault('PUBSUB_MAX_BUFFER_BYTES', 64 * 1024)
+        self.heartbeat = app.config.setdefault('STREAM_HEARTBEAT', 15)
+        self.max_seconds = app.config.setdefault('STREAM_MAX_SECONDS', 300)
+        self.transport = make_transport(url)
+        self.listening = False
+
+    def publish(self, channel, data):
+        """Send `data` (a string) to the subscribers of `channel`, everywhere."""
+
+        if self.transport is None:
+            self.deliver(channel, data)
+        else:
+            self.transport.publish(channel, data)
+
+    def deliver(self, channel, data):
+        """Hand an event to this process's subscribers of `channel`."""
+
+        with self.lock:
+            subscriptions = list(self.subscriptions.get(channel, ()))
+
+        for subscription in subscriptions:
+            subscription.put(channel, data)
+
+    def subscribe(self, channels):
+        """Start queueing events sent to any of `channels`. Returns a `Subscription`."""
+
+        subscription = Subscription(channels, self.max_bytes)
+
+        with self.lock:
+            for channel in subscription.channels:
+                self.subscriptions[channel].add(subscription)
+
+            if self.transport is not None and not self.listening:
+                self.listening = True
+                threading.Thread(target=self.transport.listen, args=(self.deliver,),
+                                 daemon=True).start()
+
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            for channel in subscription.channels:
+                subscriptions = self.subscriptions.get(channel)
+                if subscriptions is not None:
+                    subscriptions.discard(subscription)
+                    if not subscriptions:
+                        del self.subscriptions[channel]
+
+    def stream(self, subscription):
+        """Yield `subscription`'s events as Server-Sent Events, then unsubscribe.
+
+        Each event's data goes out as a `message`; a comment is sent every
+        `heartbeat` seconds without any, so dead connections are noticed.
+        """
+
+        deadline = time.monotonic() + self.max_seconds
+
+        try:
+            yield f"retry: {RETRY_MS}\n\n"
+
+            while time.monotonic() < deadline:
+                try:
+                    events = subscription.get(self.heartbeat)
+                except SlowConsumer:
+                    yield "event: dropped\ndata: {}\n\n"
+                    return
+
+                if not events:
+                    yield ": keepalive\n\n"
+                for _, data in events:
+                    yield f"data: {data}\n\n"
+
+        finally:
+            self.unsubscribe(subscription)
+
+
+class RedisTransport:
+    """Events sent between processes with Redis PUBLISH."""
+
+    def __init__(self, url):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+
+    def publish(self, channel, data):
+        self.client.publish(REDIS_PREFIX + channel, data.encode('utf-8'))
+
+    def listen(self, deliver):
+        while True:
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe(REDIS_PREFIX + '*')
+                for message in pubsub.listen():
+                    channel = message['channel'].decode('utf-8')[len(REDIS_PREFIX):]
+                    deliver(channel, message['data'].decode('utf-8'))
+            except Exception:
+                logger.exception("Lost the Redis pubsub connection; reconnecting")
+                time.sleep(1)
+
+
+class PostgresTransport:
+    """Events sent between processes with Postgres NOTIFY."""
+
+    def __init__(self, url):
+        self.engine = create_engine(url, pool_size=2)
+
+    def publish(self, channel, data):
+        # (notifications are sent on commit; payloads must be under 8000 bytes)
+        with self.engine.begin() as conn:
+            conn.execute(text("SELECT pg_notify(:name, :payload)"),
+                         name=NOTIFY_CHANNEL, payload=json.dumps([channel, data]))
+
+    def listen(self, deliver):
+        while True:
+            try:
+                self.listen_once(deliver)
+            except Exception:
+                logger.exception("Lost the Postgres LISTEN connection; reconnecting")
+                time.sleep(1)
+
+    def listen_once(self, deliver):
+        # A connection of its own, out of the pool for good
+        fairy = self.engine.raw_connection()
+        fairy.detach()
+        conn = fairy.connection
+
+        try:
+            conn.autocommit = True
+            conn.cursor().execute(f"LISTEN {NOTIFY_CHANNEL}")
+
+            while True:
+                select.select([conn], [], [], 60)
+                conn.poll()
+                while conn.notifies:
+                    channel, data = json.loads(conn.notifies.pop(0).payload)
+                    deliver(channel, data)
+        finally:
+            conn.close()
+
+
+def make_transport(url):
+    scheme = url.split('://', 1)[0]
+
+    if scheme == 'memory':
+        return None
+    if scheme == 'redis':
+        return RedisTransport(url)
+    if scheme == 'postgresql':
+        return PostgresTransport(url)
+
+    raise ValueError(f"Unknown PUBSUB_URL: {url!r}")
+
+
+broker = Broker()
+
+
+def message_channel(user_id):
+    """The channel the messages `user_id` posts are published on."""
+
+    return f'messages:{user_id}'
+
+
+def publish_message(message):
+    """Send a newly-posted `message` to everyone streaming its author's messages."""
+
+    broker.publish(message_channel(message.user_id), json.dumps(message.serialize()))
@@ -0,0 +1,87 @@
+"""Sending read-only requests to read replicas.
+
+Views decorated with `@read_only` read from one of the databases listed in
+`SQLALCHEMY_REPLICA_URIS` (picked at random, once per request) when
+they're asked for with GET; everything else uses the primary,
+`SQLALCHEMY_DATABASE_URI`. With no replicas configured, that's everything.
+
+Replicas lag behind the primary, so a user who has just written something
+could read a page that's missing it. To stop that:
+
+- once a request writes (flushes, or executes an INSERT/UPDATE/DELETE or
+  raw SQL), the rest of it reads from the primary,
+- and the user's later requests do too, for `SQLALCHEMY_REPLICA_STICKY`
+  seconds (noted in their session as `primary_until`).
+
+Anything run outside a request (CLI commands, background flushes) always
+uses the primary.
+"""
+
+import random
+import time
+
+from flask import g, request, session, has_app_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import create_engine, orm
+from sqlalchemy.sql.expression import UpdateBase, TextClause
+
+PRIMARY_UNTIL_KEY = 'primary_until'
+
+
+class RoutingSession(SignallingSession):
+    """Session that reads from the request's replica, if it has one."""
+
+    def get_bind(self, mapper=None, clause=None):
+        if has_app_context() and g.get('db_replica') is not None:
+            if self._flushing or isinstance(clause, (UpdateBase, TextClause)):
+                # Writing: stay on the primary from now on
+                g.db_replica = None
+                g.db_wrote = True
+            else:
+                return g.db_replica
+
+        elif has_app_context() and self._flushing:
+            g.db_wrote = True
+
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy, with sessions that can use read replicas."""
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+def read_only(view):
+    """Mark a view as safe to answer GETs for from a replica."""
+
+    view.read_only = True
+    return view
+
+
+def init_app(app):
+    """Connect `app` to its replicas and route read-only requests to them."""
+
+    app.config.setdefault('SQLALCHEMY_REPLICA_URIS', [])
+    app.config.setdefault('SQLALCHEMY_REPLICA_STICKY', 10)
+    app.extensions['db_replicas'] = [
+        create_engine(uri) for uri in app.config['SQLALCHEMY_REPLICA_URIS']]
+
+    @app.before_request
+    def choose_replica():
+        replicas = app.extensions['db_replicas']
+        view = app.view_functions.get(request.endpoint)
+
+        if (replicas and request.method == 'GET'
+                and getattr(view, 'read_only', False)
+                and session.get(PRIMARY_UNTIL_KEY, 0) < time.time()):
+            g.db_replica = random.choice(replicas)
+
+    @app.after_request
+    def stick_to_primary(response):
+        if g.get('db_wrote') and app.extensions['db_replicas']:
+            session[PRIMARY_UNTIL_KEY] = time.time() + app.config['SQLALCHEMY_REPLICA_STICKY']
+
+        return response
+
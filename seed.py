@@ -1,20 +1,252 @@
-"""Seed database with sample data from CSV Files."""
+"""Seed database with sample data from CSV Files.
+
+    python seed.py [--append] [--csv-dir generator] [--jobs 4]
+
+Streams users.csv, messages.csv, follows.csv and likes.csv (see
+generator/create_csvs.py) into PostgreSQL with `COPY ... FROM STDIN`, each
+table over its own connection, then brings timelines and counters up to
+date.
+
+By default it starts over: drops and recreates every table, and loads all
+four at once, with secondary indexes and foreign keys left off until the
+rows are in (building an index once is far cheaper than updating it for
+every row, and nothing needs checking until the end).
+
+With --append it keeps what's there and adds the CSVs' rows, loading
+tables in foreign key order with indexes and constraints in place. The
+CSVs' ids must start after the database's (generate them with
+--first-user-id/--first-message-id), and the follows and likes must
+involve at least one of the new users or messages, as generated batches'
+do. Only those rows are fanned out to timelines and recounted, so an
+append costs about what its rows do, not a reload of everything. Each
+table's load commits on its own, so if one fails the tables loaded before
+it keep their rows.
+"""
+
+import argparse
+import csv
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import Integer, text
 
-from csv import DictReader
 from app import db
-from models import User, Message, Follows
+import timeline
+import counters
+import migrations
+
+# Loaded together in each stage; later stages reference earlier ones
+STAGES = [['users'], ['messages', 'follows'], ['likes']]
+TABLES = [table for stage in STAGES for table in stage]
+
+# Tables whose ids come from a sequence, and the CSVs may also set
+SEQUENCE_TABLES = ['users', 'messages', 'likes']
+
+# Tables whose secondary indexes and foreign keys are dropped while loading
+DEFERRED_TABLES = TABLES + ['timeline_entries']
+
+
+def copy_csv(table, path):
+    """COPY the CSV at `path` into `table` on a new connection.
+
+    Returns the number of rows loaded.
+    """
+
+    with open(path, newline='') as f:
+        columns = next(csv.reader(f))
+        f.seek(0)
+
+        conn = db.engine.raw_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) "
+                               f"FROM STDIN WITH (FORMAT csv, HEADER true)", f)
+            conn.commit()
+            return cursor.rowcount
+        finally:
+            conn.close()
+
+
+def load_tables(tables, csv_dir, jobs):
+    """Load each of `tables` from its CSV, up to `jobs` at a time, reporting speed."""
+
+    def load_one(table):
+        started = time.monotonic()
+        rows = copy_csv(table, os.path.join(csv_dir, f'{table}.csv'))
+        elapsed = time.monotonic() - started
+        print(f"{table:>10}: {rows:>12,} rows in {elapsed:7.1f}s "
+              f"({rows / max(elapsed, 1e-6):>10,.0f} rows/s)")
+        return rows
+
+    with ThreadPoolExecutor(jobs) as pool:
+        return sum(pool.map(load_one, tables))
+
+
+def drop_deferred(conn):
+    """Drop secondary indexes and foreign keys on `DEFERRED_TABLES`.
+
+    Returns the statements that put them back.
+    """
+
+    indexes = conn.execute(text("""
+        SELECT i.relname, pg_get_indexdef(i.oid)
+        FROM pg_index x
+        JOIN pg_class i ON i.oid = x.indexrelid
+        JOIN pg_class t ON t.oid = x.indrelid
+        WHERE t.relname = ANY(:tables)
+          AND t.relnamespace = current_schema()::regnamespace
+          AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = i.oid)
+    """), tables=DEFERRED_TABLES).fetchall()
+
+    foreign_keys = conn.execute(text("""
+        SELECT c.conname, t.relname, pg_get_constraintdef(c.oid)
+        FROM pg_constraint c
+        JOIN pg_class t ON t.oid = c.conrelid
+        WHERE c.contype = 'f'
+          AND t.relname = ANY(:tables)
+          AND t.relnamespace = current_schema()::regnamespace
+    """), tables=DEFERRED_TABLES).fetchall()
+
+    for name, table, _ in foreign_keys:
+        conn.execute(f'ALTER TABLE {table} DROP CONSTRAINT "{name}"')
+    for name, _ in indexes:
+        conn.execute(f'DROP INDEX "{name}"')
+
+    return ([definition for _, definition in indexes],
+            [f'ALTER TABLE {table} ADD CONSTRAINT "{name}" {definition}'
+             for name, table, definition in foreign_keys])
+
+
+def run_all(statements, jobs):
+    """Run independent DDL `statements`, up to `jobs` at a time."""
+
+    def run(statement):
+        with db.engine.begin() as conn:
+            conn.execute(statement)
+
+    with ThreadPoolExecutor(jobs) as pool:
+        list(pool.map(run, statements))
+
+
+def check_ids_free(conn, csv_dir):
+    """Make sure the CSVs' user and message ids come after the database's."""
+
+    for table, option in [('users', '--first-user-id'), ('messages', '--first-message-id')]:
+        with open(os.path.join(csv_dir, f'{table}.csv'), newline='') as f:
+            first_row = next(csv.DictReader(f), None)
+
+        highest = conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}").scalar()
+        if first_row is not None and int(first_row['id']) <= highest:
+            raise SystemExit(f"{table}.csv starts at id {first_row['id']}, but the database "
+                             f"already has up to {highest}; generate it with "
+                             f"{option} {highest + 1}")
+
+
+def highest_ids(conn):
+    """Get the highest user, message and like ids in the database."""
+
+    return {table: conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}").scalar()
+            for table in SEQUENCE_TABLES}
+
+
+def affected_ids(highest):
+    """Get SQL for the user and message ids whose counters appended rows changed.
+
+    `highest` is `highest_ids` from before the append.
+    """
+
+    user_ids = text("""
+        SELECT id FROM users WHERE id > :user_id
+        UNION SELECT user_id FROM messages WHERE id > :message_id
+        UNION SELECT user_being_followed_id FROM follows WHERE user_following_id > :user_id
+        UNION SELECT user_following_id FROM follows WHERE user_being_followed_id > :user_id
+        UNION SELECT user_id FROM likes WHERE id > :like_id
+    """).bindparams(user_id=highest['users'], message_id=highest['messages'],
+                    like_id=highest['likes']).columns(id=Integer)
+
+    message_ids = text("""
+        SELECT id FROM messages WHERE id > :message_id
+        UNION SELECT message_id FROM likes WHERE id > :like_id
+    """).bindparams(message_id=highest['messages'],
+                    like_id=highest['likes']).columns(id=Integer)
+
+    return user_ids, message_ids
+
+
+def reset_sequences(conn):
+    """Move id sequences past the ids the CSVs brought with them."""
+
+    for table in SEQUENCE_TABLES:
+        conn.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                     f"(SELECT COALESCE(MAX(id), 0) + 1 FROM {table}), false)")
+
+
+def load(csv_dir='generator', append=False, jobs=4):
+    """Load the CSVs in `csv_dir` (see the module docstring). Returns rows loaded."""
+
+    if db.engine.dialect.name != 'postgresql':
+        raise SystemExit("seed.py loads with COPY, so it needs PostgreSQL")
+
+    started = time.monotonic()
+
+    if append:
+        with db.engine.begin() as conn:
+            check_ids_free(conn, csv_dir)
+            highest = highest_ids(conn)
+
+        rows = 0
+        for stage in STAGES:
+            rows += load_tables(stage, csv_dir, jobs)
+
+    else:
+        db.drop_all()
+        db.create_all()
+        # create_all made the latest schema, so there's nothing to migrate
+        migrations.stamp(db.engine)
+
+        with db.engine.begin() as conn:
+            indexes, foreign_keys = drop_deferred(conn)
+
+        rows = load_tables(TABLES, csv_dir, jobs)
+
+    with db.engine.begin() as conn:
+        reset_sequences(conn)
+
+    if append:
+        # Only the new rows: the existing timelines and counters are right
+        timeline.fan_out_loaded(highest['users'], highest['messages'])
+        counters.reconcile(*affected_ids(highest))
+        db.session.commit()
+
+    else:
+        # Timelines before putting indexes back: one big insert into a bare table
+        timeline.backfill()
+        db.session.commit()
+
+        run_all(indexes, jobs)
+        run_all(foreign_keys, jobs)
+
+        counters.reconcile()
+        db.session.commit()
 
+    elapsed = time.monotonic() - started
+    print(f"{'total':>10}: {rows:>12,} rows in {elapsed:7.1f}s "
+          f"({rows / elapsed:>10,.0f} rows/s, including indexes, timelines and counters)")
+    return rows
 
-db.drop_all()
-db.create_all()
 
-with open('generator/users.csv') as users:
-    db.session.bulk_insert_mappings(User, DictReader(users))
+def main():
+    parser = argparse.ArgumentParser(description="Load the generated CSVs into the database.")
+    parser.add_argument('--append', action='store_true',
+                        help="add to the existing data instead of starting over")
+    parser.add_argument('--csv-dir', default='generator')
+    parser.add_argument('--jobs', type=int, default=4,
+                        help="tables (and indexes) to load at once")
+    args = parser.parse_args()
 
-with open('generator/messages.csv') as messages:
-    db.session.bulk_insert_mappings(Message, DictReader(messages))
+    load(args.csv_dir, args.append, args.jobs)
 
-with open('generator/follows.csv') as follows:
-    db.session.bulk_insert_mappings(Follows, DictReader(follows))
 
-db.session.commit()
+if __name__ == '__main__':
+    main()
@@ -1,24 +1,231 @@
-// Get liked button element
-const likeButtons = document.querySelectorAll('.like-button');
-
 console.log('loaded app.js');
+
 // Event Listener
-likeButtons.forEach((likeButton) => {
-    likeButton.addEventListener('click', () => {
-        const messageId = likeButton.dataset.mid;
-        console.log(`Like button clicked, message id: ${messageId}`);
-        // Send AJAX request to server to toggle like status
-        fetch(`/messages/${messageId}/like`, { method: 'POST' })
+// (delegated from the document so buttons on messages loaded later by
+// infinite scroll work too)
+document.addEventListener('click', (evt) => {
+    const likeButton = evt.target.closest('.like-button');
+    if (!likeButton) return;
+
+    const messageId = likeButton.dataset.mid;
+    console.log(`Like button clicked, message id: ${messageId}`);
+    // Send AJAX request to server to toggle like status
+    fetch(`/messages/${messageId}/like`, { method: 'POST' })
+        .then((response) => response.json())
+        .then((data) => {
+            // Update button class based on updated status
+            if (data.liked) {
+                likeButton.classList.remove('btn-secondary');
+                likeButton.classList.add('btn-primary');
+            } else {
+                likeButton.classList.remove('btn-primary');
+                likeButton.classList.add('btn-secondary');
+            }
+        });
+});
+
+// Infinite scroll
+//
+// Pages with more messages end with a "load more" link. It still works as a
+// plain link, but when it scrolls into view we fetch the next page from the
+// JSON API (which hands back the cursor for the page after that) instead.
+
+const messageList = document.querySelector('#messages');
+const loadMore = document.querySelector('#load-more');
+
+function formatDate(isoTimestamp) {
+    return new Date(isoTimestamp).toLocaleDateString('en-GB', {
+        day: '2-digit',
+        month: 'long',
+        year: 'numeric',
+    });
+}
+
+function renderMessage(msg) {
+    const li = document.createElement('li');
+    li.className = 'list-group-item';
+
+    const avatarLink = document.createElement('a');
+    avatarLink.href = `/users/${msg.user.id}`;
+    const avatar = document.createElement('img');
+    avatar.src = msg.user.image_url;
+    avatar.alt = '';
+    avatar.className = 'timeline-image';
+    avatarLink.append(avatar);
+
+    const area = document.createElement('div');
+    area.className = 'message-area';
+    const userLink = document.createElement('a');
+    userLink.href = `/users/${msg.user.id}`;
+    userLink.textContent = `@${msg.user.username}`;
+    const date = document.createElement('span');
+    date.className = 'text-muted';
+    date.textContent = ` ${formatDate(msg.timestamp)}`;
+    const text = document.createElement('p');
+    text.textContent = msg.text;
+    area.append(userLink, date, text);
+
+    li.append(avatarLink, area);
+
+    // Only messages we're allowed to like come back with a `liked` flag
+    if (msg.liked !== undefined) {
+        const button = document.createElement('button');
+        button.className = `btn btn-sm like-button ${
+            msg.liked ? 'btn-primary' : 'btn-secondary'
+        }`;
+        button.dataset.mid = msg.id;
+        button.innerHTML = '<i class="fa fa-thumbs-up"></i>';
+        li.append(button);
+    }
+
+    return li;
+}
+
+if (messageList && loadMore && 'IntersectionObserver' in window) {
+    let loading = false;
+
+    const observer = new IntersectionObserver((entries) => {
+        if (!entries[0].isIntersecting || loading) return;
+        loading = true;
+
+        fetch(loadMore.dataset.api)
             .then((response) => response.json())
             .then((data) => {
-                // Update button class based on updated status
-                if (data.liked) {
-                    likeButton.classList.remove('btn-secondary');
-                    likeButton.classList.add('btn-primary');
+                data.messages.forEach((msg) => {
+                    messageList.append(renderMessage(msg));
+                });
+
+                if (data.next) {
+                    const api = new URL(loadMore.dataset.api, window.location);
+                    const page = new URL(loadMore.href, window.location);
+                    api.searchParams.set('before', data.next);
+                    page.searchParams.set('before', data.next);
+                    loadMore.dataset.api = api.pathname + api.search;
+                    loadMore.href = page.pathname + page.search;
                 } else {
-                    likeButton.classList.remove('btn-primary');
-                    likeButton.classList.add('btn-secondary');
+                    observer.disconnect();
+                    loadMore.remove();
                 }
+            })
+            .finally(() => {
+                loading = false;
             });
     });
-});
+
+    observer.observe(loadMore);
+}
+
+// Live timeline
+//
+// The newest page of the home timeline subscribes to a stream of messages
+// posted since it loaded (Server-Sent Events) and adds them to the top. If
+// the server drops us for falling behind, offer a reload instead.
+
+if (messageList && messageList.dataset.stream && 'EventSource' in window) {
+    const userId = Number(messageList.dataset.userId);
+    const source = new EventSource(messageList.dataset.stream);
+
+    source.addEventListener('message', (evt) => {
+        const msg = JSON.parse(evt.data);
+        // New messages aren't liked by anyone yet; our own can't be
+        if (msg.user.id !== userId) msg.liked = false;
+        messageList.prepend(renderMessage(msg));
+    });
+
+    source.addEventListener('dropped', () => {
+        source.close();
+
+        const li = document.createElement('li');
+        li.className = 'list-group-item';
+        const reload = document.createElement('a');
+        reload.href = '/';
+        reload.textContent = 'There are new messages: reload to see them.';
+        li.append(reload);
+        messageList.prepend(li);
+    });
+}
+
+// Trending sidebar
+//
+// Trending hashtags and most-mentioned users, from the JSON API; the box
+// stays hidden if there's nothing to show.
+
+const trending = document.querySelector('#trending');
+
+function trendingItem(href, label, count) {
+    const li = document.createElement('li');
+    const link = document.createElement('a');
+    link.href = href;
+    link.textContent = label;
+    const counter = document.createElement('span');
+    counter.className = 'text-muted';
+    counter.textContent = ` ${count}`;
+    li.append(link, counter);
+    return li;
+}
+
+if (trending) {
+    fetch(trending.dataset.api)
+        .then((response) => response.json())
+        .then((data) => {
+            document.querySelector('#trending-hashtags').replaceChildren(
+                ...data.hashtags.map((hashtag) =>
+                    trendingItem(
+                        `/search?q=${encodeURIComponent(hashtag.tag)}`,
+                        `#${hashtag.tag}`,
+                        hashtag.count
+                    )
+                )
+            );
+            document.querySelector('#trending-mentions').replaceChildren(
+                ...data.mentions.map((user) =>
+                    trendingItem(
+                        `/users/${user.id}/mentions`,
+                        `@${user.username}`,
+                        user.count
+                    )
+                )
+            );
+            trending.hidden = !data.hashtags.length && !data.mentions.length;
+        });
+}
+
+// Search typeahead
+//
+// Suggests usernames (from the JSON search API) as the user types in the
+// navbar search box, waiting for a short pause in typing between requests.
+
+const searchBox = document.querySelector('#search');
+
+if (searchBox) {
+    const suggestions = document.createElement('datalist');
+    suggestions.id = 'search-suggestions';
+    searchBox.after(suggestions);
+    searchBox.setAttribute('list', suggestions.id);
+    searchBox.setAttribute('autocomplete', 'off');
+
+    let timer = null;
+
+    searchBox.addEventListener('input', () => {
+        clearTimeout(timer);
+        const q = searchBox.value.trim();
+        if (!q) return;
+
+        timer = setTimeout(() => {
+            fetch(`/api/users/search?q=${encodeURIComponent(q)}`)
+                .then((response) => response.json())
+                .then((data) => {
+                    // Ignore answers to queries the user has typed past
+                    if (searchBox.value.trim() !== q) return;
+
+                    suggestions.replaceChildren(
+                        ...data.users.map((user) => {
+                            const option = document.createElement('option');
+                            option.value = user.username;
+                            return option;
+                        })
+                    );
+                });
+        }, 150);
+    });
+}
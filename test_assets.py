@@ -0,0 +1,101 @@
+"""Static asset pipeline tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_assets.py
+
+
+import gzip
+import os
+import shutil
+from unittest import TestCase, skipUnless
+
+from models import db
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+# Now we can import app
+
+from app import app
+import assets
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class AssetsTestCase(TestCase):
+    """Test building and serving fingerprinted, pre-compressed assets."""
+
+    def setUp(self):
+        self.client = app.test_client()
+        self.dist = os.path.join(app.static_folder, assets.DIST_DIR)
+        self.manifest = assets.build(app.static_folder)
+        app.extensions['assets_manifest'] = self.manifest
+
+    def tearDown(self):
+        shutil.rmtree(self.dist, ignore_errors=True)
+        app.extensions['assets_manifest'] = {}
+
+    def test_build(self):
+        self.assertRegex(self.manifest['app.css'], r'^app\.\w{10}\.css$')
+        self.assertRegex(self.manifest['images/nav-bg.png'], r'^images/nav-bg\.\w{10}\.png$')
+
+        with open(os.path.join(self.dist, self.manifest['app.css'])) as f:
+            css = f.read()
+
+        # minified, and pointing at the fingerprinted images
+        self.assertNotIn('/*', css)
+        self.assertIn(f"/static/dist/{self.manifest['images/nav-bg.png']}", css)
+
+        css_path = os.path.join(self.dist, self.manifest['app.css'])
+        with gzip.open(css_path + '.gz', 'rt') as f:
+            self.assertEqual(f.read(), css)
+
+        # building again gives the same names
+        self.assertEqual(assets.build(app.static_folder), self.manifest)
+
+    def test_templates_link_built_assets(self):
+        with self.client as c:
+            page = c.get("/login").get_data(as_text=True)
+
+            self.assertIn(f'href="/static/dist/{self.manifest["app.css"]}"', page)
+            self.assertIn(f'src="/static/dist/{self.manifest["app.js"]}"', page)
+            self.assertIn(f'src="/static/dist/{self.manifest["images/warbler-logo.png"]}"', page)
+
+    def test_serves_precompressed(self):
+        url = f"/static/dist/{self.manifest['app.js']}"
+
+        with self.client as c:
+            resp = c.get(url, headers={'Accept-Encoding': 'gzip, deflate'})
+            self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+            self.assertTrue(resp.content_type.endswith('javascript; charset=utf-8'))
+            self.assertEqual(resp.headers['Cache-Control'],
+                             'public, max-age=31536000, immutable')
+            self.assertIn('Accept-Encoding', resp.headers['Vary'])
+            gzipped = resp.get_data()
+            resp.close()
+
+            resp = c.get(url, headers={'Accept-Encoding': 'identity'})
+            self.assertNotIn('Content-Encoding', resp.headers)
+            self.assertEqual(gzip.decompress(gzipped), resp.get_data())
+            resp.close()
+
+    @skipUnless(assets.brotli, "brotli isn't installed")
+    def test_prefers_brotli(self):
+        with self.client as c:
+            resp = c.get(f"/static/dist/{self.manifest['app.css']}",
+                         headers={'Accept-Encoding': 'gzip, br'})
+            self.assertEqual(resp.headers['Content-Encoding'], 'br')
+            resp.close()
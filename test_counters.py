@@ -0,0 +1,148 @@
+"""User counter tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_counters.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, Message, User, Likes, Follows
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import counters
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class CounterTestCase(TestCase):
+    """Test denormalized counters on User."""
+
+    def setUp(self):
+        """Create test client and add sample data"""
+
+        db.drop_all()
+        db.create_all()
+
+        self.client = app.test_client()
+
+        self.testuser = User.signup("testuser", "test@test.com", "testuser", None)
+        self.testuser_id = 8989
+        self.testuser.id = self.testuser_id
+        self.u1 = User.signup("babyyoda", "test1@test.com", "password", None)
+        self.u1_id = 778
+        self.u1.id = self.u1_id
+
+        db.session.commit()
+
+    def tearDown(self):
+        resp = super().tearDown()
+        db.session.rollback()
+        return resp
+
+    def counts(self, user_id):
+        user = User.query.get(user_id)
+        return (user.messages_count, user.following_count,
+                user.followers_count, user.likes_count)
+
+    def login(self, c, user_id):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def test_follow_unfollow(self):
+        with self.client as c:
+            self.login(c, self.testuser_id)
+
+            c.post(f"/users/follow/{self.u1_id}")
+            self.assertEqual(self.counts(self.testuser_id), (0, 1, 0, 0))
+            self.assertEqual(self.counts(self.u1_id), (0, 0, 1, 0))
+
+            c.post(f"/users/stop-following/{self.u1_id}")
+            self.assertEqual(self.counts(self.testuser_id), (0, 0, 0, 0))
+            self.assertEqual(self.counts(self.u1_id), (0, 0, 0, 0))
+
+    def test_messages_and_likes(self):
+        with self.client as c:
+            self.login(c, self.u1_id)
+            c.post("/messages/new", data={"text": "This is the way."})
+            self.assertEqual(self.counts(self.u1_id), (1, 0, 0, 0))
+
+            msg_id = Message.query.one().id
+
+            self.login(c, self.testuser_id)
+            c.post(f"/messages/{msg_id}/like")
+            self.assertEqual(self.counts(self.testuser_id), (0, 0, 0, 1))
+
+            c.post(f"/messages/{msg_id}/like")
+            self.assertEqual(self.counts(self.testuser_id), (0, 0, 0, 0))
+
+            c.post(f"/messages/{msg_id}/like")
+            self.login(c, self.u1_id)
+            c.post(f"/messages/{msg_id}/delete")
+            self.assertEqual(self.counts(self.u1_id), (0, 0, 0, 0))
+            self.assertEqual(self.counts(self.testuser_id), (0, 0, 0, 0))
+
+    def test_collections(self):
+        self.u1.following.append(self.testuser)
+        db.session.commit()
+        self.assertEqual(self.counts(self.u1_id), (0, 1, 0, 0))
+        self.assertEqual(self.counts(self.testuser_id), (0, 0, 1, 0))
+
+        self.testuser.followers.remove(self.u1)
+        db.session.commit()
+        self.assertEqual(self.counts(self.u1_id), (0, 0, 0, 0))
+        self.assertEqual(self.counts(self.testuser_id), (0, 0, 0, 0))
+
+    def test_reconcile(self):
+        db.session.execute(Follows.__table__.insert().values(
+            user_being_followed_id=self.u1_id, user_following_id=self.testuser_id))
+        db.session.execute(Message.__table__.insert().values(
+            id=1, text="raw", user_id=self.u1_id))
+        db.session.execute(Likes.__table__.insert().values(
+            user_id=self.testuser_id, message_id=1))
+        db.session.commit()
+
+        # Raw SQL skips the flush hooks, so these are wrong until reconciled
+        self.assertEqual(self.counts(self.testuser_id), (0, 0, 0, 0))
+
+        # two users plus the liked message
+        self.assertEqual(counters.reconcile(), 3)
+        db.session.commit()
+
+        self.assertEqual(self.counts(self.testuser_id), (0, 1, 0, 1))
+        self.assertEqual(self.counts(self.u1_id), (1, 0, 1, 0))
+        self.assertEqual(Message.query.get(1).likes_count, 1)
+        self.assertEqual(counters.reconcile(), 0)
+
+    def test_reconcile_some(self):
+        db.session.execute(Follows.__table__.insert().values(
+            user_being_followed_id=self.u1_id, user_following_id=self.testuser_id))
+        db.session.commit()
+
+        # Only the users asked about
+        self.assertEqual(counters.reconcile(user_ids=[self.testuser_id]), 1)
+        db.session.commit()
+        self.assertEqual(self.counts(self.testuser_id), (0, 1, 0, 0))
+        self.assertEqual(self.counts(self.u1_id), (0, 0, 0, 0))
+
+        self.assertEqual(counters.reconcile(user_ids=[self.u1_id]), 1)
+        db.session.commit()
+        self.assertEqual(self.counts(self.u1_id), (0, 0, 1, 0))
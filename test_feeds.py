@@ -0,0 +1,98 @@
+"""Feed read model tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_feeds.py
+
+
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import db, Message, User, Follows
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+# Now we can import app
+
+from app import app
+import feeds
+import timeline
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class FeedsTestCase(TestCase):
+    """Test reading feeds as plain rows."""
+
+    def setUp(self):
+        """Create test client and add sample data"""
+
+        db.drop_all()
+        db.create_all()
+
+        self.testuser = User.signup("testuser", "test@test.com", "testuser", None)
+        self.testuser_id = 8989
+        self.testuser.id = self.testuser_id
+        self.u1 = User.signup("babyyoda", "test1@test.com", "password", None)
+        self.u1_id = 778
+        self.u1.id = self.u1_id
+        db.session.commit()
+
+        db.session.add(Follows(user_being_followed_id=self.u1_id,
+                               user_following_id=self.testuser_id))
+
+        start = datetime(2020, 1, 1)
+        for n in range(1, 6):
+            db.session.add(Message(id=n, text=f"Message {n}", timestamp=start + timedelta(hours=n),
+                                   user_id=self.u1_id if n % 2 else self.testuser_id))
+        db.session.commit()
+
+        timeline.backfill()
+        db.session.commit()
+
+    def tearDown(self):
+        resp = super().tearDown()
+        db.session.rollback()
+        return resp
+
+    def test_home_feed_matches_orm(self):
+        orm, orm_cursor = timeline.home_messages(self.testuser_id, per_page=3)
+        rows, cursor = feeds.home_feed(self.testuser_id, per_page=3)
+
+        self.assertEqual([row.serialize() for row in rows],
+                         [msg.serialize() for msg in orm])
+        self.assertEqual(cursor, orm_cursor)
+
+        rest, cursor = feeds.home_feed(self.testuser_id, before=cursor, per_page=3)
+        self.assertEqual([row.id for row in rest], [2, 1])
+        self.assertIsNone(cursor)
+
+    def test_user_feed(self):
+        rows, cursor = feeds.user_feed(self.u1_id)
+
+        self.assertEqual([row.id for row in rows], [5, 3, 1])
+        self.assertIsNone(cursor)
+        self.assertEqual(rows[0].user.username, "babyyoda")
+        self.assertEqual(rows[0].user_id, self.u1_id)
+
+        # One author object for the whole page
+        self.assertIs(rows[0].user, rows[2].user)
+
+    def test_rows_are_not_tracked(self):
+        loaded = len(db.session.identity_map)
+        feeds.user_feed(self.u1_id)
+        self.assertEqual(len(db.session.identity_map), loaded)
@@ -0,0 +1,125 @@
+"""Template fragment cache tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_fragment_cache.py
+
+
+import os
+from unittest import TestCase
+
+from bs4 import BeautifulSoup
+from flask import render_template_string
+
+from models import db, User, Message
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import fragment_cache
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class FragmentCacheTestCase(TestCase):
+    """Test caching rendered message fragments."""
+
+    def setUp(self):
+        """Create test client and add sample data"""
+
+        db.drop_all()
+        db.create_all()
+        app.jinja_env.fragment_cache = fragment_cache.MemoryBackend(1024 * 1024)
+
+        self.client = app.test_client()
+
+        self.testuser = User.signup("testuser", "test@test.com", "testuser", None)
+        self.testuser_id = 8989
+        self.testuser.id = self.testuser_id
+        self.u1 = User.signup("babyyoda", "test1@test.com", "password", None)
+        self.u1_id = 778
+        self.u1.id = self.u1_id
+
+        db.session.commit()
+
+    def tearDown(self):
+        resp = super().tearDown()
+        db.session.rollback()
+        return resp
+
+    def login(self, c, user_id):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def test_block_rendered_once(self):
+        template = "{% cache 'greeting', 1 %}Hello, {{ name }}{% endcache %}"
+
+        with app.test_request_context():
+            self.assertEqual(render_template_string(template, name="<b>"), "Hello, &lt;b&gt;")
+            # Same key: what was rendered first, still escaped only once
+            self.assertEqual(render_template_string(template, name="Yoda"), "Hello, &lt;b&gt;")
+
+    def test_memory_backend_evicts_by_size(self):
+        backend = fragment_cache.MemoryBackend(10)
+        backend.set('a', 'x' * 6)
+        backend.set('b', 'y' * 3)
+        self.assertEqual(backend.get('a'), 'x' * 6)
+
+        # 'b' is now the least recently used
+        backend.set('c', 'z' * 3)
+        self.assertIsNone(backend.get('b'))
+        self.assertEqual(backend.get('a'), 'x' * 6)
+        self.assertEqual(backend.get('c'), 'z' * 3)
+
+    def test_profile_edit_refreshes_messages(self):
+        db.session.add(Message(id=1, text="Hello there", user_id=self.testuser_id))
+        db.session.commit()
+
+        with self.client as c:
+            self.login(c, self.testuser_id)
+            resp = c.get(f"/users/{self.testuser_id}")
+            self.assertIn("@testuser", resp.get_data(as_text=True))
+
+            c.post("/users/profile", data={"username": "renamed",
+                                           "email": "test@test.com",
+                                           "password": "testuser"})
+
+            resp = c.get(f"/users/{self.testuser_id}")
+            soup = BeautifulSoup(resp.data, 'html.parser')
+            area = soup.find('div', class_='message-area')
+            self.assertIn("@renamed", area.text)
+            self.assertIn("Hello there", area.text)
+
+    def test_like_button_per_viewer(self):
+        with self.client as c:
+            self.login(c, self.u1_id)
+            c.post(f"/users/follow/{self.testuser_id}")
+
+            self.login(c, self.testuser_id)
+            c.post("/messages/new", data={"text": "Hello there"})
+
+            # The author sees no like button...
+            soup = BeautifulSoup(c.get("/").data, 'html.parser')
+            self.assertIn("Hello there", soup.find(id='messages').text)
+            self.assertEqual(soup.find_all('button', class_='like-button'), [])
+
+            # ...but their follower, shown the same cached fragment, does
+            self.login(c, self.u1_id)
+            soup = BeautifulSoup(c.get("/").data, 'html.parser')
+            self.assertIn("Hello there", soup.find(id='messages').text)
+            self.assertEqual(len(soup.find_all('button', class_='like-button')), 1)
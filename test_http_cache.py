@@ -0,0 +1,208 @@
+"""HTTP caching tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_http_cache.py
+
+
+import os
+import re
+from unittest import TestCase
+
+from flask import template_rendered
+
+from models import db, User, Message
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class HttpCacheTestCase(TestCase):
+    """Test ETags, 304s and Cache-Control policies."""
+
+    def setUp(self):
+        """Create test client and add sample data"""
+
+        db.drop_all()
+        db.create_all()
+
+        self.client = app.test_client()
+
+        self.testuser = User.signup("testuser", "test@test.com", "testuser", None)
+        self.testuser_id = 8989
+        self.testuser.id = self.testuser_id
+        self.u1 = User.signup("babyyoda", "test1@test.com", "password", None)
+        self.u1_id = 778
+        self.u1.id = self.u1_id
+
+        db.session.add(Message(id=1, text="This is the way.", user_id=self.u1_id))
+        db.session.commit()
+
+        self.rendered = []
+        template_rendered.connect(self.record_render, app)
+
+    def tearDown(self):
+        template_rendered.disconnect(self.record_render, app)
+        resp = super().tearDown()
+        db.session.rollback()
+        return resp
+
+    def record_render(self, sender, template, context, **extra):
+        self.rendered.append(template.name)
+
+    def login(self, c, user_id):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def revalidate(self, c, url, etag):
+        self.rendered = []
+        return c.get(url, headers={'If-None-Match': f'"{etag}"'})
+
+    def assert_not_modified(self, c, url):
+        resp = c.get(url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.headers['Cache-Control'], 'private, no-cache')
+        etag = resp.get_etag()[0]
+
+        resp = self.revalidate(c, url, etag)
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.get_etag()[0], etag)
+        self.assertEqual(self.rendered, [])
+
+        return etag
+
+    def test_profile(self):
+        url = f"/users/{self.u1_id}"
+
+        with self.client as c:
+            self.login(c, self.testuser_id)
+            etag = self.assert_not_modified(c, url)
+
+            # the viewer's follow button changes
+            c.post(f"/users/follow/{self.u1_id}")
+            resp = self.revalidate(c, url, etag)
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(self.rendered, ['users/show.html'])
+            etag = resp.get_etag()[0]
+
+            # a new message shows up
+            self.login(c, self.u1_id)
+            etag = self.assert_not_modified(c, url)
+            c.post("/messages/new", data={"text": "Help me, Obi-Wan Kenobi."})
+            self.assertEqual(self.revalidate(c, url, etag).status_code, 200)
+
+    def test_etag_depends_on_viewer(self):
+        url = f"/users/{self.u1_id}"
+
+        with self.client as c:
+            # The author's own page: same user rows as an anonymous view
+            self.login(c, self.u1_id)
+            etag = self.assert_not_modified(c, url)
+
+            c.get("/logout")
+            c.get("/")  # (shows the "logged out" flash)
+            resp = self.revalidate(c, url, etag)
+            self.assertEqual(resp.status_code, 200)
+            self.assertNotEqual(resp.get_etag()[0], etag)
+
+    def test_message(self):
+        url = "/messages/1"
+
+        with self.client as c:
+            self.login(c, self.u1_id)
+            etag = self.assert_not_modified(c, url)
+
+            # the author edits their profile
+            c.post("/users/profile", data={"username": "grogu",
+                                           "email": "test1@test.com",
+                                           "password": "password"})
+            c.get("/users/778")  # (shows the "Profile edited" flash)
+            self.assertEqual(self.revalidate(c, url, etag).status_code, 200)
+
+            c.post("/messages/1/delete")
+            self.assertEqual(self.revalidate(c, url, etag).status_code, 404)
+
+    def test_timeline(self):
+        with self.client as c:
+            self.login(c, self.testuser_id)
+            c.post(f"/users/follow/{self.u1_id}")
+            etag = self.assert_not_modified(c, "/")
+
+            c.post("/messages/1/like")
+            self.assertEqual(self.revalidate(c, "/", etag).status_code, 200)
+
+    def test_timeline_author_changes(self):
+        db.session.add(Message(id=2, text="I have spoken.", user_id=self.u1_id))
+        db.session.commit()
+
+        with self.client as c:
+            self.login(c, self.testuser_id)
+            c.post(f"/users/follow/{self.u1_id}")
+            etag = self.assert_not_modified(c, "/")
+
+            # an author's new avatar shows on the messages already listed
+            self.login(c, self.u1_id)
+            c.post("/users/profile", data={"username": "babyyoda",
+                                           "email": "test1@test.com",
+                                           "image_url": "/static/images/grogu.png",
+                                           "password": "password"})
+            c.get(f"/users/{self.u1_id}")  # (shows the "Profile edited" flash)
+            self.login(c, self.testuser_id)
+            resp = self.revalidate(c, "/", etag)
+            self.assertEqual(resp.status_code, 200)
+            etag = resp.get_etag()[0]
+
+            # an older message of theirs is deleted
+            self.login(c, self.u1_id)
+            c.post("/messages/1/delete")
+            self.login(c, self.testuser_id)
+            self.assertEqual(self.revalidate(c, "/", etag).status_code, 200)
+
+    def test_flashes_are_never_cached(self):
+        with self.client as c:
+            self.login(c, self.testuser_id)
+            etag = c.get("/").get_etag()[0]
+
+            with c.session_transaction() as sess:
+                sess['_flashes'] = [('success', 'Hello, testuser!')]
+
+            resp = self.revalidate(c, "/", etag)
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("Hello, testuser!", resp.get_data(as_text=True))
+
+    def test_other_pages_not_stored(self):
+        with self.client as c:
+            resp = c.get("/login")
+            self.assertEqual(resp.headers['Cache-Control'], 'no-store')
+            self.assertIsNone(resp.get_etag()[0])
+
+    def test_static(self):
+        with self.client as c:
+            page = c.get("/login").get_data(as_text=True)
+            css_url = re.search(r'href="(/static/stylesheets/style.css\?v=\w+)"', page).group(1)
+
+            resp = c.get(css_url)
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.headers['Cache-Control'],
+                             'public, max-age=31536000, immutable')
+
+            resp = c.get("/static/images/default-pic.png")
+            self.assertEqual(resp.headers['Cache-Control'], 'public, max-age=3600')
@@ -0,0 +1,145 @@
+"""Current user identity cache tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_identity.py
+
+
+import os
+from unittest import TestCase
+
+from bs4 import BeautifulSoup
+from sqlalchemy import event
+
+from models import db, User
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import identity
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class IdentityTestCase(TestCase):
+    """Test that g.user comes from a cached, versioned snapshot."""
+
+    def setUp(self):
+        """Create test client and add sample data"""
+
+        db.drop_all()
+        db.create_all()
+        identity.snapshots.clear()
+
+        self.client = app.test_client()
+
+        self.testuser = User.signup("testuser", "test@test.com", "testuser", None)
+        self.testuser_id = 8989
+        self.testuser.id = self.testuser_id
+        self.u1 = User.signup("babyyoda", "test1@test.com", "password", None)
+        self.u1_id = 778
+        self.u1.id = self.u1_id
+
+        db.session.commit()
+
+        self.statements = []
+        event.listen(db.engine, 'before_cursor_execute', self.record_statement)
+
+    def tearDown(self):
+        event.remove(db.engine, 'before_cursor_execute', self.record_statement)
+        resp = super().tearDown()
+        db.session.rollback()
+        return resp
+
+    def record_statement(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def user_lookups(self):
+        return [statement for statement in self.statements
+                if statement.lstrip().startswith('SELECT users.')]
+
+    def login(self, c, user_id):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def test_snapshot_skips_user_lookup(self):
+        with self.client as c:
+            self.login(c, self.testuser_id)
+            c.get("/api/likes/state?ids=1,2")
+
+            self.statements = []
+            resp = c.get("/api/likes/state?ids=1,2")
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(self.user_lookups(), [])
+
+    def test_counters_refresh(self):
+        with self.client as c:
+            self.login(c, self.testuser_id)
+            c.get("/")
+
+            c.post(f"/users/follow/{self.u1_id}")
+            resp = c.get("/")
+
+            following = BeautifulSoup(resp.data, 'html.parser').find(
+                'a', href=f"/users/{self.testuser_id}/following")
+            self.assertEqual(following.text.strip(), "1")
+
+    def test_profile_edit_bumps_version(self):
+        with self.client as c:
+            resp = c.post("/login", data={"username": "testuser",
+                                          "password": "testuser"})
+            with c.session_transaction() as sess:
+                self.assertEqual(sess[identity.CURR_USER_VERSION_KEY], 0)
+
+            c.post("/users/profile", data={"username": "renamed",
+                                           "email": "test@test.com",
+                                           "password": "testuser"})
+            with c.session_transaction() as sess:
+                self.assertEqual(sess[identity.CURR_USER_VERSION_KEY], 1)
+
+            resp = c.get("/")
+            self.assertIn("@renamed", resp.get_data(as_text=True))
+
+    def test_stale_snapshot_reloaded(self):
+        identity.load(self.testuser_id)
+        User.query.filter_by(id=self.testuser_id).update(
+            {'username': 'elsewhere', 'version': 1})
+        db.session.commit()
+
+        # Changed behind our back (as by another worker), so still cached...
+        self.assertEqual(identity.load(self.testuser_id).username, 'testuser')
+
+        # ...until a session that has seen the new version asks
+        self.assertEqual(identity.load(self.testuser_id, 1).username, 'elsewhere')
+
+    def test_deleted_user_cant_write(self):
+        with self.client as c:
+            self.login(c, self.testuser_id)
+            c.get("/")
+
+            # Deleted by another worker: this one's snapshot is still fresh...
+            User.query.filter_by(id=self.testuser_id).delete()
+            db.session.commit()
+            self.assertIsNotNone(identity.snapshots.get(self.testuser_id))
+
+            # ...but writing checks the user is still there
+            resp = c.post("/messages/new", data={"text": "This is the way."})
+            self.assertEqual(resp.status_code, 302)
+            self.assertEqual(resp.location, "http://localhost/")
+            self.assertIsNone(identity.snapshots.get(self.testuser_id))
@@ -0,0 +1,115 @@
+"""SQL instrumentation tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_instrumentation.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import instrumentation
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class InstrumentationTestCase(TestCase):
+    """Test per-request query stats, Server-Timing and the metrics endpoint."""
+
+    def setUp(self):
+        """Create test client and add sample data"""
+
+        db.drop_all()
+        db.create_all()
+
+        self.client = app.test_client()
+
+        self.testuser = User.signup("testuser", "test@test.com", "testuser", None)
+        self.testuser_id = 8989
+        self.testuser.id = self.testuser_id
+
+        db.session.commit()
+
+    def tearDown(self):
+        resp = super().tearDown()
+        db.session.rollback()
+        app.config['SQL_SLOW_QUERY_MS'] = 100
+        app.config['SQL_REPEATED_QUERY_THRESHOLD'] = 10
+        app.config['INTERNAL_METRICS_TOKEN'] = None
+        return resp
+
+    def test_server_timing(self):
+        with self.client as c:
+            resp = c.get(f"/users/{self.testuser_id}")
+            stats = instrumentation.current_stats()
+
+            self.assertGreater(stats.count, 0)
+            timings = resp.headers.getlist('Server-Timing')
+            self.assertIn(f'desc="{stats.count} queries"', timings[0])
+            self.assertTrue(timings[1].startswith('app;dur='))
+
+    def test_slow_queries_logged(self):
+        app.config['SQL_SLOW_QUERY_MS'] = 0
+
+        with self.assertLogs('instrumentation', 'WARNING') as logs:
+            self.client.get(f"/users/{self.testuser_id}")
+
+        self.assertTrue(any('Slow query' in line for line in logs.output))
+
+    def test_repeated_queries_logged(self):
+        app.config['SQL_REPEATED_QUERY_THRESHOLD'] = 3
+
+        with app.test_request_context(f"/users/{self.testuser_id}"):
+            app.preprocess_request()
+
+            with self.assertLogs('instrumentation', 'WARNING') as logs:
+                for i in range(5):
+                    User.query.filter_by(id=i).first()
+
+            stats = instrumentation.current_stats()
+
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn('Possible N+1', logs.output[0])
+        self.assertEqual(stats.count, 5)
+        self.assertEqual(len(stats.slowest), app.config['SQL_SLOWEST_KEPT'])
+
+    def test_metrics(self):
+        with self.client as c:
+            c.get(f"/users/{self.testuser_id}")
+
+            # Off until a token is set, even from localhost
+            resp = c.get("/_internal/metrics")
+            self.assertEqual(resp.status_code, 404)
+
+            app.config['INTERNAL_METRICS_TOKEN'] = 's3cret'
+            resp = c.get("/_internal/metrics",
+                         headers={'Authorization': 'Bearer s3cret'})
+            self.assertEqual(resp.status_code, 200)
+            self.assertGreaterEqual(
+                resp.json['endpoints']['users_show']['requests'], 1)
+
+            resp = c.get("/_internal/metrics")
+            self.assertEqual(resp.status_code, 404)
+            resp = c.get("/_internal/metrics",
+                         headers={'Authorization': 'Bearer guess'})
+            self.assertEqual(resp.status_code, 404)
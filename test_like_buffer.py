@@ -0,0 +1,180 @@
+"""Like buffer tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_like_buffer.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, Message, User, Likes
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+from like_buffer import like_buffer
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class LikeBufferTestCase(TestCase):
+    """Test coalescing like toggles."""
+
+    def setUp(self):
+        """Create test client and add sample data"""
+
+        db.drop_all()
+        db.create_all()
+
+        self.client = app.test_client()
+
+        self.testuser = User.signup("testuser", "test@test.com", "testuser", None)
+        self.testuser_id = 8989
+        self.testuser.id = self.testuser_id
+        self.u1 = User.signup("babyyoda", "test1@test.com", "password", None)
+        self.u1_id = 778
+        self.u1.id = self.u1_id
+        self.u2 = User.signup("mando", "test2@test.com", "password", None)
+        self.u2_id = 884
+        self.u2.id = self.u2_id
+
+        m = Message(id=777, text="This is the way.", user_id=self.u1_id)
+        db.session.add(m)
+        db.session.commit()
+
+        # Hold clicks in the buffer until we flush it ourselves
+        self.max_age = like_buffer.max_age
+        like_buffer.max_age = 3600
+
+    def tearDown(self):
+        like_buffer.max_age = self.max_age
+        db.session.rollback()
+        like_buffer.reset()
+        return super().tearDown()
+
+    def click(self, c, user_id):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+        return c.post("/messages/777/like").json
+
+    def test_toggles_coalesce(self):
+        with self.client as c:
+            self.assertEqual(self.click(c, self.testuser_id), {'liked': True, 'likes_count': 1})
+            self.assertEqual(self.click(c, self.testuser_id), {'liked': False, 'likes_count': 0})
+            self.assertEqual(self.click(c, self.testuser_id), {'liked': True, 'likes_count': 1})
+            self.assertEqual(self.click(c, self.u2_id), {'liked': True, 'likes_count': 1})
+
+            # Nothing written yet, but the clicker sees their own like
+            self.assertEqual(Likes.query.count(), 0)
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+            self.assertEqual(c.get("/api/likes/state?ids=777").json, {'liked': [777]})
+
+        self.assertEqual(like_buffer.size, 2)
+        added, removed = like_buffer.flush()
+        db.session.commit()
+
+        self.assertEqual(sorted(added), [(self.u2_id, 777), (self.testuser_id, 777)])
+        self.assertEqual(removed, [])
+        self.assertEqual(Likes.query.count(), 2)
+        self.assertEqual(Message.query.get(777).likes_count, 2)
+        self.assertEqual(User.query.get(self.testuser_id).likes_count, 1)
+
+    def test_unlike_flush(self):
+        db.session.add(Likes(user_id=self.testuser_id, message_id=777))
+        db.session.commit()
+        self.assertEqual(Message.query.get(777).likes_count, 1)
+
+        with self.client as c:
+            self.assertEqual(self.click(c, self.testuser_id), {'liked': False, 'likes_count': 0})
+
+        added, removed = like_buffer.flush()
+        db.session.commit()
+
+        self.assertEqual(removed, [(self.testuser_id, 777)])
+        self.assertEqual(Likes.query.count(), 0)
+        self.assertEqual(Message.query.get(777).likes_count, 0)
+        self.assertEqual(User.query.get(self.testuser_id).likes_count, 0)
+
+    def test_flushed_toggles_visible_until_commit(self):
+        with self.client as c:
+            self.assertEqual(self.click(c, self.testuser_id), {'liked': True, 'likes_count': 1})
+
+        # Flushed but not yet committed: other requests, which can't see the
+        # uncommitted like, still toggle from the clicked state
+        like_buffer.flush()
+        self.assertEqual(like_buffer.pending, {})
+        self.assertEqual(like_buffer.overlay(self.testuser_id, set(), [777]), {777})
+
+        db.session.commit()
+        self.assertEqual(like_buffer.in_flight, [])
+        self.assertEqual(Likes.query.count(), 1)
+
+    def test_rolled_back_flush_restored(self):
+        with self.client as c:
+            self.click(c, self.testuser_id)
+
+        like_buffer.flush()
+        db.session.rollback()
+
+        self.assertEqual(like_buffer.in_flight, [])
+        self.assertEqual(like_buffer.pending, {self.testuser_id: {777: True}})
+        self.assertEqual(Likes.query.count(), 0)
+
+    def test_like_of_deleted_message(self):
+        db.session.add(Message(id=778, text="I have spoken.", user_id=self.u2_id))
+        db.session.commit()
+
+        with self.client as c:
+            self.click(c, self.testuser_id)
+            self.click(c, self.u2_id)
+
+        # Deleted before the flush: its like is dropped, the others still go in
+        Message.query.filter_by(id=777).delete()
+        db.session.commit()
+        like_buffer.set(self.testuser_id, 778, True)
+
+        added, removed = like_buffer.flush()
+        db.session.commit()
+
+        self.assertEqual(added, [(self.testuser_id, 778)])
+        self.assertEqual(Message.query.get(778).likes_count, 1)
+        self.assertEqual(like_buffer.size, 0)
+
+    def test_failed_flush_keeps_toggles(self):
+        with self.client as c:
+            self.click(c, self.testuser_id)
+
+        real_write = like_buffer.write
+
+        def failing_write(pending):
+            # A click that lands while we're flushing wins over the failed one
+            like_buffer.set(self.testuser_id, 777, False)
+            raise RuntimeError("database went away")
+
+        like_buffer.write = failing_write
+        try:
+            with self.assertRaises(RuntimeError):
+                like_buffer.flush()
+        finally:
+            like_buffer.write = real_write
+        db.session.rollback()
+
+        self.assertEqual(like_buffer.pending, {self.testuser_id: {777: False}})
+        self.assertEqual(like_buffer.size, 1)
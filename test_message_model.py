@@ -83,4 +83,30 @@ class MessageModelTestCase(TestCase):
 
         likes = Likes.query.filter(Likes.user_id == u2id).all()
         self.assertEqual(len(likes), 1)
-        self.assertEqual(likes[0].message_id, m1.id)
\ No newline at end of file
+        self.assertEqual(likes[0].message_id, m1.id)
+
+    def test_liked_message_ids(self):
+        """Are liked message ids cached and kept up to date?"""
+
+        m1 = Message(user_id=self.uid, text='test content')
+        m2 = Message(user_id=self.uid, text='this is the way')
+
+        u2 = User.signup("mando22", "mando@email.com", "password", None)
+        db.session.add_all([m1, m2, u2])
+        db.session.commit()
+
+        self.assertEqual(len(u2.liked_message_ids), 0)
+        self.assertFalse(u2.has_liked_message(m1))
+
+        u2.like_message(m1)
+        db.session.commit()
+
+        self.assertIn(m1.id, u2.liked_message_ids)
+        self.assertNotIn(m2.id, u2.liked_message_ids)
+        self.assertTrue(u2.has_liked_message(m1))
+        self.assertEqual(u2.like_states([m1.id, m2.id]), {m1.id})
+
+        u2.unlike_message(m1)
+        db.session.commit()
+
+        self.assertNotIn(m1.id, u2.liked_message_ids)
@@ -0,0 +1,173 @@
+"""Message full-text search tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_message_search.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follows
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import message_search
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class MessageSearchTestCase(TestCase):
+    """Test ranked, cursor-paged message search."""
+
+    def setUp(self):
+        """Create test client and add sample data"""
+
+        db.drop_all()
+        db.create_all()
+
+        self.client = app.test_client()
+
+        self.testuser = User.signup("testuser", "test@test.com", "testuser", None)
+        self.testuser_id = 8989
+        self.testuser.id = self.testuser_id
+        self.u1 = User.signup("babyyoda", "test1@test.com", "password", None)
+        self.u1_id = 778
+        self.u1.id = self.u1_id
+        self.u2 = User.signup("mando", "test2@test.com", "password", None)
+        self.u2_id = 884
+        self.u2.id = self.u2_id
+        db.session.commit()
+
+        db.session.add_all([
+            Message(id=1, text="The way of the Mandalorian", user_id=self.u1_id),
+            Message(id=2, text="This is the way", user_id=self.u1_id),
+            Message(id=3, text="Grogu eats a frog", user_id=self.u2_id),
+            Message(id=4, text="Way way way", user_id=self.testuser_id),
+            Follows(user_being_followed_id=self.u1_id, user_following_id=self.testuser_id),
+        ])
+        db.session.commit()
+
+    def tearDown(self):
+        resp = super().tearDown()
+        db.session.rollback()
+        return resp
+
+    def search_ids(self, q, **kwargs):
+        messages, next_cursor = message_search.search(q, **kwargs)
+        return [msg.id for msg in messages]
+
+    def test_ranking(self):
+        # more of the words matching first; ties newest first
+        self.assertEqual(self.search_ids("way"), [4, 2, 1])
+        self.assertEqual(self.search_ids("WAY"), [4, 2, 1])
+
+    def test_all_words_required(self):
+        self.assertEqual(self.search_ids("way mandalorian"), [1])
+        self.assertEqual(self.search_ids("way grogu"), [])
+        self.assertEqual(self.search_ids(""), [])
+
+    def test_filters(self):
+        self.assertEqual(self.search_ids("way", author_id=self.u1_id), [2, 1])
+        self.assertEqual(self.search_ids("way", follower_id=self.testuser_id), [2, 1])
+        self.assertEqual(self.search_ids("way", follower_id=self.u2_id), [])
+
+    def test_paging(self):
+        seen = []
+        after = None
+        while True:
+            messages, after = message_search.search("way", after=after, per_page=1)
+            seen += [msg.id for msg in messages]
+            if after is None:
+                break
+
+        self.assertEqual(seen, [4, 2, 1])
+
+    def test_paging_through_ties(self):
+        db.session.add_all([Message(id=message_id, text="This is the way", user_id=self.u2_id)
+                            for message_id in range(5, 10)])
+        db.session.commit()
+
+        # (these all rank the same as message 2; the loop is bounded
+        # so a cursor that repeats results fails rather than hangs)
+        seen = []
+        after = None
+        for _ in range(10):
+            messages, after = message_search.search("way", after=after, per_page=2)
+            seen += [msg.id for msg in messages]
+            if after is None:
+                break
+
+        self.assertEqual(seen, [4, 9, 8, 7, 6, 5, 2, 1])
+
+    def test_new_edited_and_deleted_messages(self):
+        self.search_ids("way")
+
+        db.session.add(Message(id=5, text="Which way now", user_id=self.u2_id))
+        Message.query.get(3).text = "Grogu goes his own way"
+        db.session.delete(Message.query.get(4))
+        db.session.commit()
+
+        self.assertEqual(set(self.search_ids("way")), {1, 2, 3, 5})
+        self.assertEqual(self.search_ids("frog"), [])
+
+    def test_search_api(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            resp = c.get("/api/search?q=way&limit=2")
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual([m['id'] for m in resp.json['messages']], [4, 2])
+            # (can't like our own message)
+            self.assertNotIn('liked', resp.json['messages'][0])
+            self.assertFalse(resp.json['messages'][1]['liked'])
+
+            resp = c.get(f"/api/search?q=way&limit=2&after={resp.json['next']}")
+            self.assertEqual([m['id'] for m in resp.json['messages']], [1])
+            self.assertIsNone(resp.json['next'])
+
+            resp = c.get("/api/search?q=way&following=1")
+            self.assertEqual([m['id'] for m in resp.json['messages']], [2, 1])
+
+    def test_search_page(self):
+        resp = self.client.get("/search?q=mandalorian")
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("The way of the Mandalorian", str(resp.data))
+        self.assertNotIn("This is the way", str(resp.data))
+        # (the last page says how far back search goes)
+        self.assertIn("Only the 1,000 most recent matching", str(resp.data))
+
+        resp = self.client.get(f"/search?q=way&author={self.u1_id}")
+        self.assertIn("This is the way", str(resp.data))
+        self.assertNotIn("Way way way", str(resp.data))
+
+    def test_following_needs_login(self):
+        resp = self.client.get("/api/search?q=way&following=1")
+        self.assertEqual(resp.status_code, 401)
+
+        resp = self.client.get("/search?q=way&following=1")
+        self.assertEqual(resp.status_code, 302)
+
+    def test_bad_cursor(self):
+        resp = self.client.get("/api/search?q=way&after=garbage")
+        self.assertEqual(resp.status_code, 400)
+
+        resp = self.client.get("/search?q=way&after=garbage")
+        self.assertEqual(resp.status_code, 400)
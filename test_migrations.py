@@ -0,0 +1,128 @@
+"""Schema migration tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_migrations.py
+
+
+import os
+from datetime import datetime
+from unittest import TestCase
+
+from sqlalchemy import inspect, text
+
+from models import db, User, Message, Likes, TimelineEntry
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+# Now we can import app
+
+from app import app
+import migrations
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class MigrationTestCase(TestCase):
+    """Test migrating empty and first-release databases to the current schema."""
+
+    def setUp(self):
+        db.session.close()
+        db.drop_all()
+
+    def tearDown(self):
+        resp = super().tearDown()
+        db.session.rollback()
+        db.drop_all()
+        db.create_all()
+        return resp
+
+    def run_baseline(self):
+        baseline_version, baseline = migrations.available()[0]
+        with db.engine.begin() as conn:
+            baseline.upgrade(conn)
+            migrations.applied(conn)
+            conn.execute(migrations.schema_migrations.insert().values(
+                version=baseline_version))
+
+    def test_upgrade_matches_models(self):
+        ran = migrations.upgrade(db.engine)
+
+        self.assertEqual(ran, [version for version, _ in migrations.available()])
+        self.assertEqual(migrations.upgrade(db.engine), [])
+
+        inspector = inspect(db.engine)
+        for table in db.metadata.sorted_tables:
+            columns = {column['name'] for column in inspector.get_columns(table.name)}
+            self.assertEqual(columns, set(table.columns.keys()), table.name)
+
+            indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                self.assertIn(index.name, indexes)
+
+    def test_upgrade_existing_data(self):
+        self.run_baseline()
+
+        db.engine.execute(
+            "INSERT INTO users (id, email, username, password) VALUES "
+            "(1, 'a@test.com', 'alice', 'x'), (2, 'b@test.com', 'bob', 'x')")
+        db.engine.execute(
+            "INSERT INTO follows (user_being_followed_id, user_following_id) VALUES (1, 2)")
+        db.engine.execute(
+            text("INSERT INTO messages (id, text, timestamp, user_id) "
+                 "VALUES (1, 'hi', :timestamp, 1)"),
+            timestamp=datetime(2020, 1, 1))
+        db.engine.execute("INSERT INTO likes (user_id, message_id) VALUES (2, 1)")
+
+        migrations.upgrade(db.engine)
+
+        alice = User.query.get(1)
+        bob = User.query.get(2)
+        self.assertEqual((alice.messages_count, alice.followers_count), (1, 1))
+        self.assertEqual((bob.following_count, bob.likes_count), (1, 1))
+        self.assertEqual(Message.query.get(1).likes_count, 1)
+        self.assertEqual(sorted(entry.user_id for entry in TimelineEntry.query), [1, 2])
+
+        if db.engine.dialect.name == 'postgresql':
+            # A second user can now like the same message
+            db.session.add(Likes(user_id=1, message_id=1))
+            db.session.commit()
+
+    def test_remove_self_follows(self):
+        migrations.upgrade(db.engine)
+
+        # (following yourself used to be allowed)
+        db.engine.execute(
+            "INSERT INTO users (id, email, username, password) VALUES "
+            "(1, 'a@test.com', 'alice', 'x')")
+        db.engine.execute(
+            "INSERT INTO follows (user_being_followed_id, user_following_id) VALUES (1, 1)")
+        db.engine.execute("UPDATE users SET following_count = 1, followers_count = 1")
+
+        # Run 0010 again on the data as it now is
+        db.engine.execute(migrations.schema_migrations.delete().where(
+            migrations.schema_migrations.c.version == '0010'))
+        self.assertEqual(migrations.upgrade(db.engine), ['0010'])
+
+        alice = User.query.get(1)
+        self.assertEqual((alice.following_count, alice.followers_count), (0, 0))
+        self.assertEqual(db.engine.execute("SELECT count(*) FROM follows").scalar(), 0)
+
+    def test_stamp(self):
+        db.create_all()
+        migrations.stamp(db.engine)
+
+        self.assertEqual(migrations.upgrade(db.engine), [])
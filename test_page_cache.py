@@ -0,0 +1,154 @@
+"""Anonymous page cache tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_page_cache.py
+
+
+import os
+import threading
+from unittest import TestCase
+
+from sqlalchemy import event
+
+from models import db, User, Message
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+from page_cache import page_cache
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class PageCacheTestCase(TestCase):
+    """Test serving anonymous pages from the page cache."""
+
+    def setUp(self):
+        """Create test client and add sample data"""
+
+        db.drop_all()
+        db.create_all()
+        page_cache.pages.clear()
+
+        self.client = app.test_client()
+
+        self.testuser = User.signup("testuser", "test@test.com", "testuser", None)
+        self.testuser_id = 8989
+        self.testuser.id = self.testuser_id
+        db.session.commit()
+
+        db.session.add(Message(id=1, text="Hello there", user_id=self.testuser_id))
+        db.session.commit()
+
+        self.statements = []
+        event.listen(db.engine, 'before_cursor_execute', self.record_statement)
+
+    def tearDown(self):
+        event.remove(db.engine, 'before_cursor_execute', self.record_statement)
+        resp = super().tearDown()
+        db.session.rollback()
+        return resp
+
+    def record_statement(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def test_anonymous_hit_skips_database(self):
+        first = self.client.get(f"/users/{self.testuser_id}")
+        self.assertNotIn('X-Page-Cache', first.headers)
+
+        self.statements = []
+        second = self.client.get(f"/users/{self.testuser_id}")
+
+        self.assertEqual(second.headers['X-Page-Cache'], 'hit')
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second.headers['Cache-Control'], first.headers['Cache-Control'])
+        self.assertEqual(self.statements, [])
+
+    def test_hit_answers_if_none_match(self):
+        etag = self.client.get("/messages/1").headers['ETag']
+        resp = self.client.get("/messages/1", headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 304)
+
+    def test_logged_in_not_cached(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            c.get(f"/users/{self.testuser_id}")
+            resp = c.get(f"/users/{self.testuser_id}")
+            self.assertNotIn('X-Page-Cache', resp.headers)
+
+    def test_invalidated_on_commit(self):
+        self.client.get(f"/users/{self.testuser_id}")
+        self.client.get("/messages/1")
+        tag = f'user:{self.testuser_id}'
+        version = page_cache.tag_versions.get(tag)
+
+        User.query.get(self.testuser_id).username = "renamed"
+        db.session.flush()
+
+        # Not committed yet: the cached pages are still good
+        self.assertEqual(page_cache.tag_versions.get(tag), version)
+
+        db.session.commit()
+
+        for url in [f"/users/{self.testuser_id}", "/messages/1"]:
+            resp = self.client.get(url)
+            self.assertNotIn('X-Page-Cache', resp.headers)
+            self.assertIn("@renamed", resp.get_data(as_text=True))
+
+    def test_evicted_tag_counts_as_changed(self):
+        max_tags = page_cache.tag_versions.max_size
+        page_cache.tag_versions.max_size = 1
+        try:
+            self.client.get(f"/users/{self.testuser_id}")
+            resp = self.client.get(f"/users/{self.testuser_id}")
+            self.assertEqual(resp.headers['X-Page-Cache'], 'hit')
+
+            # Another page's tag pushes the profile's out
+            self.client.get("/messages/1")
+            self.assertEqual(len(page_cache.tag_versions), 1)
+
+            resp = self.client.get(f"/users/{self.testuser_id}")
+            self.assertNotIn('X-Page-Cache', resp.headers)
+        finally:
+            page_cache.tag_versions.max_size = max_tags
+
+    def test_new_message_invalidates_profile(self):
+        self.client.get(f"/users/{self.testuser_id}")
+
+        db.session.add(Message(id=2, text="Another one", user_id=self.testuser_id))
+        db.session.commit()
+
+        resp = self.client.get(f"/users/{self.testuser_id}")
+        self.assertIn("Another one", resp.get_data(as_text=True))
+
+    def test_concurrent_misses_render_once(self):
+        self.assertTrue(page_cache.start_render('/somewhere?'))
+
+        waited = []
+        waiter = threading.Thread(target=lambda: waited.append(page_cache.start_render('/somewhere?')))
+        waiter.start()
+        waiter.join(0.1)
+        # Still waiting for our render
+        self.assertTrue(waiter.is_alive())
+
+        page_cache.finish_render('/somewhere?')
+        waiter.join()
+        self.assertEqual(waited, [False])
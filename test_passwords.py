@@ -0,0 +1,136 @@
+"""Password hashing tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_passwords.py
+
+
+import os
+import threading
+from types import SimpleNamespace
+from unittest import TestCase
+
+from models import db, User
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+# Now we can import app
+
+from app import app
+from passwords import (passwords, PasswordHasher, PasswordHasherBusy, hash_password, hash_rounds,
+                       calibrate)
+import passwords as passwords_module
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class PasswordHasherTestCase(TestCase):
+    """Test the pooled hasher on its own."""
+
+    def test_pool(self):
+        hasher = PasswordHasher(rounds=4, workers=1, max_pending=2)
+
+        hashed = hasher.hash("hunter2")
+        self.assertEqual(hash_rounds(hashed), 4)
+        self.assertTrue(hasher.check("hunter2", hashed))
+        self.assertFalse(hasher.check("hunter3", hashed))
+        self.assertFalse(hasher.check("hunter2", "not a hash"))
+
+        hasher.pool.shutdown()
+
+    def test_calibrate_ignores_one_slow_sample(self):
+        # Each sample reads the clock twice: 10 ms samples, bar one 1000 ms one
+        ticks = iter([0, 10, 0, 1000, 0, 10, 0, 10, 0, 10])
+
+        real_time = passwords_module.time
+        passwords_module.time = SimpleNamespace(perf_counter=lambda: next(ticks) / 1000)
+        try:
+            rounds = calibrate(target_ms=160, min_rounds=4, sample_rounds=8)
+        finally:
+            passwords_module.time = real_time
+
+        # 10 ms at cost 8 -> 160 ms at cost 12
+        self.assertEqual(rounds, 12)
+
+    def test_busy(self):
+        hasher = PasswordHasher(rounds=4, max_pending=1, wait=0)
+        hasher.slots.acquire()
+
+        with self.assertRaises(PasswordHasherBusy):
+            hasher.hash("hunter2")
+
+        hasher.slots.release()
+        self.assertTrue(hasher.check("hunter2", hasher.hash("hunter2")))
+
+    def test_needs_rehash(self):
+        hasher = PasswordHasher(rounds=12)
+
+        self.assertTrue(hasher.needs_rehash(hash_password("hunter2", 4)))
+        self.assertFalse(hasher.needs_rehash("$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe"))
+
+
+class LoginRehashTestCase(TestCase):
+    """Test login upgrades weak hashes and sheds load when busy."""
+
+    def setUp(self):
+        """Create test client and add sample data"""
+
+        db.drop_all()
+        db.create_all()
+
+        self.client = app.test_client()
+
+        self.testuser = User.signup("testuser", "test@test.com", "testuser", None)
+        self.testuser_id = 8989
+        self.testuser.id = self.testuser_id
+        self.testuser.password = hash_password("testuser", 4)
+
+        db.session.commit()
+
+    def tearDown(self):
+        resp = super().tearDown()
+        db.session.rollback()
+        return resp
+
+    def login(self, c):
+        return c.post("/login", data={"username": "testuser", "password": "testuser"})
+
+    def test_rehash_on_login(self):
+        with self.client as c:
+            resp = self.login(c)
+            self.assertEqual(resp.status_code, 302)
+
+        password = User.query.get(self.testuser_id).password
+        self.assertEqual(hash_rounds(password), passwords.rounds)
+
+        with self.client as c:
+            resp = self.login(c)
+            self.assertEqual(resp.status_code, 302)
+
+        self.assertEqual(User.query.get(self.testuser_id).password, password)
+
+    def test_busy_login(self):
+        slots, wait = passwords.slots, passwords.wait
+        passwords.slots, passwords.wait = threading.BoundedSemaphore(1), 0
+        passwords.slots.acquire()
+
+        try:
+            with self.client as c:
+                resp = self.login(c)
+                self.assertEqual(resp.status_code, 503)
+                self.assertEqual(resp.headers['Retry-After'], '1')
+        finally:
+            passwords.slots, passwords.wait = slots, wait
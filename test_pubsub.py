@@ -0,0 +1,151 @@
+"""Live timeline (pub/sub and Server-Sent Events) tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_pubsub.py
+
+
+import json
+import os
+from unittest import TestCase
+
+from models import db, User, Message
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+from pubsub import broker, message_channel
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class PubSubTestCase(TestCase):
+    """Test publishing new messages to followers' streams."""
+
+    def setUp(self):
+        """Create test client and add sample data"""
+
+        db.drop_all()
+        db.create_all()
+
+        self.client = app.test_client()
+
+        self.testuser = User.signup("testuser", "test@test.com", "testuser", None)
+        self.testuser_id = 8989
+        self.testuser.id = self.testuser_id
+        self.u1 = User.signup("babyyoda", "test1@test.com", "password", None)
+        self.u1_id = 778
+        self.u1.id = self.u1_id
+        self.u2 = User.signup("mando", "test2@test.com", "password", None)
+        self.u2_id = 884
+        self.u2.id = self.u2_id
+
+        self.testuser.following.append(self.u1)
+        db.session.commit()
+
+        self.max_bytes = broker.max_bytes
+        self.heartbeat = broker.heartbeat
+        broker.heartbeat = 0.05
+
+    def tearDown(self):
+        broker.max_bytes = self.max_bytes
+        broker.heartbeat = self.heartbeat
+        resp = super().tearDown()
+        db.session.rollback()
+        return resp
+
+    def post_as(self, user_id, text):
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = user_id
+            c.post("/messages/new", data={"text": text})
+
+    def test_followers_get_new_messages(self):
+        follower = broker.subscribe([message_channel(self.u1_id)])
+        stranger = broker.subscribe([message_channel(self.u2_id)])
+
+        self.post_as(self.u1_id, "Hello followers")
+
+        [(channel, data)] = follower.get(0)
+        self.assertEqual(channel, message_channel(self.u1_id))
+        self.assertEqual(json.loads(data)['text'], "Hello followers")
+        self.assertEqual(json.loads(data)['user']['username'], "babyyoda")
+        self.assertEqual(stranger.get(0), [])
+
+        broker.unsubscribe(follower)
+        broker.unsubscribe(stranger)
+
+    def test_broker_outage_doesnt_fail_post(self):
+        def publish(channel, data):
+            raise ConnectionError("broker is down")
+
+        real_publish = broker.publish
+        broker.publish = publish
+        try:
+            with app.test_client() as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.u1_id
+                resp = c.post("/messages/new", data={"text": "Hello followers"})
+        finally:
+            broker.publish = real_publish
+
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(Message.query.one().text, "Hello followers")
+
+    def test_stream(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            resp = c.get("/stream/timeline")
+            self.assertEqual(resp.mimetype, 'text/event-stream')
+            self.assertEqual(resp.headers['Cache-Control'], 'no-store')
+
+            events = iter(resp.response)
+            self.assertTrue(next(events).startswith(b"retry:"))
+            # Nothing yet
+            self.assertEqual(next(events), b": keepalive\n\n")
+
+            self.post_as(self.u2_id, "Not followed")
+            self.post_as(self.u1_id, "Followed")
+
+            event = next(events)
+            self.assertTrue(event.startswith(b"data: "))
+            self.assertEqual(json.loads(event[len(b"data: "):])['text'], "Followed")
+
+            resp.close()
+            self.assertNotIn(message_channel(self.u1_id), broker.subscriptions)
+
+    def test_stream_unauthorized(self):
+        resp = self.client.get("/stream/timeline")
+        self.assertEqual(resp.status_code, 401)
+
+    def test_slow_consumer_dropped(self):
+        broker.max_bytes = 10
+        subscription = broker.subscribe(['test'])
+        stream = broker.stream(subscription)
+        next(stream)
+
+        broker.publish('test', 'x' * 6)
+        broker.publish('test', 'x' * 6)
+
+        self.assertTrue(subscription.dropped)
+        self.assertEqual(next(stream), "event: dropped\ndata: {}\n\n")
+        with self.assertRaises(StopIteration):
+            next(stream)
+        self.assertNotIn('test', broker.subscriptions)
@@ -0,0 +1,118 @@
+"""Query count tests: pages should cost a fixed number of queries."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_query_counts.py
+
+
+import os
+from unittest import TestCase
+
+from sqlalchemy import event
+
+from models import db, Message, User, Likes, Follows
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import timeline
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class QueryCountTestCase(TestCase):
+    """Test that page query counts don't grow with the rows shown."""
+
+    def setUp(self):
+        """Create test client and add sample data"""
+
+        db.drop_all()
+        db.create_all()
+
+        self.client = app.test_client()
+
+        self.testuser = User.signup("testuser", "test@test.com", "testuser", None)
+        self.testuser_id = 8989
+        self.testuser.id = self.testuser_id
+        db.session.commit()
+
+        self.statements = []
+        event.listen(db.engine, 'before_cursor_execute', self.count_query)
+
+    def tearDown(self):
+        event.remove(db.engine, 'before_cursor_execute', self.count_query)
+        db.session.rollback()
+        return super().tearDown()
+
+    def count_query(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def add_authors(self, count, start):
+        """Add `count` users that testuser follows, each with a liked message."""
+
+        for i in range(start, start + count):
+            author = User.signup(f"author{i}", f"author{i}@test.com", "password", None)
+            author.id = i
+            db.session.add(Message(id=i, text=f"warble {i}", user_id=i))
+            db.session.add(Follows(user_being_followed_id=i, user_following_id=self.testuser_id))
+            db.session.add(Follows(user_being_followed_id=self.testuser_id, user_following_id=i))
+            db.session.add(Likes(user_id=self.testuser_id, message_id=i))
+        db.session.commit()
+        timeline.backfill()
+        db.session.commit()
+
+    def count_queries(self, url):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            # Warm up per-process caches (e.g. the in-process search index)
+            c.get(url)
+
+            self.statements = []
+            resp = c.get(url)
+            self.assertEqual(resp.status_code, 200)
+            return len(self.statements)
+
+    def assert_fixed_query_count(self, url):
+        self.add_authors(1, start=1)
+        few = self.count_queries(url)
+
+        self.add_authors(10, start=100)
+        many = self.count_queries(url)
+
+        self.assertEqual(few, many, f"{url} makes a query per row")
+        return many
+
+    def test_homepage(self):
+        self.assertLessEqual(self.assert_fixed_query_count("/"), 4)
+
+    def test_likes(self):
+        self.assertLessEqual(self.assert_fixed_query_count(f"/users/{self.testuser_id}/likes"), 4)
+
+    def test_followers(self):
+        self.assertLessEqual(self.assert_fixed_query_count(f"/users/{self.testuser_id}/followers"), 4)
+
+    def test_following(self):
+        self.assertLessEqual(self.assert_fixed_query_count(f"/users/{self.testuser_id}/following"), 4)
+
+    def test_users_index(self):
+        self.assertLessEqual(self.assert_fixed_query_count("/users"), 4)
+
+    def test_user_show(self):
+        self.assertLessEqual(self.assert_fixed_query_count(f"/users/{self.testuser_id}"), 4)
@@ -0,0 +1,181 @@
+"""Query plan regression tests (PostgreSQL only)."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_query_plans.py
+
+
+import os
+from unittest import TestCase, skipUnless
+
+from sqlalchemy import event
+
+from models import db, User, Message, Follows, Likes
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import timeline
+import counters
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+@skipUnless(db.engine.dialect.name == 'postgresql', "EXPLAIN output is PostgreSQL's")
+class QueryPlanTestCase(TestCase):
+    """Test that the queries behind hot pages never scan whole tables.
+
+    Each page is requested once to capture the SELECTs it runs, then each
+    one is EXPLAINed with sequential scans disabled: the planner still
+    picks one if no index can answer the query, and that fails the test.
+    """
+
+    def setUp(self):
+        """Create test client and add sample data"""
+
+        db.drop_all()
+        db.create_all()
+
+        self.client = app.test_client()
+
+        # (Not User.signup: hashing 200 passwords would dwarf the test)
+        db.session.add_all([User(id=i, username=f"user{i}", email=f"user{i}@test.com",
+                                 password="not a hash")
+                            for i in range(1, 201)])
+        db.session.flush()
+
+        for i in range(1, 201):
+            for j in range(1, 6):
+                db.session.add(Message(id=i * 10 + j, text=f"warble {i}.{j}", user_id=i))
+            for other in (i % 200 + 1, (i + 6) % 200 + 1):
+                db.session.add(Follows(user_being_followed_id=other, user_following_id=i))
+        db.session.flush()
+
+        for i in range(1, 201):
+            db.session.add(Likes(user_id=i, message_id=(i % 200 + 1) * 10 + 1))
+        db.session.commit()
+
+        timeline.backfill()
+        counters.reconcile()
+        db.session.commit()
+        db.engine.execute("ANALYZE")
+
+        self.user_id = 1
+
+    def tearDown(self):
+        resp = super().tearDown()
+        db.session.rollback()
+        return resp
+
+    def capture_selects(self, url):
+        """Request `url` and get the (statement, parameters) of its SELECTs."""
+
+        captured = []
+
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            if statement.lstrip().upper().startswith('SELECT'):
+                captured.append((statement, parameters))
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+
+            event.listen(db.engine, 'before_cursor_execute', capture)
+            try:
+                resp = c.get(url)
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', capture)
+
+            self.assertEqual(resp.status_code, 200, url)
+
+        return captured
+
+    def assert_no_seq_scans(self, url):
+        raw = db.engine.raw_connection()
+        try:
+            cursor = raw.cursor()
+            cursor.execute("SET enable_seqscan = off")
+
+            for statement, parameters in self.capture_selects(url):
+                cursor.execute("EXPLAIN " + statement, parameters)
+                plan = "\n".join(row[0] for row in cursor.fetchall())
+                self.assertNotIn("Seq Scan", plan, f"{url}:\n{statement}\n{plan}")
+        finally:
+            raw.rollback()
+            raw.close()
+
+    def test_homepage(self):
+        self.assert_no_seq_scans("/")
+
+    def test_timeline_api(self):
+        self.assert_no_seq_scans("/api/timeline")
+
+    def test_timeline_since(self):
+        self.assert_no_seq_scans("/api/timeline/since/1?ids=1")
+
+    def test_user_show(self):
+        self.assert_no_seq_scans(f"/users/{self.user_id}")
+
+    def test_user_messages_api(self):
+        self.assert_no_seq_scans(f"/api/users/{self.user_id}/messages")
+
+    def test_followers(self):
+        self.assert_no_seq_scans(f"/users/{self.user_id}/followers")
+
+    def test_following(self):
+        self.assert_no_seq_scans(f"/users/{self.user_id}/following")
+
+    def test_likes(self):
+        self.assert_no_seq_scans(f"/users/{self.user_id}/likes")
+
+    def test_mentions(self):
+        self.assert_no_seq_scans(f"/api/users/{self.user_id}/mentions")
+
+    def test_like_state(self):
+        self.assert_no_seq_scans("/api/likes/state?ids=21,31,41")
+
+    def test_message_search(self):
+        self.assert_no_seq_scans("/api/search?q=warble")
+        self.assert_no_seq_scans(f"/api/search?q=warble&author={self.user_id}")
+
+    def test_message_search_ranks_candidates_only(self):
+        # ts_rank may only run above the candidates' LIMIT, on at most
+        # MAX_CANDIDATES rows, never on every match the GIN index finds
+        [(statement, parameters)] = [
+            (statement, parameters)
+            for statement, parameters in self.capture_selects("/api/search?q=warble")
+            if 'ts_rank' in statement]
+
+        raw = db.engine.raw_connection()
+        try:
+            cursor = raw.cursor()
+            cursor.execute("EXPLAIN VERBOSE " + statement, parameters)
+            plan = [row[0] for row in cursor.fetchall()]
+        finally:
+            raw.rollback()
+            raw.close()
+
+        candidates_limit = max(i for i, line in enumerate(plan)
+                               if line.lstrip(' ->').startswith('Limit'))
+        ranked = [i for i, line in enumerate(plan) if 'ts_rank' in line]
+        self.assertTrue(ranked)
+        self.assertLess(max(ranked), candidates_limit, "\n".join(plan))
+
+    def test_user_search(self):
+        self.assert_no_seq_scans("/users?q=user1")
+        self.assert_no_seq_scans("/api/users/search?q=ser1")
@@ -0,0 +1,123 @@
+"""Read replica routing tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_replicas.py
+
+
+import os
+import tempfile
+from unittest import TestCase
+
+from sqlalchemy import create_engine
+
+from models import db, User
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import replicas
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class ReplicasTestCase(TestCase):
+    """Test reading from a replica, and users seeing their own writes."""
+
+    def setUp(self):
+        """Create test client and add sample data"""
+
+        db.drop_all()
+        db.create_all()
+
+        self.client = app.test_client()
+
+        self.testuser = User.signup("testuser", "test@test.com", "testuser", None)
+        self.testuser_id = 8989
+        self.testuser.id = self.testuser_id
+        self.u1 = User.signup("babyyoda", "test1@test.com", "password", None)
+        self.u1_id = 778
+        self.u1.id = self.u1_id
+
+        db.session.commit()
+
+        # A "replica" (a SQLite file) that's behind: it only has testuser,
+        # under an old name
+        self.replica_dir = tempfile.TemporaryDirectory()
+        self.replica = create_engine(f"sqlite:///{self.replica_dir.name}/replica.db")
+        db.metadata.create_all(self.replica)
+        self.replica.execute(User.__table__.insert(), {
+            'id': self.testuser_id, 'username': 'oldname', 'email': 'test@test.com',
+            'password': 'x', 'image_url': '/static/images/default-pic.png'})
+
+        app.extensions['db_replicas'] = [self.replica]
+
+    def tearDown(self):
+        app.extensions['db_replicas'] = []
+        self.replica.dispose()
+        self.replica_dir.cleanup()
+        resp = super().tearDown()
+        db.session.rollback()
+        return resp
+
+    def login(self, c):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.testuser_id
+
+    def test_reads_from_replica(self):
+        with self.client as c:
+            self.login(c)
+            resp = c.get(f"/users/{self.testuser_id}/following")
+            self.assertIn("@oldname", resp.get_data(as_text=True))
+
+    def test_sticks_to_primary_after_write(self):
+        with self.client as c:
+            self.login(c)
+            resp = c.post(f"/users/follow/{self.u1_id}")
+            self.assertEqual(resp.status_code, 302)
+
+            with c.session_transaction() as sess:
+                self.assertIn(replicas.PRIMARY_UNTIL_KEY, sess)
+
+            resp = c.get(f"/users/{self.testuser_id}/following")
+            html = resp.get_data(as_text=True)
+            self.assertIn("@testuser", html)
+            self.assertIn("@babyyoda", html)
+
+    def test_primary_again_after_window(self):
+        with self.client as c:
+            self.login(c)
+            with c.session_transaction() as sess:
+                sess[replicas.PRIMARY_UNTIL_KEY] = 0
+
+            resp = c.get(f"/users/{self.testuser_id}/following")
+            self.assertIn("@oldname", resp.get_data(as_text=True))
+
+    def test_writes_in_read_only_view_go_to_primary(self):
+        with app.test_request_context(f"/users/{self.testuser_id}"):
+            app.preprocess_request()
+            self.assertIs(replicas.g.db_replica, self.replica)
+
+            self.assertEqual(User.query.get(self.testuser_id).username, 'oldname')
+            db.session.execute(User.__table__.update()
+                               .where(User.__table__.c.id == self.u1_id)
+                               .values(bio='hi'))
+
+            self.assertIsNone(replicas.g.db_replica)
+            self.assertEqual(User.query.get(self.u1_id).bio, 'hi')
+            db.session.rollback()
@@ -0,0 +1,308 @@
+"""Home timeline tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_timeline.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, Message, User, Follows, TimelineEntry
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import timeline
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class TimelineTestCase(TestCase):
+    """Test fan-out on write timelines."""
+
+    def setUp(self):
+        """Create test client and add sample data"""
+
+        db.drop_all()
+        db.create_all()
+
+        self.client = app.test_client()
+
+        self.testuser = User.signup("testuser", "test@test.com", "testuser", None)
+        self.testuser_id = 8989
+        self.testuser.id = self.testuser_id
+        self.u1 = User.signup("babyyoda", "test1@test.com", "password", None)
+        self.u1_id = 778
+        self.u1.id = self.u1_id
+        self.u2 = User.signup("mando", "test2@test.com", "password", None)
+        self.u2_id = 884
+        self.u2.id = self.u2_id
+
+        db.session.commit()
+
+    def tearDown(self):
+        resp = super().tearDown()
+        db.session.rollback()
+        return resp
+
+    def timeline_ids(self, user_id):
+        messages, next_cursor = timeline.home_messages(user_id)
+        return [m.id for m in messages]
+
+    def login(self, c, user_id):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def test_post_fans_out_to_followers(self):
+        db.session.add(Follows(user_being_followed_id=self.u1_id,
+                               user_following_id=self.testuser_id))
+        db.session.commit()
+
+        with self.client as c:
+            self.login(c, self.u1_id)
+            resp = c.post("/messages/new", data={"text": "This is the way."})
+            self.assertEqual(resp.status_code, 302)
+
+        msg = Message.query.one()
+        self.assertEqual(self.timeline_ids(self.u1_id), [msg.id])
+        self.assertEqual(self.timeline_ids(self.testuser_id), [msg.id])
+        self.assertEqual(self.timeline_ids(self.u2_id), [])
+
+    def test_delete_removes_from_timelines(self):
+        db.session.add(Follows(user_being_followed_id=self.u1_id,
+                               user_following_id=self.testuser_id))
+        db.session.commit()
+
+        with self.client as c:
+            self.login(c, self.u1_id)
+            c.post("/messages/new", data={"text": "This is the way."})
+            msg = Message.query.one()
+
+            resp = c.post(f"/messages/{msg.id}/delete")
+            self.assertEqual(resp.status_code, 302)
+
+        self.assertEqual(TimelineEntry.query.count(), 0)
+
+    def test_follow_and_unfollow(self):
+        m = Message(text="I have spoken.", user_id=self.u2_id)
+        db.session.add(m)
+        db.session.commit()
+        m_id = m.id
+        timeline.backfill()
+        db.session.commit()
+
+        with self.client as c:
+            self.login(c, self.testuser_id)
+
+            c.post(f"/users/follow/{self.u2_id}")
+            self.assertEqual(self.timeline_ids(self.testuser_id), [m_id])
+
+            resp = c.get("/")
+            self.assertIn("I have spoken.", str(resp.data))
+
+            c.post(f"/users/stop-following/{self.u2_id}")
+            self.assertEqual(self.timeline_ids(self.testuser_id), [])
+
+    def test_follow_self(self):
+        with self.client as c:
+            self.login(c, self.u1_id)
+            resp = c.post(f"/users/follow/{self.u1_id}")
+            self.assertEqual(resp.status_code, 403)
+
+        self.assertEqual(Follows.query.count(), 0)
+
+    def test_post_with_existing_self_follow(self):
+        # (follows like this were allowed before; posting must still work)
+        db.session.add(Follows(user_being_followed_id=self.u1_id,
+                               user_following_id=self.u1_id))
+        db.session.commit()
+
+        with self.client as c:
+            self.login(c, self.u1_id)
+            resp = c.post("/messages/new", data={"text": "This is the way."})
+            self.assertEqual(resp.status_code, 302)
+
+        msg = Message.query.one()
+        self.assertEqual(self.timeline_ids(self.u1_id), [msg.id])
+
+        timeline.backfill()
+        db.session.commit()
+        self.assertEqual(self.timeline_ids(self.u1_id), [msg.id])
+
+    def test_backfill(self):
+        m1 = Message(text="grogu wait", user_id=self.u1_id)
+        m2 = Message(text="this is the way", user_id=self.u2_id)
+        db.session.add_all([m1, m2])
+        db.session.add(Follows(user_being_followed_id=self.u1_id,
+                               user_following_id=self.testuser_id))
+        db.session.commit()
+
+        count = timeline.backfill()
+        db.session.commit()
+
+        # one entry per author plus one for the follower of u1
+        self.assertEqual(count, 3)
+        self.assertEqual(self.timeline_ids(self.testuser_id), [m1.id])
+        self.assertEqual(self.timeline_ids(self.u2_id), [m2.id])
+
+    def test_fan_out_loaded(self):
+        old = Message(id=1, text="grogu wait", user_id=self.u1_id)
+        db.session.add(old)
+        db.session.commit()
+        timeline.backfill()
+        db.session.commit()
+
+        # Loaded behind the ORM's back: a new user who follows u1, and a new
+        # message by u2 (whom testuser already follows)
+        db.session.add(Follows(user_being_followed_id=self.u2_id,
+                               user_following_id=self.testuser_id))
+        db.session.commit()
+        db.session.execute(User.__table__.insert().values(
+            id=9000, email="new@test.com", username="din", password="x"))
+        db.session.execute(Follows.__table__.insert().values(
+            user_being_followed_id=self.u1_id, user_following_id=9000))
+        db.session.execute(Message.__table__.insert().values(
+            id=2, text="this is the way", user_id=self.u2_id))
+        db.session.commit()
+
+        self.assertEqual(timeline.fan_out_loaded(self.testuser_id, 1), 3)
+        db.session.commit()
+
+        self.assertEqual(self.timeline_ids(9000), [1])
+        self.assertEqual(self.timeline_ids(self.u2_id), [2])
+        self.assertEqual(self.timeline_ids(self.testuser_id), [2])
+        self.assertEqual(timeline.head(9000), 1)
+        self.assertEqual(timeline.head(self.testuser_id), 2)
+
+    def test_api_timeline_pages(self):
+        with self.client as c:
+            self.login(c, self.u1_id)
+            for i in range(5):
+                c.post("/messages/new", data={"text": f"warble {i}"})
+
+            resp = c.get("/api/timeline?limit=2")
+            self.assertEqual(resp.status_code, 200)
+            page = resp.json
+            self.assertEqual([m['text'] for m in page['messages']],
+                             ["warble 4", "warble 3"])
+
+            seen = [m['text'] for m in page['messages']]
+            while page['next']:
+                page = c.get(f"/api/timeline?limit=2&before={page['next']}").json
+                seen.extend(m['text'] for m in page['messages'])
+
+            self.assertEqual(seen, [f"warble {i}" for i in range(4, -1, -1)])
+
+    def test_api_timeline_bad_cursor(self):
+        with self.client as c:
+            self.login(c, self.u1_id)
+            resp = c.get("/api/timeline?before=yesterday")
+            self.assertEqual(resp.status_code, 400)
+
+    def test_api_timeline_unauthorized(self):
+        with self.client as c:
+            resp = c.get("/api/timeline")
+            self.assertEqual(resp.status_code, 401)
+
+    def test_timeline_head(self):
+        db.session.add(Follows(user_being_followed_id=self.u1_id,
+                               user_following_id=self.testuser_id))
+        db.session.commit()
+
+        with self.client as c:
+            self.login(c, self.u1_id)
+            c.post("/messages/new", data={"text": "This is the way."})
+
+        msg = Message.query.one()
+        self.assertEqual(timeline.head(self.u1_id), msg.id)
+        self.assertEqual(timeline.head(self.testuser_id), msg.id)
+        self.assertIsNone(timeline.head(self.u2_id))
+
+        # Following someone brings their newest message in
+        with self.client as c:
+            self.login(c, self.u2_id)
+            c.post(f"/users/follow/{self.u1_id}")
+        self.assertEqual(timeline.head(self.u2_id), msg.id)
+
+        # (and backfilling agrees)
+        timeline.backfill()
+        db.session.commit()
+        self.assertEqual(timeline.head(self.u2_id), msg.id)
+
+    def test_timeline_version(self):
+        def version(user_id):
+            return db.session.query(User.timeline_version).filter_by(id=user_id).scalar()
+
+        with self.client as c:
+            self.login(c, self.testuser_id)
+            c.post(f"/users/follow/{self.u1_id}")
+            self.assertEqual(version(self.testuser_id), 1)
+
+            # A followed author's profile edit changes how the timeline looks
+            self.login(c, self.u1_id)
+            c.post("/users/profile", data={"username": "grogu",
+                                           "email": "test1@test.com",
+                                           "password": "password"})
+            self.assertEqual(version(self.testuser_id), 2)
+            self.assertEqual(version(self.u2_id), 0)
+
+            # New messages move the head instead; deleting one is a change
+            c.post("/messages/new", data={"text": "This is the way."})
+            msg = Message.query.one()
+            self.assertEqual(version(self.testuser_id), 2)
+            c.post(f"/messages/{msg.id}/delete")
+            self.assertEqual(version(self.testuser_id), 3)
+
+            self.login(c, self.testuser_id)
+            c.post(f"/users/stop-following/{self.u1_id}")
+            self.assertEqual(version(self.testuser_id), 4)
+
+    def test_api_timeline_since(self):
+        db.session.add(Follows(user_being_followed_id=self.u1_id,
+                               user_following_id=self.testuser_id))
+        db.session.commit()
+
+        with self.client as c:
+            self.login(c, self.u1_id)
+            c.post("/messages/new", data={"text": "first"})
+            first_id = Message.query.one().id
+
+            self.login(c, self.testuser_id)
+            resp = c.get(f"/api/timeline/since/{first_id}")
+            self.assertEqual(resp.status_code, 304)
+
+            self.login(c, self.u1_id)
+            c.post("/messages/new", data={"text": "second"})
+            c.post("/messages/new", data={"text": "third"})
+            new_ids = sorted((m.id for m in Message.query.filter(Message.id > first_id)),
+                             reverse=True)
+
+            self.login(c, self.testuser_id)
+            resp = c.get(f"/api/timeline/since/{first_id}")
+            self.assertEqual(resp.json, {'count': 2, 'head': new_ids[0]})
+
+            resp = c.get(f"/api/timeline/since/{first_id}?ids=1&limit=1")
+            self.assertEqual(resp.json['ids'], new_ids[:1])
+
+            resp = c.get(f"/api/timeline/since/{new_ids[0]}")
+            self.assertEqual(resp.status_code, 304)
+
+    def test_api_timeline_since_unauthorized(self):
+        resp = self.client.get("/api/timeline/since/1")
+        self.assertEqual(resp.status_code, 401)
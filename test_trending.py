@@ -0,0 +1,131 @@
+"""Trending hashtags/mentions and mentions index tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_trending.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Mention
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+from trending import (trends, hashtags_in, mentions_in, CountMinSketch, TopK,
+                      TrendingWindow)
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class TrendingTestCase(TestCase):
+    """Test counting hashtags and mentions, and listing a user's mentions."""
+
+    def setUp(self):
+        """Create test client and add sample data"""
+
+        db.drop_all()
+        db.create_all()
+        trends.init_app(app)
+
+        self.client = app.test_client()
+
+        self.testuser = User.signup("testuser", "test@test.com", "testuser", None)
+        self.testuser_id = 8989
+        self.testuser.id = self.testuser_id
+        self.u1 = User.signup("babyyoda", "test1@test.com", "password", None)
+        self.u1_id = 778
+        self.u1.id = self.u1_id
+
+        db.session.commit()
+
+    def tearDown(self):
+        resp = super().tearDown()
+        db.session.rollback()
+        return resp
+
+    def post(self, text):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+            c.post("/messages/new", data={"text": text})
+
+    def test_parsing(self):
+        text = "#Grogu says hi to @babyyoda and @nobody (#grogu!) me@example.com a#b"
+        self.assertEqual(hashtags_in(text), ["grogu"])
+        self.assertEqual(mentions_in(text), ["babyyoda", "nobody"])
+
+    def test_sketch_never_undercounts(self):
+        sketch = CountMinSketch(width=16, depth=3)
+        for n in range(100):
+            for _ in range(n % 7):
+                sketch.add(f"key{n}")
+
+        for n in range(100):
+            self.assertGreaterEqual(sketch.estimate(f"key{n}"), n % 7)
+
+    def test_top_k(self):
+        top = TopK(2)
+        for key, count in [("a", 1), ("b", 2), ("c", 3), ("a", 4)]:
+            top.offer(key, count)
+
+        self.assertEqual(sorted(top.keys()), ["a", "c"])
+
+    def test_window_slides(self):
+        window = TrendingWindow(bucket_seconds=10, buckets=3)
+        window.add("old", when=0)
+        window.add("new", when=25)
+        window.add("new", when=29)
+
+        self.assertEqual(window.top(5, now=29), [("new", 2), ("old", 1)])
+        # 30s later the first bucket is out of the window, and its slot reused
+        window.add("newest", when=30)
+        self.assertEqual(window.top(5, now=30), [("new", 2), ("newest", 1)])
+        self.assertEqual(len(window.ring), 3)
+
+    def test_posting_counts_and_indexes(self):
+        self.post("Hello @babyyoda #grogu")
+        self.post("#Grogu again, @babyyoda and @nobody")
+        self.post("#other")
+
+        msg_ids = [m.id for m in Message.query.order_by(Message.id)]
+        self.assertEqual(sorted((m.user_id, m.message_id) for m in Mention.query),
+                         [(self.u1_id, msg_ids[0]), (self.u1_id, msg_ids[1])])
+
+        resp = self.client.get("/api/trending")
+        self.assertEqual(resp.json['hashtags'],
+                         [{'tag': 'grogu', 'count': 2}, {'tag': 'other', 'count': 1}])
+        self.assertEqual(resp.json['mentions'],
+                         [{'id': self.u1_id, 'username': 'babyyoda', 'count': 2}])
+        self.assertIn('max-age', resp.headers['Cache-Control'])
+
+    def test_mentions_pages(self):
+        self.post("Hello @babyyoda")
+        self.post("Not for you")
+
+        resp = self.client.get(f"/users/{self.u1_id}/mentions")
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("Hello @babyyoda", str(resp.data))
+        self.assertNotIn("Not for you", str(resp.data))
+
+        resp = self.client.get(f"/api/users/{self.u1_id}/mentions")
+        self.assertEqual([m['text'] for m in resp.json['messages']], ["Hello @babyyoda"])
+
+        resp = self.client.get("/users/12345/mentions")
+        self.assertEqual(resp.status_code, 404)
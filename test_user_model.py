@@ -102,6 +102,30 @@ class UserModelTestCase(TestCase):
         # Test when user1 is not followed by user2
         self.assertFalse(self.u1.is_followed_by(self.u2))
 
+    def test_follow_states(self):
+        """Does follow_states report follow state for a batch of users?"""
+
+        self.u.following.append(self.u2)
+        db.session.commit()
+
+        self.assertEqual(self.u.follow_states([self.u1, self.u2]),
+                         {self.u1.id: False, self.u2.id: True})
+
+    def test_following_ids_invalidated(self):
+        """Do cached following ids notice follows and unfollows?"""
+
+        self.assertEqual(self.u.following_ids, frozenset())
+
+        self.u.following.append(self.u1)
+        self.assertTrue(self.u.is_following(self.u1))
+        self.assertTrue(self.u1.is_followed_by(self.u))
+
+        db.session.commit()
+        self.assertEqual(self.u.following_ids, {self.u1.id})
+
+        self.u.following.remove(self.u1)
+        self.assertFalse(self.u.is_following(self.u1))
+
     def test_create_user(self):
         """Does User.create successfully create a new user given valid credentials?"""
 
@@ -0,0 +1,127 @@
+"""User search tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_user_search.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+# Now we can import app
+
+from app import app
+import user_search
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class UserSearchTestCase(TestCase):
+    """Test ranked, cursor-paged username search."""
+
+    def setUp(self):
+        """Create test client and add sample data"""
+
+        db.drop_all()
+        db.create_all()
+
+        self.client = app.test_client()
+
+        usernames = ["mando", "Mandalorian", "the_mandalorian", "armando",
+                     "grogu", "man_of_steel", "manxcat"]
+        for i, username in enumerate(usernames):
+            user = User.signup(username, f"test{i}@test.com", "password", None)
+            user.id = 900 + i
+
+        db.session.commit()
+
+    def tearDown(self):
+        resp = super().tearDown()
+        db.session.rollback()
+        return resp
+
+    def usernames(self, users):
+        return [user.username for user in users]
+
+    def test_ranking(self):
+        users, next_cursor = user_search.search("MAND")
+
+        # prefix matches (A-Z) before names that only contain the query
+        self.assertEqual(self.usernames(users),
+                         ["Mandalorian", "mando", "armando", "the_mandalorian"])
+        self.assertIsNone(next_cursor)
+
+        # an exact match is the first prefix match
+        users, _ = user_search.search("mando")
+        self.assertEqual(self.usernames(users), ["mando", "armando"])
+
+    def test_short_queries_only_match_prefixes(self):
+        users, _ = user_search.search("ma")
+
+        self.assertEqual(self.usernames(users),
+                         ["man_of_steel", "Mandalorian", "mando", "manxcat"])
+
+    def test_like_wildcards_are_literal(self):
+        users, _ = user_search.search("man_")
+
+        self.assertEqual(self.usernames(users), ["man_of_steel"])
+
+    def test_paging(self):
+        seen = []
+        after = None
+        while True:
+            users, after = user_search.search("mand", after=after, per_page=1)
+            seen += self.usernames(users)
+            if after is None:
+                break
+
+        self.assertEqual(seen, ["Mandalorian", "mando", "armando", "the_mandalorian"])
+
+    def test_new_and_renamed_users_found(self):
+        user_search.search("gro")
+
+        user = User.query.get(904)
+        user.username = "baby_yoda"
+        User.signup("grogu2", "grogu2@test.com", "password", None)
+        db.session.commit()
+
+        self.assertEqual(self.usernames(user_search.search("gro")[0]), ["grogu2"])
+        self.assertEqual(self.usernames(user_search.search("yoda")[0]), ["baby_yoda"])
+
+    def test_typeahead_api(self):
+        with self.client as c:
+            resp = c.get("/api/users/search?q=mand&limit=2")
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual([user['username'] for user in resp.json['users']],
+                             ["Mandalorian", "mando"])
+
+            resp = c.get(f"/api/users/search?q=mand&limit=2&after={resp.json['next']}")
+            self.assertEqual([user['username'] for user in resp.json['users']],
+                             ["armando", "the_mandalorian"])
+            self.assertIsNone(resp.json['next'])
+
+    def test_bad_cursor(self):
+        with self.client as c:
+            resp = c.get("/api/users/search?q=mand&after=garbage")
+            self.assertEqual(resp.status_code, 400)
+
+            resp = c.get("/users?q=mand&after=garbage")
+            self.assertEqual(resp.status_code, 400)
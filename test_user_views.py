@@ -95,6 +95,21 @@ class UserViewTestCase(TestCase):
 
             self.assertIn("@grogu", str(resp.data))
 
+    def test_user_messages_api(self):
+        msgs = [Message(text=f"warble {i}", user_id=self.u3_id) for i in range(3)]
+        db.session.add_all(msgs)
+        db.session.commit()
+
+        with self.client as c:
+            resp = c.get(f"/api/users/{self.u3_id}/messages?limit=2")
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(len(resp.json['messages']), 2)
+            self.assertIsNotNone(resp.json['next'])
+
+            resp = c.get(f"/api/users/{self.u3_id}/messages?before={resp.json['next']}")
+            self.assertEqual(len(resp.json['messages']), 1)
+            self.assertIsNone(resp.json['next'])
+
     def setup_likes(self):
         msg1 = Message(text="this is the way", user_id=self.testuser_id)
         msg2 = Message(text="grogu wait", user_id=self.testuser_id)
@@ -176,6 +191,23 @@ class UserViewTestCase(TestCase):
             # the like has been deleted
             self.assertEqual(len(likes), 0)
 
+    def test_like_state_api(self):
+        self.setup_likes()
+
+        with self.client as c:
+            resp = c.get("/api/likes/state?ids=926,1")
+            self.assertEqual(resp.status_code, 401)
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            resp = c.get("/api/likes/state?ids=926,1")
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.json, {'liked': [926]})
+
+            resp = c.get("/api/likes/state?ids=926,grogu")
+            self.assertEqual(resp.status_code, 400)
+
     def test_unauthenticated_like(self):
         self.setup_likes()
 
@@ -241,6 +273,20 @@ class UserViewTestCase(TestCase):
             self.assertNotIn("@grogu", str(resp.data))
             self.assertNotIn("@testing", str(resp.data))
 
+    def test_users_index_follow_buttons(self):
+
+        self.setup_followers()
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            resp = c.get("/users")
+            soup = BeautifulSoup(resp.get_data(as_text=True), 'html.parser')
+            unfollows = soup.find_all("form", {"action": f"/users/stop-following/{self.u1_id}"})
+            follows = soup.find_all("form", {"action": f"/users/follow/{self.u3_id}"})
+            self.assertEqual(len(unfollows), 1)
+            self.assertEqual(len(follows), 1)
+
     def test_show_followers(self):
 
         self.setup_followers()
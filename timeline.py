@@ -0,0 +1,239 @@
+"""Materialized home timelines for Warbler (fan-out on write).
+
+Every message is copied into the `timeline_entries` table of its author and
+of each of the author's followers when it is posted. Reading a home page is
+then one indexed range scan over `(user_id, timestamp)` instead of an
+IN-list over everyone the user follows.
+
+Each user's row also keeps `timeline_head_id`, the newest message id their
+timeline has had, so asking "anything new since message N?" is a primary
+key lookup. It only ever moves forward: after an unfollow or a deletion it
+can be ahead of the timeline, which costs a poll a count that finds
+nothing, never a missed message. `timeline_version` is bumped whenever the
+timeline changes in any other way: follows and unfollows, deleted messages,
+and the profile edits of authors it shows (whose names and avatars it
+displays). Together the two say whether a home page is still current.
+
+All of these functions only add statements to the current session; the
+caller commits, so timelines change in the same transaction as the
+messages/follows they mirror.
+"""
+
+from sqlalchemy import select, literal, union_all, or_, func
+from sqlalchemy.orm import joinedload
+
+from models import db, User, Follows, Message, TimelineEntry
+from pagination import paginate
+
+users = User.__table__
+entries = TimelineEntry.__table__
+messages = Message.__table__
+follows = Follows.__table__
+
+ENTRY_COLUMNS = ['user_id', 'message_id', 'timestamp']
+
+
+def fan_out(message):
+    """Push a newly-posted `message` onto its author's and followers' timelines.
+
+    The message must already be flushed so it has an id.
+    """
+
+    to_author = (select([messages.c.user_id, messages.c.id, messages.c.timestamp])
+                 .where(messages.c.id == message.id))
+
+    to_followers = (select([follows.c.user_following_id,
+                            messages.c.id,
+                            messages.c.timestamp])
+                    .where(messages.c.id == message.id)
+                    .where(follows.c.user_being_followed_id == messages.c.user_id)
+                    .where(follows.c.user_following_id != messages.c.user_id))
+
+    db.session.execute(entries.insert().from_select(
+        ENTRY_COLUMNS, union_all(to_author, to_followers)))
+
+    followers = (select([follows.c.user_following_id])
+                 .where(follows.c.user_being_followed_id == message.user_id))
+
+    advance_heads(or_(users.c.id == message.user_id, users.c.id.in_(followers)), message.id)
+
+
+def advance_heads(which_users, message_id):
+    """Move the timeline heads of the users matching `which_users` up to `message_id`.
+
+    (`message_id` may be a scalar subquery; if it's NULL nothing changes.)
+    """
+
+    db.session.execute(users.update()
+                       .where(which_users)
+                       .where(func.coalesce(users.c.timeline_head_id, 0) < message_id)
+                       .values(timeline_head_id=message_id))
+
+
+def bump_versions(which_users):
+    """Note that the timelines of the users matching `which_users` changed."""
+
+    db.session.execute(users.update()
+                       .where(which_users)
+                       .values(timeline_version=users.c.timeline_version + 1))
+
+
+def remove_message(message):
+    """Remove a deleted `message` from every timeline it was pushed to."""
+
+    bump_versions(users.c.id.in_(select([entries.c.user_id])
+                                 .where(entries.c.message_id == message.id)))
+    db.session.execute(entries.delete().where(entries.c.message_id == message.id))
+
+
+def author_changed(user_id):
+    """Note that `user_id` changed how their messages look (name, avatar).
+
+    That changes their own timeline and those of their followers.
+    """
+
+    followers = (select([follows.c.user_following_id])
+                 .where(follows.c.user_being_followed_id == user_id))
+    bump_versions(or_(users.c.id == user_id, users.c.id.in_(followers)))
+
+
+def follow(user_id, followed_id):
+    """Copy the messages of `followed_id` into the timeline of `user_id`.
+
+    A user's own messages are always in their timeline, so following
+    yourself is refused (by add_follow) rather than copied here.
+    """
+
+    followed_messages = (select([literal(user_id),
+                                 messages.c.id,
+                                 messages.c.timestamp])
+                         .where(messages.c.user_id == followed_id))
+
+    db.session.execute(entries.insert().from_select(ENTRY_COLUMNS, followed_messages))
+
+    newest = (select([func.max(messages.c.id)])
+              .where(messages.c.user_id == followed_id)
+              .as_scalar())
+    advance_heads(users.c.id == user_id, newest)
+    bump_versions(users.c.id == user_id)
+
+
+def unfollow(user_id, followed_id):
+    """Drop the messages of `followed_id` from the timeline of `user_id`."""
+
+    followed_messages = select([messages.c.id]).where(messages.c.user_id == followed_id)
+
+    db.session.execute(entries.delete()
+                       .where(entries.c.user_id == user_id)
+                       .where(entries.c.message_id.in_(followed_messages)))
+    bump_versions(users.c.id == user_id)
+
+
+def home_messages(user_id, before=None, per_page=100):
+    """Return a page of the home timeline of `user_id`, newest first.
+
+    Returns `(messages, next_cursor)`; see `pagination.paginate`.
+    """
+
+    # Authors come back in the same query, since every message shows one
+    query = (Message
+             .query
+             .join(TimelineEntry, TimelineEntry.message_id == Message.id)
+             .filter(TimelineEntry.user_id == user_id)
+             .options(joinedload(Message.user)))
+
+    return paginate(query, TimelineEntry.timestamp, TimelineEntry.message_id,
+                    before=before, per_page=per_page)
+
+
+def head(user_id):
+    """Get the id of the newest message the timeline of `user_id` has had (or None)."""
+
+    return db.session.execute(select([users.c.timeline_head_id])
+                              .where(users.c.id == user_id)).scalar()
+
+
+def since(user_id, message_id, limit):
+    """Count the messages after `message_id` in the timeline of `user_id`.
+
+    Returns `(count, ids)`: how many there are, and the ids of up to
+    `limit` of them, newest first. Messages are "after" if they were
+    posted later (have higher ids), whatever their timestamps.
+    """
+
+    newer = (entries.c.user_id == user_id) & (entries.c.message_id > message_id)
+
+    count = db.session.execute(select([func.count()]).where(newer)).scalar()
+    ids = [] if not limit else [
+        entry_id for (entry_id,) in db.session.execute(
+            select([entries.c.message_id])
+            .where(newer)
+            .order_by(entries.c.message_id.desc())
+            .limit(limit))]
+
+    return count, ids
+
+
+def fan_out_loaded(after_user_id, after_message_id):
+    """Add bulk-loaded rows to timelines without rebuilding them all.
+
+    For when messages with ids above `after_message_id` and follows
+    involving users with ids above `after_user_id` have been added behind
+    the ORM's back (as by `seed.py --append`): new messages go to their
+    authors' and followers' timelines, and new follows bring in the older
+    messages of whoever was followed. Returns the number of entries written.
+    """
+
+    new_message = messages.c.id > after_message_id
+    new_follow = or_(follows.c.user_following_id > after_user_id,
+                     follows.c.user_being_followed_id > after_user_id)
+
+    own_messages = (select([messages.c.user_id, messages.c.id, messages.c.timestamp])
+                    .where(new_message))
+
+    followed_messages = (select([follows.c.user_following_id,
+                                 messages.c.id,
+                                 messages.c.timestamp])
+                         .where(follows.c.user_being_followed_id == messages.c.user_id)
+                         .where(follows.c.user_following_id != messages.c.user_id))
+
+    written = db.session.execute(entries.insert().from_select(
+        ENTRY_COLUMNS, union_all(own_messages,
+                                 followed_messages.where(new_message),
+                                 followed_messages.where(new_follow).where(~new_message)))
+    ).rowcount
+
+    changed = or_(users.c.id.in_(select([entries.c.user_id])
+                                 .where(entries.c.message_id > after_message_id)),
+                  users.c.id.in_(select([follows.c.user_following_id]).where(new_follow)))
+    advance_heads(changed, (select([func.max(entries.c.message_id)])
+                            .where(entries.c.user_id == users.c.id)
+                            .as_scalar()))
+
+    return written
+
+
+def backfill():
+    """Rebuild every home timeline (and timeline head) from the `follows`
+    and `messages` tables.
+
+    Returns the number of timeline entries written.
+    """
+
+    own_messages = select([messages.c.user_id, messages.c.id, messages.c.timestamp])
+
+    followed_messages = (select([follows.c.user_following_id,
+                                 messages.c.id,
+                                 messages.c.timestamp])
+                         .where(follows.c.user_being_followed_id == messages.c.user_id)
+                         .where(follows.c.user_following_id != messages.c.user_id))
+
+    db.session.execute(entries.delete())
+    db.session.execute(entries.insert().from_select(
+        ENTRY_COLUMNS, union_all(own_messages, followed_messages)))
+    db.session.execute(users.update().values(
+        timeline_head_id=(select([func.max(entries.c.message_id)])
+                          .where(entries.c.user_id == users.c.id)
+                          .as_scalar())))
+
+    return db.session.query(TimelineEntry).count()
@@ -0,0 +1,212 @@
+"""Trending #hashtags and @mentions, and the mentions index.
+
+When a message is posted, its #hashtags and the users it @mentions are
+counted here, over a sliding window of the last `TRENDING_BUCKETS` time
+buckets of `TRENDING_BUCKET_SECONDS` each (an hour, by default).
+
+Every bucket has a count-min sketch, which estimates how often any key
+came up in fixed memory (never too low, and only a little too high), and
+a heap of its top `TRENDING_TOP_K` keys. Buckets are kept in a ring, and
+one is cleared and reused as it falls out of the window. So memory stays
+the same however many messages come through. What's trending is then
+the keys in any bucket's heap, ranked by their estimated counts summed
+over the window.
+
+The counts live in each process's memory: they start empty when it
+starts, and each process counts only the messages it was posted through
+(each of several workers sees a sample of them).
+
+Mentions are also written to the `mentions` table, in the same
+transaction as the message, so a user's mentions are a range scan over it
+rather than a search through every message's text.
+"""
+
+import hashlib
+import heapq
+import re
+import threading
+import time
+from array import array
+
+from models import db, User, Mention
+
+HASHTAG = re.compile(r'(?<!\w)#(\w+)')
+MENTION = re.compile(r'(?<!\w)@(\w+)')
+
+mentions = Mention.__table__
+
+
+def hashtags_in(text):
+    """The distinct #hashtags in `text`, lowercased."""
+
+    return sorted({tag.lower() for tag in HASHTAG.findall(text)})
+
+
+def mentions_in(text):
+    """The distinct usernames @mentioned in `text`."""
+
+    return sorted(set(MENTION.findall(text)))
+
+
+def add_mentions(message):
+    """Index the users `message` @mentions. Returns their ids.
+
+    The message must already be flushed so it has an id.
+    """
+
+    names = mentions_in(message.text)
+    if not names:
+        return []
+
+    user_ids = [user_id for (user_id,) in (db.session
+                                           .query(User.id)
+                                           .filter(User.username.in_(names)))]
+    if user_ids:
+        db.session.execute(mentions.insert(), [
+            {'user_id': user_id, 'message_id': message.id, 'timestamp': message.timestamp}
+            for user_id in user_ids])
+
+    return user_ids
+
+
+##############################################################################
+# Counting
+
+
+class CountMinSketch:
+    """Approximate counts of any number of keys, in `depth` rows of `width` counters.
+
+    A key adds to one counter in each row, picked by hashing it, and its
+    estimate is the smallest of those: never less than its true count, and
+    more only by what keys sharing all its counters added.
+    """
+
+    def __init__(self, width, depth):
+        self.width = width
+        self.depth = depth
+        self.rows = [array('q', bytes(8 * width)) for _ in range(depth)]
+
+    def cells(self, key):
+        digest = hashlib.blake2b(str(key).encode('utf-8'), digest_size=4 * self.depth).digest()
+        return [int.from_bytes(digest[4 * i:4 * i + 4], 'little') % self.width
+                for i in range(self.depth)]
+
+    def add(self, key, count=1):
+        """Count `key`. Returns its new estimate."""
+
+        estimate = None
+        for row, cell in zip(self.rows, self.cells(key)):
+            row[cell] += count
+            estimate = row[cell] if estimate is None else min(estimate, row[cell])
+        return estimate
+
+    def estimate(self, key):
+        return min(row[cell] for row, cell in zip(self.rows, self.cells(key)))
+
+
+class TopK:
+    """The `k` keys with the highest counts offered, as a min-heap of [count, key]."""
+
+    def __init__(self, k):
+        self.k = k
+        self.heap = []
+        self.entries = {}
+
+    def offer(self, key, count):
+        entry = self.entries.get(key)
+
+        if entry is not None:
+            entry[0] = count
+            heapq.heapify(self.heap)
+        elif len(self.heap) < self.k:
+            self.entries[key] = entry = [count, key]
+            heapq.heappush(self.heap, entry)
+        elif count > self.heap[0][0]:
+            self.entries[key] = entry = [count, key]
+            evicted = heapq.heapreplace(self.heap, entry)
+            del self.entries[evicted[1]]
+
+    def keys(self):
+        return self.entries.keys()
+
+
+class Bucket:
+    """The counts of one time bucket (number `number` since the epoch)."""
+
+    def __init__(self, number, width, depth, k):
+        self.number = number
+        self.sketch = CountMinSketch(width, depth)
+        self.top = TopK(k)
+
+
+class TrendingWindow:
+    """The most frequent keys over the last `buckets` time buckets."""
+
+    def __init__(self, bucket_seconds=300, buckets=12, width=2048, depth=4, k=50):
+        self.bucket_seconds = bucket_seconds
+        self.sizes = (width, depth, k)
+        self.ring = [Bucket(None, *self.sizes) for _ in range(buckets)]
+        self.lock = threading.Lock()
+
+    def add(self, key, when=None):
+        """Count `key` in the bucket of time `when` (default now)."""
+
+        number = int((time.time() if when is None else when) // self.bucket_seconds)
+        slot = number % len(self.ring)
+
+        with self.lock:
+            bucket = self.ring[slot]
+            if bucket.number != number:
+                if bucket.number is not None and bucket.number > number:
+                    return  # fell out of the window already
+                bucket = self.ring[slot] = Bucket(number, *self.sizes)
+
+            bucket.top.offer(key, bucket.sketch.add(key))
+
+    def top(self, n, now=None):
+        """Get the `n` most frequent keys in the window ending `now`, as (key, count)."""
+
+        current = int((time.time() if now is None else now) // self.bucket_seconds)
+
+        with self.lock:
+            live = [bucket for bucket in self.ring
+                    if bucket.number is not None
+                    and current - len(self.ring) < bucket.number <= current]
+            candidates = {key for bucket in live for key in bucket.top.keys()}
+            counts = [(key, sum(bucket.sketch.estimate(key) for bucket in live))
+                      for key in candidates]
+
+        counts.sort(key=lambda item: (-item[1], str(item[0])))
+        return counts[:n]
+
+
+class Trends:
+    """Trending hashtags, and most-mentioned users (by id)."""
+
+    def __init__(self):
+        self.hashtags = TrendingWindow()
+        self.mentions = TrendingWindow()
+
+    def init_app(self, app):
+        """Size the windows from `app.config`."""
+
+        settings = {
+            'bucket_seconds': app.config.setdefault('TRENDING_BUCKET_SECONDS', 300),
+            'buckets': app.config.setdefault('TRENDING_BUCKETS', 12),
+            'width': app.config.setdefault('TRENDING_SKETCH_WIDTH', 2048),
+            'depth': app.config.setdefault('TRENDING_SKETCH_DEPTH', 4),
+            'k': app.config.setdefault('TRENDING_TOP_K', 50),
+        }
+        self.hashtags = TrendingWindow(**settings)
+        self.mentions = TrendingWindow(**settings)
+
+    def count(self, text, mentioned_ids, when=None):
+        """Count a message's hashtags (from its `text`) and mentioned users."""
+
+        for tag in hashtags_in(text):
+            self.hashtags.add(tag, when)
+        for user_id in mentioned_ids:
+            self.mentions.add(user_id, when)
+
+
+trends = Trends()
@@ -0,0 +1,279 @@
+"""Username search for the /users page and the search box typeahead.
+
+Results come in two ranked tiers:
+
+1. usernames that start with the query (an exact match sorts first),
+2. usernames that merely contain it (only for queries of at least
+   `MIN_SUBSTRING_LENGTH` characters, which is what a trigram index can
+   narrow down).
+
+Within a tier, results are in (lowercased username, id) order, so a page
+ends with a cursor of (tier, username, id) and the next page continues
+after it; an empty query is tier 1 for everyone, i.e. all users A-Z.
+
+On PostgreSQL, tier 1 is a range scan over a "C"-collated btree index on
+`lower(username)` and tier 2 is answered by a pg_trgm GIN index; both are
+created along with the `users` table. Other databases (SQLite in
+development) get `UsernameIndex`, an in-process prefix + trigram index
+loaded on first use and kept up to date by User mapper events.
+"""
+
+import base64
+import json
+import threading
+from bisect import bisect_left, bisect_right, insort
+
+from sqlalchemy import DDL, event, func, literal_column, tuple_, and_
+
+from models import db, User
+
+PREFIX = 1
+SUBSTRING = 2
+MIN_SUBSTRING_LENGTH = 3
+
+# Not backslash, which databases disagree about escaping in string literals
+LIKE_ESCAPE = '!'
+
+users = User.__table__
+
+# lower(username), compared byte-wise so the btree index serves both
+# `LIKE 'prefix%'` and the ORDER BY
+sort_key = func.lower(User.username).op('COLLATE')(literal_column('"C"'))
+
+event.listen(users, 'after_create', DDL(
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm'
+).execute_if(dialect='postgresql'))
+event.listen(users, 'after_create', DDL(
+    'CREATE INDEX ix_users_username_lower_c ON users (lower(username) COLLATE "C")'
+).execute_if(dialect='postgresql'))
+event.listen(users, 'after_create', DDL(
+    'CREATE INDEX ix_users_username_trgm ON users USING gin (lower(username) gin_trgm_ops)'
+).execute_if(dialect='postgresql'))
+
+
+##############################################################################
+# Cursors
+
+
+def encode_cursor(tier, name, user_id):
+    """Build an opaque cursor for a result at (`tier`, `name`, `user_id`)."""
+
+    raw = json.dumps([tier, name, user_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Turn a cursor string back into a (tier, name, id) tuple.
+
+    Raises ValueError if the cursor is malformed.
+    """
+
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        tier, name, user_id = json.loads(raw)
+    except (TypeError, UnicodeDecodeError, json.JSONDecodeError, ValueError) as exc:
+        raise ValueError(f"Bad cursor: {cursor!r}") from exc
+
+    if tier not in (PREFIX, SUBSTRING) or not isinstance(name, str) \
+            or not isinstance(user_id, int):
+        raise ValueError(f"Bad cursor: {cursor!r}")
+
+    return tier, name, user_id
+
+
+##############################################################################
+# Searching
+
+
+def search(q, after=None, per_page=20):
+    """Find users whose username matches `q`, best matches first.
+
+    `after` is a cursor from a previous page (or None for the first page).
+    Returns `(users, next_cursor)`; `next_cursor` is None on the last page.
+    """
+
+    q = (q or '').strip().lower()
+    finder = find_in_db if is_postgres() else local_index.find
+
+    tiers = [PREFIX]
+    if len(q) >= MIN_SUBSTRING_LENGTH:
+        tiers.append(SUBSTRING)
+
+    start_tier, start = PREFIX, None
+    if after:
+        start_tier, name, user_id = decode_cursor(after)
+        start = (name, user_id)
+
+    # Grab one extra result so we know whether there's another page
+    found = []
+    for tier in tiers:
+        if tier < start_tier:
+            continue
+        found += finder(tier, q, start if tier == start_tier else None,
+                        per_page + 1 - len(found))
+        if len(found) > per_page:
+            break
+
+    next_cursor = None
+    if len(found) > per_page:
+        found = found[:per_page]
+        next_cursor = encode_cursor(*found[-1])
+
+    by_id = {user.id: user
+             for user in User.query.filter(User.id.in_([uid for _, _, uid in found]))}
+
+    return [by_id[uid] for _, _, uid in found if uid in by_id], next_cursor
+
+
+def is_postgres():
+    return db.session.get_bind().dialect.name == 'postgresql'
+
+
+def escape_like(text):
+    """Escape LIKE wildcards in `text` with LIKE_ESCAPE."""
+
+    return (text
+            .replace(LIKE_ESCAPE, LIKE_ESCAPE * 2)
+            .replace('%', LIKE_ESCAPE + '%')
+            .replace('_', LIKE_ESCAPE + '_'))
+
+
+def find_in_db(tier, q, after, limit):
+    """Get up to `limit` (tier, name, id) matches in `tier` after `after`."""
+
+    pattern = escape_like(q)
+
+    if tier == PREFIX:
+        matching = sort_key.like(pattern + '%', escape=LIKE_ESCAPE)
+    else:
+        name = func.lower(User.username)
+        matching = and_(name.like('%' + pattern + '%', escape=LIKE_ESCAPE),
+                        ~name.like(pattern + '%', escape=LIKE_ESCAPE))
+
+    query = db.session.query(sort_key, User.id).filter(matching)
+
+    if after:
+        query = query.filter(tuple_(sort_key, User.id) > tuple_(*after))
+
+    return [(tier, name, user_id)
+            for name, user_id in query.order_by(sort_key, User.id).limit(limit)]
+
+
+##############################################################################
+# In-process index (for databases without pg_trgm)
+
+
+def trigrams(name):
+    return {name[i:i + 3] for i in range(len(name) - 2)}
+
+
+class UsernameIndex:
+    """Prefix + trigram index over every username, held in memory.
+
+    `names` is a sorted list of (lowercased username, id), so a prefix is a
+    bisect; `postings` maps each trigram to the ids whose name contains it,
+    so a substring is an intersection of a few sets.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.names = []
+        self.by_id = {}
+        self.postings = {}
+
+    def reset(self):
+        """Forget everything; it's reloaded on next use."""
+
+        with self.lock:
+            self.loaded = False
+            self.names = []
+            self.by_id = {}
+            self.postings = {}
+
+    def load(self):
+        rows = db.session.query(User.id, User.username).all()
+
+        with self.lock:
+            self.names = sorted((username.lower(), user_id) for user_id, username in rows)
+            self.by_id = {user_id: name for name, user_id in self.names}
+            self.postings = {}
+            for name, user_id in self.names:
+                for gram in trigrams(name):
+                    self.postings.setdefault(gram, set()).add(user_id)
+            self.loaded = True
+
+    def add(self, user_id, username):
+        with self.lock:
+            if not self.loaded:
+                return
+            self._remove(user_id)
+            name = username.lower()
+            insort(self.names, (name, user_id))
+            self.by_id[user_id] = name
+            for gram in trigrams(name):
+                self.postings.setdefault(gram, set()).add(user_id)
+
+    def remove(self, user_id):
+        with self.lock:
+            if self.loaded:
+                self._remove(user_id)
+
+    def _remove(self, user_id):
+        name = self.by_id.pop(user_id, None)
+        if name is None:
+            return
+        del self.names[bisect_left(self.names, (name, user_id))]
+        for gram in trigrams(name):
+            self.postings[gram].discard(user_id)
+
+    def find(self, tier, q, after, limit):
+        """Get up to `limit` (tier, name, id) matches in `tier` after `after`."""
+
+        if not self.loaded:
+            self.load()
+
+        with self.lock:
+            if tier == PREFIX:
+                start = bisect_right(self.names, after) if after else \
+                    bisect_left(self.names, (q,))
+                found = []
+                for name, user_id in self.names[start:start + limit]:
+                    if not name.startswith(q):
+                        break
+                    found.append((tier, name, user_id))
+                return found
+
+            candidates = None
+            for gram in sorted(trigrams(q), key=lambda gram: len(self.postings.get(gram, ()))):
+                ids = self.postings.get(gram, set())
+                candidates = ids.copy() if candidates is None else candidates & ids
+                if not candidates:
+                    return []
+
+            matches = sorted((self.by_id[user_id], user_id) for user_id in candidates)
+
+        matches = [(name, user_id) for name, user_id in matches
+                   if q in name and not name.startswith(q)
+                   and (after is None or (name, user_id) > tuple(after))]
+        return [(tier, name, user_id) for name, user_id in matches[:limit]]
+
+
+local_index = UsernameIndex()
+
+
+@event.listens_for(User, 'after_insert')
+@event.listens_for(User, 'after_update')
+def index_user(mapper, connection, user):
+    local_index.add(user.id, user.username)
+
+
+@event.listens_for(User, 'after_delete')
+def unindex_user(mapper, connection, user):
+    local_index.remove(user.id)
+
+
+@event.listens_for(users, 'after_create')
+@event.listens_for(users, 'after_drop')
+def reset_index(target, connection, **kw):
+    local_index.reset()